@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# benchconfig.py - configuration file loading benchmark
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# Generates a synthetic corpus of old-style and Armbian-NG configuration files
+# in a temporary directory and times loading all of them with ngconfig: cold
+# (empty cache), warm (on-disk cache, as in a new build.py run) and hot
+# (in-memory cache), compared with a plain shlex parse of the old-style files.
+#
+# Usage: python3 benchmarks/benchconfig.py [number of files]
+
+import os
+import sys
+import time
+import shlex
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ngconfig
+
+def makecorpus(directory, count):
+    # Writes count configuration files, one in four in the Armbian-NG format
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'board%05d.conf' % i)
+        with open(path, 'w') as f:
+            if i % 4 == 0:
+                f.write('# This is an Armbian-NG configuration file\n[build]\n')
+                f.write('board = board%05d\nrelease = bionic\nbuild_desktop = no\n' % i)
+                f.write('[distcc]\npool = 10.0.0.%d/4 ${build:board}\n' % (i % 250))
+            else:
+                f.write('# board configuration %d\n' % i)
+                f.write('BOARD_NAME="Board %d"\nBOARDFAMILY="family%d"\n' % (i, i % 20))
+                f.write('KERNEL_TARGET="legacy,current,dev"\nBOOTCONFIG="board%d_defconfig"\n' % i)
+                for j in range(20):
+                    f.write('VAR%d="${BOARDFAMILY}-%d" # comment\n' % (j, j))
+                f.write('write_uboot_platform()\n{\n\tdd if=$1 of=$2 bs=1k seek=8\n}\n')
+        paths.append(path)
+    return paths
+
+def timeload(paths, cachedir):
+    start = time.perf_counter()
+    for path in paths:
+        ngconfig.loadconfig([path], cachedir)
+    return time.perf_counter() - start
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, 'corpus'))
+        paths = makecorpus(os.path.join(directory, 'corpus'), count)
+        cachedir = os.path.join(directory, 'cache')
+
+        start = time.perf_counter()
+        for path in paths:
+            with open(path) as f:
+                shlex.split(f.read(), comments=True)
+        shlextime = time.perf_counter() - start
+
+        cold = timeload(paths, cachedir)
+        ngconfig.memorycache.clear()
+        warm = timeload(paths, cachedir)
+        hot = timeload(paths, cachedir)
+
+    print('%d configuration files' % count)
+    print('shlex.split only:     %.3f s' % shlextime)
+    print('ngconfig, cold cache: %.3f s' % cold)
+    print('ngconfig, disk cache: %.3f s' % warm)
+    print('ngconfig, in memory:  %.3f s' % hot)
+
+if __name__ == '__main__':
+    main()
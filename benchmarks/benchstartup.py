@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# benchstartup.py - startup latency benchmark for build.py
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# Runs a non-interactive build.py (--dryrun) several times and checks that the
+# median wall-clock time stays under a fixed budget. Also checks that importing
+# build.py does not load the user interface and banner packages.
+#
+# Usage: python3 benchmarks/benchstartup.py [budget in seconds]
+
+import os
+import sys
+import time
+import statistics
+import subprocess
+
+budget = 1.0        # seconds, for a whole non-interactive build.py run
+runs = 10
+lazymodules = ['npyscreen', 'pyfiglet', 'clint', 'curses', 'ngtui', 'asyncio', 'urllib.request']
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timecommand(command):
+    # Returns the median wall-clock time of command over runs runs
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=topdir, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def loadedmodules():
+    # Returns the lazy modules that importing build.py loads
+    return subprocess.run([sys.executable, '-c',
+                           'import sys, build; print(" ".join(m for m in ' + repr(lazymodules) + ' if m in sys.modules))'],
+                          cwd=topdir, stdout=subprocess.PIPE, check=True).stdout.decode().split()
+
+def main():
+    limit = float(sys.argv[1]) if len(sys.argv) > 1 else budget
+
+    interpreter = timecommand([sys.executable, '-c', 'pass'])
+    dryrun = timecommand([sys.executable, 'build.py', '--dryrun'])
+    print('Python interpreter startup: %.3f s' % interpreter)
+    print('build.py --dryrun:          %.3f s (budget %.3f s)' % (dryrun, limit))
+
+    loaded = loadedmodules()
+    if loaded:
+        print('Importing build.py loads', ', '.join(loaded), 'which should only be loaded when used')
+
+    if dryrun > limit or loaded:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
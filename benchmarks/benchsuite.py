@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# benchsuite.py - benchmark suite of the Python side of the build, with regression checks
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# Times the Python code that runs at scale in a build, on synthetic inputs in a
+# temporary directory (no board, network or root access needed):
+#
+#	startup     importing build.py and ngsupportfunc, build.py --dryrun
+#	boards      gettargets() over a boards directory of thousands of files
+#	config      loading old-style and Armbian-NG configuration files
+#	artifacts   hashing and compressing an image file
+#	image       assembling a sparse SD card image from sparse filesystem images
+#
+# The results are written to a JSON file. Given the results of an earlier run
+# (e.g. of the previous release, on the same host) with -b, every metric is
+# compared with it using the tolerances of benchmarks/thresholds.json. Metrics
+# marked "scaled" there depend on the input sizes, and are only compared with
+# a baseline run with the same -s scale. thresholds.json also sets absolute
+# limits for some metrics, measured on the host whose calibration time it
+# records: they are scaled by how much slower the calibration runs here, so
+# that a slower host (e.g. an Aarch64 board booting from an SD card) gets
+# proportionally higher limits. The exit status is 1 when a metric regressed,
+# so the suite can gate a release.
+#
+# Usage: python3 benchmarks/benchsuite.py [-o results.json] [-b baseline.json] [-s scale] [benchmark...]
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+import benchconfig
+import benchstartup
+
+topdir = benchstartup.topdir
+sys.path.insert(0, topdir)
+
+defaultthresholds = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+defaultresults = os.path.join(topdir, 'output', 'benchmarks.json')
+runs = 5
+
+def median(function, count=runs):
+    # Returns the median wall-clock time of count calls of function
+    times = []
+    for i in range(count):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def calibrate():
+    # Returns the median time of a fixed pure Python workload, a measure of the host speed
+    data = [{'board': 'board%05d' % i, 'family': 'family%d' % (i % 40), 'value': str(i) * 8} for i in range(20000)]
+    return median(lambda: sorted(json.loads(json.dumps(data)), key=lambda d: d['value']))
+
+def importtime(module):
+    # Returns the median time to import module in a new interpreter, without the interpreter startup
+    code = 'import time; start = time.perf_counter(); import ' + module + '; print(time.perf_counter() - start)'
+    times = [float(subprocess.run([sys.executable, '-c', code], cwd=topdir, stdout=subprocess.PIPE,
+                                  check=True).stdout) for i in range(runs)]
+    return statistics.median(times)
+
+def writesparse(path, size, extents):
+    # Writes a sparse file of size bytes with extents (offset, length) of pseudo-random data
+    with open(path, 'wb') as f:
+        f.truncate(size)
+        for offset, length in extents:
+            f.seek(offset)
+            f.write(os.urandom(length))
+
+def runstartup(scale, workdir):
+    benchstartup.runs = runs
+    return {
+        'startup.import_build': (importtime('build'), 's'),
+        'startup.import_ngsupportfunc': (importtime('ngsupportfunc'), 's'),
+        'startup.dryrun': (benchstartup.timecommand([sys.executable, 'build.py', '--dryrun']), 's'),
+        'startup.lazy_modules_loaded': (len(benchstartup.loadedmodules()), 'modules'),
+        }
+
+def runboards(scale, workdir):
+    import ngboards
+    import ngsupportfunc
+    count = int(5000 * scale)
+    directory = os.path.join(workdir, 'armbian-bench', 'build', 'config', 'boards')
+    os.makedirs(directory)
+    tiers = list(ngboards.boardtiers)
+    for i in range(count):
+        with open(os.path.join(directory, 'board%05d.%s' % (i, tiers[i % len(tiers)])), 'w') as f:
+            f.write('# synthetic board %d\nBOARD_NAME="Board %d"\nBOARDFAMILY="family%d"\n' % (i, i, i % 40))
+            f.write('BOOTCONFIG="board%d_defconfig"\nKERNEL_TARGET="legacy,current,dev"\n' % i)
+            f.write('FULL_DESKTOP="yes"\nMODULES="g_serial"\nMODULES_BLACKLIST="lima"\n')
+    cwd = os.getcwd()
+    os.chdir(workdir)      # gettargets() works on armbian-<branch>/ and cache/ in the current directory
+    try:
+        def gettargets():
+            ngboards.catalogs.clear()
+            return ngsupportfunc.gettargets('bench')
+        start = time.perf_counter()
+        targets = gettargets()
+        cold = time.perf_counter() - start
+        warm = median(gettargets)
+        with open(os.path.join(directory, 'board00000.conf'), 'a') as f:
+            f.write('HAS_VIDEO_OUTPUT="no"\n')
+        start = time.perf_counter()
+        gettargets()
+        changed = time.perf_counter() - start
+        hot = median(lambda: ngsupportfunc.gettargets('bench'))
+    finally:
+        os.chdir(cwd)
+    if len(targets) != count:
+        raise RuntimeError('gettargets() returned %d boards instead of %d' % (len(targets), count))
+    return {
+        'boards.count': (count, 'boards'),
+        'boards.gettargets_cold': (cold, 's'),
+        'boards.gettargets_indexed': (warm, 's'),
+        'boards.gettargets_one_changed': (changed, 's'),
+        'boards.gettargets_loaded': (hot, 's'),
+        }
+
+def runconfig(scale, workdir):
+    import ngconfig
+    count = int(3000 * scale)
+    os.mkdir(os.path.join(workdir, 'corpus'))
+    paths = benchconfig.makecorpus(os.path.join(workdir, 'corpus'), count)
+    ngpaths = [path for i, path in enumerate(paths) if i % 4 == 0]
+    bashpaths = [path for i, path in enumerate(paths) if i % 4 != 0]
+    cachedir = os.path.join(workdir, 'configcache')
+    ngconfig.memorycache.clear()
+    bashcold = benchconfig.timeload(bashpaths, cachedir)
+    ngcold = benchconfig.timeload(ngpaths, cachedir)
+    ngconfig.memorycache.clear()
+    warm = benchconfig.timeload(paths, cachedir)
+    hot = benchconfig.timeload(paths, cachedir)
+    ngconfig.memorycache.clear()
+    return {
+        'config.bash_cold_per_file': (bashcold / len(bashpaths), 's'),
+        'config.ng_cold_per_file': (ngcold / len(ngpaths), 's'),
+        'config.disk_cache_per_file': (warm / count, 's'),
+        'config.memory_cache_per_file': (hot / count, 's'),
+        }
+
+def runartifacts(scale, workdir):
+    import ngcache
+    import ngcompress
+    size = int(256 * 1024 ** 2 * scale)
+    path = os.path.join(workdir, 'artifact.img')
+    # a quarter random data, the rest zeros and repeated text: compresses like a real image
+    block = os.urandom(256 * 1024) + b'\0' * (512 * 1024) + b'Armbian-NG synthetic image\n' * 9709
+    with open(path, 'wb') as f:
+        for i in range(size // len(block)):
+            f.write(block)
+    size = os.path.getsize(path)
+    results = {'artifacts.hash_sha256': (size / median(lambda: ngcache.hashfile(path)) / 1000000, 'MB/s')}
+    for name in ngcompress.compressors:
+        if shutil.which(ngcompress.compressors[name][0][0]) is None:
+            print(name, 'not found, skipping its compression benchmark')
+            continue
+        manifest = ngcompress.compressimage(path, (name,), {name: 3})
+        results['artifacts.compress_' + name] = (manifest['mbps'], 'MB/s')
+    return results
+
+def runimage(scale, workdir):
+    import ngimage
+    # a boot and a root filesystem image, mostly holes, as made by mkfs and populated
+    bootsize = 256 * 1024 ** 2
+    rootsize = int(4 * 1024 ** 3 * scale)
+    chunk = 4 * 1024 ** 2
+    # a sixteenth of the root filesystem is data, in 64 extents
+    boot = os.path.join(workdir, 'boot.fs')
+    root = os.path.join(workdir, 'root.fs')
+    loader = os.path.join(workdir, 'u-boot.bin')
+    writesparse(boot, bootsize, [(0, chunk), (bootsize // 2, chunk)])
+    writesparse(root, rootsize, [(offset, rootsize // 1024) for offset in range(0, rootsize, rootsize // 64)])
+    writesparse(loader, 700 * 1024, [(0, 700 * 1024)])
+    image = os.path.join(workdir, 'sdcard.img')
+    seconds = median(lambda: ngimage.assembleimage(image, [(boot, 'fat32'), (root, 'linux')],
+                                                   [(loader, 8 * 1024)]))
+    allocated = os.stat(image).st_blocks * 512
+    return {
+        'image.assemble': (seconds, 's'),
+        'image.assemble_apparent_size': (os.path.getsize(image) / seconds / 1000000, 'MB/s'),
+        'image.allocated_fraction': (allocated / os.path.getsize(image), 'ratio'),
+        }
+
+benchmarks = {
+    'startup': runstartup,
+    'boards': runboards,
+    'config': runconfig,
+    'artifacts': runartifacts,
+    'image': runimage,
+    }
+
+def gitcommit():
+    result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=topdir, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    return result.stdout.decode().strip() if result.returncode == 0 else None
+
+def limitfactor(calibration, thresholds):
+    # Returns how much slower than the host of the absolute limits this host is,
+    # never below 1: the limits are not tightened on faster hosts
+    reference = thresholds.get('calibration')
+    if not reference or not calibration:
+        return 1.0
+    return max(calibration / reference, 1.0)
+
+def compare(metrics, baseline, thresholds, samescale=True, factor=1.0):
+    # Returns the list of regressions of metrics, against the absolute limits of
+    # thresholds, time limits scaled by factor (see limitfactor()), and, for
+    # metrics in baseline, against baseline with its tolerance. Without samescale,
+    # the metrics marked "scaled" in thresholds are not compared with baseline.
+    regressions = []
+    for name, (value, unit) in sorted(metrics.items()):
+        threshold = thresholds['metrics'].get(name, {})
+        higher = threshold.get('better', 'lower' if unit == 's' else 'higher') == 'higher'
+        timed = unit == 's' or unit.endswith('/s')
+        if 'max' in threshold:
+            limit = threshold['max'] * factor if timed else threshold['max']
+            if value > limit:
+                regressions.append('%s is %.6g %s, above the limit of %.6g' % (name, value, unit, limit))
+        if 'min' in threshold:
+            limit = threshold['min'] / factor if timed else threshold['min']
+            if value < limit:
+                regressions.append('%s is %.6g %s, below the limit of %.6g' % (name, value, unit, limit))
+        if name not in baseline or not baseline[name]['value']:
+            continue
+        if threshold.get('scaled') and not samescale:
+            continue
+        tolerance = threshold.get('tolerance', thresholds['tolerance'])
+        before = baseline[name]['value']
+        change = (before - value) / before if higher else (value - before) / before
+        if change > tolerance:
+            regressions.append('%s is %.6g %s, %d%% worse than %.6g (tolerance %d%%)' %
+                               (name, value, unit, 100 * change, before, 100 * tolerance))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(prog='benchsuite.py', description='Armbian-NG benchmark suite')
+    parser.add_argument('benchmarks', nargs='*', help="Benchmarks to run: " + ', '.join(benchmarks) + " (default: all)")
+    parser.add_argument('--output', '-o', default=defaultresults, help="Results JSON file to write")
+    parser.add_argument('--baseline', '-b', default=None, help="Results JSON file of an earlier run to compare with")
+    parser.add_argument('--thresholds', '-t', default=defaultthresholds, help="Tolerances and limits JSON file")
+    parser.add_argument('--scale', '-s', type=float, default=1.0, help="Size of the synthetic inputs, 0.1 for a quick run")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error('unknown benchmark ' + name)
+
+    with open(args.thresholds) as f:
+        thresholds = json.load(f)
+    baseline = {}
+    samescale = True
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print('The baseline was run with scale', baseline.get('scale'), 'instead of', args.scale,
+                  'only the per file and throughput metrics compare')
+            samescale = False
+        baseline = baseline['metrics']
+
+    calibration = calibrate()
+    factor = limitfactor(calibration, thresholds)
+    print('Calibration: %.6g s, absolute time limits scaled by %.3g' % (calibration, factor))
+
+    metrics = {}
+    for name in args.benchmarks or list(benchmarks):
+        print('Running the', name, 'benchmark...')
+        workdir = tempfile.mkdtemp(prefix='armbian-ng-bench-')
+        try:
+            metrics.update(benchmarks[name](args.scale, workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    for name, (value, unit) in sorted(metrics.items()):
+        print('    %-36s %12.6g %s' % (name, value, unit))
+
+    results = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': gitcommit(), 'scale': args.scale,
+               'calibration': calibration,
+               'python': platform.python_version(), 'machine': platform.machine(), 'cores': os.cpu_count(),
+               'metrics': dict((name, {'value': value, 'unit': unit}) for name, (value, unit) in metrics.items())}
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('Results written to', args.output)
+
+    regressions = compare(metrics, baseline, thresholds, samescale, factor)
+    for regression in regressions:
+        print('Regression:', regression)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -17,10 +17,18 @@
 import os
 import sys
 import subprocess
-import time
 import argparse
 
 import ngsupportfunc    # various functions used by main() below
+import ngstages         # build pipeline stages and their dependencies
+import ngcache          # cache of kernel, u-boot and rootfs build artifacts
+import ngconfig         # configuration file loader
+import ngmatrix         # build matrix mode
+import ngtelemetry      # per-stage timing and resource sampling
+import ngrunner         # runs commands with their output logged
+import ngstate          # checkpoints to resume a failed build
+import ngprofile        # host resources and automatic tuning
+import ngworkspace      # build trees in RAM when the host has memory to spare
 
 ngversion = "0.05"
 
@@ -28,21 +36,42 @@ def main():
 
     print("Welcome to Armbian-NG!")
     
-    # Start stopwatch
-    start = time.time()
+    # Start stopwatch, times every stage of the build
+    telemetry = ngtelemetry.ngTelemetry()
     
     # Parse command line
     args = ngsupportfunc.parsecommandline(ngversion)
     print(args.armbianbranch,args.configfile,args.distcc) # temporarily print command line arguments, for debugging
     
-    # Check the underlying architecture, must be Aarch64, if not, print message and exit
-    ngsupportfunc.checkarch()
+    # Declare the build stages, in dry-run mode just show the plan and exit
+    # (a build matrix needs the board catalog of an earlier armbian-build checkout)
+    if args.matrix:
+        targets = ngmatrix.readmatrix(args.matrix)
+        pipeline = ngmatrix.buildmatrixpipeline(args.armbianbranch, targets, args.configfile) if args.dryrun else None
+    else:
+        pipeline = ngstages.buildpipeline()
+    if args.dryrun:
+        pipeline.dryrun()
+        sys.exit(0)
     
-    # Install needed Python 3 packages
-    ngsupportfunc.installmodules()
+    # Log the output of all commands to output/logs/build.log, and some of it to the terminal
+    ngrunner.setuplogging(args.verbose)
     
-    # Check build host Linux distribution
-    ngsupportfunc.checklinuxdistro()
+    # Sample CPU, memory, disk and network use while we build
+    telemetry.startsampling()
+    
+    with telemetry.span('host-checks', 'setup'):
+        # Check the underlying architecture, must be Aarch64, if not, print message and exit
+        ngsupportfunc.checkarch()
+        
+        # Install needed Python 3 packages
+        ngsupportfunc.installmodules()
+        
+        # Check build host Linux distribution
+        ngsupportfunc.checklinuxdistro()
+        
+        # Cores, memory and storage available to the build
+        profile = ngprofile.hostprofile('.')
 
     # Display Armbian-NG banner
     ngsupportfunc.printbanner()
@@ -50,31 +79,92 @@ def main():
     # Tell user we are getting started
     ngsupportfunc.armbianngmsg('Armbian-NG started!')
     
+    # Read the user configuration file, if it exists
+    config = ngconfig.loadconfig([args.configfile])
+    
+    # Checkpoints of the previous build, to resume it
+    state = ngstate.ngBuildState()
+    if args.resume and not state.load():
+        ngsupportfunc.armbianngmsg('No previous build to resume, starting a new build')
+        args.resume = False
+    
     # Git clone the selected armbian-build branch in /armbian-<branchname>
-    ngsupportfunc.armbianngmsg('Cloning armbian-build, '+ args.armbianbranch + ' branch, please wait...')
-    ngsupportfunc.clonearmbianbranch(args.armbianbranch)
+    # (a resumed build keeps the checkout of the previous build)
+    armbianbuild = "armbian-" + args.armbianbranch + "/build"
+    if args.resume and os.path.isdir(armbianbuild):
+        ngsupportfunc.armbianngmsg('Resuming build, keeping the armbian-build checkout in ' + armbianbuild)
+    else:
+        ngsupportfunc.armbianngmsg('Cloning armbian-build, '+ args.armbianbranch + ' branch, please wait...')
+        with telemetry.span('clone-armbian-build', 'setup'):
+            ngsupportfunc.clonearmbianbranch(args.armbianbranch, config['ARMBIAN_BUILD_URL'])
     
     # Make modules in lib visible
     sys.path.append('./lib/')
     
-    # Get build options from user
-    options = ngsupportfunc.dialog(ngversion)
+    # Kernel and u-boot sources are downloaded in the background as soon as a
+    # board and kernel branch are known, while the build goes on
+    import ngsources
+    sources = ngsources.ngSourceFetcher(config['DOWNLOAD_CONCURRENCY'])
+    def fetchsources(board, kernelbranch):
+        sources.start(ngsources.targetsources(args.armbianbranch, board, kernelbranch, args.configfile))
+    
+    if args.matrix:
+        # No user interface, each target has its own options and configuration
+        pipeline = ngmatrix.buildmatrixpipeline(args.armbianbranch, targets, args.configfile)
+        for target in targets:
+            fetchsources(target[0], target[1])
+        options = None
+    elif args.resume and state.options:
+        # Same options as the build we resume
+        options = state.options
+        fetchsources(options['board'], options['kernelbranch'])
+    else:
+        # Get build options from user, sources start downloading during the last choices
+        with telemetry.span('user-interface', 'setup'):
+            options = ngsupportfunc.dialog(ngversion, args.armbianbranch, onbranch=fetchsources)
+        fetchsources(options['board'], options['kernelbranch'])
+    
+    # Merge the board, board family and user configuration files
+    # (a build matrix loads the configuration of each target in its stages)
+    if options is not None:
+        config = ngconfig.loadconfig(ngconfig.configlayers(args.armbianbranch, options['board'], args.configfile),
+                                     variables={'BRANCH': options['kernelbranch']})
+    
+    # Derive make -j, compressor threads, concurrent stages and tmpfs use from the
+    # host profile, unless set in the configuration or on the command line
+    tuning = ngprofile.tune(profile, config)
+    if args.parallelstages:
+        tuning['parallelstages'] = args.parallelstages
+    ngprofile.report(profile, tuning)
     
-#    import armbian-ng-functions
-#    check-requirements()
-#    build-kernel()
-#    build-u-boot()
-#    build-rootfs()
-#    build-boot()
-#    build-image()
-#    cleanup()
+    # Run the build stages, independent stages (e.g. kernel and rootfs) run in parallel
+    cache = None if args.nocache else ngcache.ngArtifactCache(maxsize=config['ARTIFACT_CACHE_SIZE'] * 1024 ** 3)
+    workspace = ngworkspace.ngWorkspace(size=tuning['tmpfssize'] if tuning['tmpfs'] else 0)
+    workspace.open()
+    try:
+        context = {'args': args, 'config': config, 'options': options, 'cache': cache, 'telemetry': telemetry,
+                   'state': state, 'tuning': tuning, 'workspace': workspace, 'sources': sources}
+        # The kernel configuration menu runs alone on the terminal, before the
+        # stages, a resumed build reuses the configuration saved then
+        with telemetry.span('edit-kernel-config', 'setup'):
+            context['options'] = ngstages.editkernelconfig(context)
+        state.start(ngcache.treestate(armbianbuild), context['options'], args.resume)
+        pipeline.run(context, workers=tuning['parallelstages'])
+    finally:
+        # Keep the build trees worth keeping on disk and release the tmpfs
+        with telemetry.span('close-workspace', 'setup'):
+            workspace.close()
+        sources.close()
+        # Stop stopwatch, write the Chrome trace and the summary, also when a stage failed
+        telemetry.stopsampling()
+        summary = telemetry.write()
     
-    # Tell user we are done and stop stopwatch
+    # Tell user we are done
     ngsupportfunc.armbianngmsg('Armbian-NG done!')
-    end = time.time()
     
-    # Report build time in minutes
-    btime = round((end-start)/60)
+    # Report time spent in each stage, and build time in minutes
+    ngsupportfunc.reportstagetimes(summary)
+    btime = round(summary['total_seconds']/60)
     ngsupportfunc.reportbuildtime(btime)
     
                      
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngboards.py - indexed catalog of the armbian-build target board configurations
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Every file in armbian-<branch>/build/config/boards is parsed once into a board
+# entry and the entries are kept in an index file in the cache directory. On the
+# next run only the files whose size/mtime changed are hashed again, and only
+# those whose contents changed are parsed again. The directory mtime tells us
+# whether files were added or removed.
+
+import os
+import json
+import shlex
+import difflib
+import hashlib
+
+defaultindexdir = "cache"
+
+# support tier of a board, from its configuration file suffix
+boardtiers = {
+    'conf': 'officially supported',
+    'csc': 'community supported',
+    'wip': 'work in progress',
+    'eos': 'support ended',
+    'tvb': 'TV box'
+    }
+
+def boardsdir(armbianbranch):
+    return "armbian-" + armbianbranch + "/build/config/boards"
+
+def parseboardfile(path):
+    # Returns a board entry dict from a board configuration file
+    filename = os.path.basename(path)
+    board, dot, tier = filename.partition('.')
+    entry = {'board': board, 'tier': tier, 'file': filename,
+             'name': board, 'family': '', 'kernelbranches': []}
+    values = {}
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            try:
+                tokens = shlex.split(line, comments=True)
+            except ValueError:
+                continue
+            for token in tokens:
+                if '=' in token:
+                    name, value = token.split('=', 1)
+                    values[name] = value
+    entry['name'] = values.get('BOARD_NAME', entry['name'])
+    entry['family'] = values.get('BOARDFAMILY', '')
+    entry['kernelbranches'] = [b for b in values.get('KERNEL_TARGET', '').split(',') if b]
+    return entry
+
+class ngBoardCatalog:
+    def __init__(self, armbianbranch, indexdir=defaultindexdir, directory=None):
+        self.directory = directory or boardsdir(armbianbranch)
+        self.indexfile = os.path.join(indexdir, "boards-" + armbianbranch + ".json")
+        self.boards = {}
+        self.load()
+
+    def load(self):
+        # Loads the index and brings it up to date with the boards directory
+        try:
+            with open(self.indexfile) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {'directory': None, 'dirmtime': None, 'files': {}}
+        dirmtime = os.stat(self.directory).st_mtime_ns
+        files = index['files']
+        changed = False
+        if index['directory'] != self.directory or index['dirmtime'] != dirmtime:
+            # files were added or removed
+            names = set(os.listdir(self.directory))
+            for name in list(files):
+                if name not in names:
+                    del files[name]
+            for name in names:
+                files.setdefault(name, {'stat': None, 'sha256': None, 'entry': None})
+            changed = True
+        for name, record in files.items():
+            path = os.path.join(self.directory, name)
+            st = os.stat(path)
+            stat = [st.st_size, st.st_mtime_ns]
+            if record['stat'] == stat:
+                continue
+            with open(path, 'rb') as f:
+                sha256 = hashlib.sha256(f.read()).hexdigest()
+            if record['sha256'] != sha256:
+                record['entry'] = parseboardfile(path)
+                record['sha256'] = sha256
+            record['stat'] = stat
+            changed = True
+        self.boards = dict((record['entry']['board'], record['entry']) for record in files.values())
+        if changed:
+            index = {'directory': self.directory, 'dirmtime': dirmtime, 'files': files}
+            os.makedirs(os.path.dirname(self.indexfile) or '.', exist_ok=True)
+            with open(self.indexfile + '.tmp', 'w') as f:
+                json.dump(index, f)
+            os.replace(self.indexfile + '.tmp', self.indexfile)
+
+    def get(self, board):
+        return self.boards.get(board)
+
+    def filter(self, tier=None, family=None, kernelbranch=None):
+        # Returns the boards matching all given criteria, sorted by board name
+        result = []
+        for board in sorted(self.boards):
+            entry = self.boards[board]
+            if tier is not None and entry['tier'] != tier:
+                continue
+            if family is not None and entry['family'] != family:
+                continue
+            if kernelbranch is not None and kernelbranch not in entry['kernelbranches']:
+                continue
+            result.append(entry)
+        return result
+
+    def prefix(self, prefix):
+        # Returns the boards whose name starts with prefix
+        prefix = prefix.lower()
+        return [self.boards[b] for b in sorted(self.boards) if b.lower().startswith(prefix)]
+
+    def fuzzy(self, query, count=10):
+        # Returns the boards whose name best matches query, e.g. a misspelled board name
+        matches = difflib.get_close_matches(query.lower(), [b.lower() for b in self.boards], n=count, cutoff=0.5)
+        lower = dict((b.lower(), b) for b in self.boards)
+        return [self.boards[lower[m]] for m in matches]
+
+catalogs = {}
+
+def getcatalog(armbianbranch):
+    # Returns the board catalog of an armbian-build branch, loaded once per run
+    if armbianbranch not in catalogs:
+        catalogs[armbianbranch] = ngBoardCatalog(armbianbranch)
+    return catalogs[armbianbranch]
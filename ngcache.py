@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngcache.py - content-addressed cache of build artifacts (.debs, tarballs)
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Each cache entry is a directory cache/artifacts/<key[:2]>/<key>/ holding the
+# artifact files and a manifest.json. The key is a sha256 of everything the
+# artifacts were built from, so an entry never needs to be invalidated: a change
+# in the inputs gives a different key. The entry directory mtime is its last
+# use time, the least recently used entries are evicted above the size cap.
+
+import os
+import json
+import shutil
+import hashlib
+
+defaultcachedir = "cache/artifacts"
+defaultcachesize = 20 * 1024 ** 3  # 20 GB
+
+def hashfile(path, h=None):
+    # Returns the sha256 of a file's contents (or feeds them into h)
+    if h is None:
+        h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h
+
+def inputskey(*parts):
+    # Returns the cache key for a list of inputs. Each part is either
+    # ('file', path) for a file whose contents matter, or any JSON-able value
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, tuple) and len(part) == 2 and part[0] == 'file':
+            if part[1] and os.path.isfile(part[1]):
+                h.update(b'file\0')
+                hashfile(part[1], h)
+            else:
+                h.update(b'nofile\0')
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+def treestate(gitdir):
+    # Returns the commit of a git checkout plus a hash of its local changes
+    if not os.path.isdir(gitdir):
+        return None
+    import ngrunner
+    commit = ngrunner.run(['git', '-C', gitdir, 'rev-parse', 'HEAD'], check=False, capture=True).stdout.strip()
+    diff = ngrunner.run(['git', '-C', gitdir, 'diff', 'HEAD'], check=False, capture=True).stdout
+    return commit + '+' + hashlib.sha256(diff.encode()).hexdigest()
+
+def dirsize(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+class ngArtifactCache:
+    def __init__(self, cachedir=defaultcachedir, maxsize=defaultcachesize):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+
+    def entrydir(self, key):
+        return os.path.join(self.cachedir, key[:2], key)
+
+    def lookup(self, key):
+        # Restores the artifacts of key to their original paths and returns the
+        # stage outputs, or returns None on a cache miss
+        entry = self.entrydir(key)
+        try:
+            with open(os.path.join(entry, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            for stored, original in manifest['files']:
+                if os.path.dirname(original):
+                    os.makedirs(os.path.dirname(original), exist_ok=True)
+                shutil.copy2(os.path.join(entry, stored), original)
+            os.utime(entry)     # mark as recently used
+        except FileNotFoundError:
+            return None     # evicted meanwhile by another build
+        return manifest['outputs']
+
+    def store(self, key, outputs):
+        # Stores the stage outputs. Output values that are lists of existing file
+        # paths (or a single path) have their files copied into the cache.
+        entry = self.entrydir(key)
+        temp = entry + '.tmp'
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        files = []
+        for value in (outputs or {}).values():
+            paths = value if isinstance(value, list) else [value]
+            for path in paths:
+                if isinstance(path, str) and os.path.isfile(path):
+                    stored = str(len(files)) + '-' + os.path.basename(path)
+                    shutil.copy2(path, os.path.join(temp, stored))
+                    files.append((stored, path))
+        with open(os.path.join(temp, 'manifest.json'), 'w') as f:
+            json.dump({'outputs': outputs, 'files': files}, f, default=str)
+        # an entry only becomes visible once complete
+        shutil.rmtree(entry, ignore_errors=True)
+        os.rename(temp, entry)
+        self.evict()
+
+    def evict(self):
+        # Removes least recently used entries until the cache fits in maxsize.
+        # Stages store in parallel, and other builds may share the cache: one
+        # eviction at a time, and entries removed during the scan are skipped.
+        import ngdownload
+        with ngdownload.pathlock(os.path.join(self.cachedir, 'evict')):
+            entries = []
+            for prefix in os.listdir(self.cachedir):
+                prefixdir = os.path.join(self.cachedir, prefix)
+                if os.path.isdir(prefixdir):
+                    for key in os.listdir(prefixdir):
+                        entry = os.path.join(prefixdir, key)
+                        if key.endswith('.tmp'):
+                            continue
+                        try:
+                            entries.append((os.stat(entry).st_mtime, dirsize(entry), entry))
+                        except FileNotFoundError:
+                            continue
+            total = sum(e[1] for e in entries)
+            for mtime, size, entry in sorted(entries):
+                if total <= self.maxsize:
+                    break
+                print('Evicting cached artifacts', os.path.basename(entry))
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngcompress.py - streaming compression and checksums of output images
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# The image is read once. Each chunk read is handed to a set of consumers, each
+# running in its own thread behind a small bounded queue: the sha256 and sha512
+# digests of the image, and one multithreaded xz/zstd process per output format.
+# The compressed output of each process is written to its file and hashed on the
+# way, so no intermediate copy is ever written. The slowest consumer sets the
+# pace, the bounded queues keep memory use flat.
+#
+# When a compressor fails, or its output cannot be written (e.g. the disk is
+# full), the compressor is killed so that nothing waits on it, the other
+# consumers finish, and compressimage() raises ngCompressError.
+
+import os
+import json
+import time
+import queue
+import shutil
+import hashlib
+import threading
+import subprocess
+
+chunksize = 4 * 1024 * 1024
+queuedepth = 8
+
+# compressor command lines, {threads} and {level} are filled in
+compressors = {
+    'xz': (['xz', '-T{threads}', '-{level}', '-c'], '.xz'),
+    'zstd': (['zstd', '-T{threads}', '-{level}', '-q', '-c'], '.zst'),
+    }
+defaultlevels = {'xz': 6, 'zstd': 19}
+
+class ngConsumer(threading.Thread):
+    # Runs function on every chunk put in its queue, None ends the stream
+    def __init__(self, function):
+        threading.Thread.__init__(self, daemon=True)
+        self.queue = queue.Queue(queuedepth)
+        self.function = function
+        self.error = None
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    self.function(chunk)
+                except OSError as e:    # e.g. the compressor died, keep draining the queue
+                    self.error = e      # so the reader never blocks
+
+class ngCompressError(Exception):
+    pass
+
+def drain(process, path, digest, errors):
+    # Copies a compressor's output to path, hashing it on the way. If path cannot
+    # be written, records the error and kills the compressor, which would
+    # otherwise block on its full output pipe and stop the whole pipeline.
+    try:
+        with open(path, 'wb') as f:
+            for chunk in iter(lambda: process.stdout.read(chunksize), b''):
+                f.write(chunk)
+                digest.update(chunk)
+    except OSError as e:
+        errors.append(e)
+        process.kill()
+        for chunk in iter(lambda: process.stdout.read(chunksize), b''):
+            pass
+
+def compressimage(imagepath, formats=('xz',), levels=None, threads=0):
+    # Compresses imagepath in all formats and computes its digests in a single read
+    # pass. Writes the compressed files, <image>.sha256/.sha512 and <image>.manifest.json
+    # next to the image. threads=0 means one compressor thread per core.
+    # Returns the manifest dict.
+    levels = dict(defaultlevels, **(levels or {}))
+    threads = threads or os.cpu_count() or 1
+    digests = {'sha256': hashlib.sha256(), 'sha512': hashlib.sha512()}
+    consumers = [ngConsumer(digest.update) for digest in digests.values()]
+    processes = []
+    for name in formats:
+        command, suffix = compressors[name]
+        if shutil.which(command[0]) is None:
+            print(command[0], 'not found, not creating the', name, 'compressed image')
+            continue
+        command = [c.format(threads=threads, level=levels[name]) for c in command]
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        outdigest = hashlib.sha256()
+        errors = []
+        writer = threading.Thread(target=drain, args=(process, imagepath + suffix, outdigest, errors), daemon=True)
+        writer.start()
+        consumer = ngConsumer(process.stdin.write)
+        processes.append((name, suffix, process, writer, outdigest, errors, consumer))
+        consumers.append(consumer)
+    for consumer in consumers:
+        consumer.start()
+
+    start = time.time()
+    size = 0
+    with open(imagepath, 'rb', buffering=0) as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            size += len(chunk)
+            for consumer in consumers:
+                consumer.queue.put(chunk)
+    for consumer in consumers:
+        consumer.queue.put(None)
+    for consumer in consumers:
+        consumer.join()
+
+    artifacts = []
+    failures = []
+    for name, suffix, process, writer, outdigest, errors, consumer in processes:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:     # the compressor died, reported below
+            pass
+        returncode = process.wait()
+        writer.join()
+        if errors or returncode != 0:
+            reason = str(errors[0]) if errors else 'exit code ' + str(returncode)
+            if consumer.error is not None and not errors:
+                reason += ', ' + str(consumer.error)
+            failures.append(name + ' compression of ' + imagepath + ' failed: ' + reason)
+            if os.path.isfile(imagepath + suffix):
+                os.remove(imagepath + suffix)   # truncated
+            continue
+        artifacts.append({'file': os.path.basename(imagepath + suffix), 'format': name, 'level': levels[name],
+                          'size': os.path.getsize(imagepath + suffix), 'sha256': outdigest.hexdigest()})
+    if failures:
+        raise ngCompressError('; '.join(failures))
+    elapsed = max(time.time() - start, 1e-6)
+
+    image = os.path.basename(imagepath)
+    for name, digest in digests.items():
+        with open(imagepath + '.' + name, 'w') as f:
+            f.write(digest.hexdigest() + '  ' + image + '\n')
+    manifest = {'image': image, 'size': size, 'threads': threads,
+                'sha256': digests['sha256'].hexdigest(), 'sha512': digests['sha512'].hexdigest(),
+                'artifacts': artifacts, 'seconds': round(elapsed, 3),
+                'mbps': round(size / elapsed / 1000000, 1)}
+    with open(imagepath + '.manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    print('Compressed', image, 'to', ', '.join(a['format'] for a in artifacts) or 'nothing',
+          'at', manifest['mbps'], 'MB/s with', threads, 'threads')
+    return manifest
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngconfig.py - configuration file loader for old-style and Armbian-NG configuration files
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# See docs/config_files.md for the two file formats. Each file is first compiled
+# into a list of assignments whose values are lists of literal strings and
+# variable references, e.g.
+#
+#	KERNELDIR="$SRC/linux-${BRANCH}"  ->  ['KERNELDIR', [['v', 'SRC'], ['s', '/linux-'], ['v', 'BRANCH']]]
+#
+# The compiled form does not depend on any other file, so it is cached in
+# cache/config/ keyed by the sha256 of the file contents. Loading a stack of
+# layers (board, family, user configuration) then evaluates all the compiled
+# assignments in order in a single pass, later layers overriding earlier ones,
+# and converts the result to the types given in configschema. As in bash,
+# references in old-style files take the value the variable has at that point.
+# References in Armbian-NG files (compiled as 'r' instead of 'v') take the
+# final value of the variable, once all layers are loaded, wherever it is set,
+# and a reference to a variable set nowhere is a configuration error.
+#
+# In Armbian-NG (INI) files, option "option" of section [section] is the
+# variable SECTION_OPTION, and options in the [DEFAULT] and [build] sections are
+# plain variables, e.g. [distcc] pool is DISTCC_POOL. Values may reference
+# variables as ${NAME} or ${section:option}.
+#
+# Old-style files are bash scripts: only top-level NAME=value assignments are
+# read, and the assignments of a top-level case $VARIABLE in ... esac arm when
+# VARIABLE selects that arm at that point (as family files set the sources of
+# each kernel branch in a case $BRANCH in). Assignments inside functions, if
+# blocks, loops and nested case blocks are ignored.
+
+import os
+import re
+import sys
+import json
+import fnmatch
+import hashlib
+import configparser
+
+compilerversion = 4     # bump when the compiled form changes, invalidates the cache
+defaultcachedir = "cache/config"
+
+# Typed schema of the variables Armbian-NG uses: name: (type, default)
+# Other variables are kept as strings.
+configschema = {
+    'BOARD': (str, ''),
+    'BRANCH': (str, ''),
+    'RELEASE': (str, ''),
+    'BUILD_MINIMAL': (bool, False),
+    'BUILD_DESKTOP': (bool, False),
+    'KERNEL_ONLY': (bool, False),
+    'KERNEL_CONFIGURE': (bool, False),
+    'FORCE_BOOTSCRIPT_UPDATE': (bool, False),
+    'CLEAN_LEVEL': (list, []),
+    'DISTCC_POOL': (list, []),
+    'ARMBIAN_BUILD_URL': (str, 'https://github.com/armbian/build.git'),
+    'ARTIFACT_CACHE_SIZE': (int, 20),   # GB
+    'IMAGE_COMPRESSION': (list, ['xz']),    # any of xz, zstd
+    'XZ_LEVEL': (int, 6),
+    'ZSTD_LEVEL': (int, 19),
+    'COMPRESS_THREADS': (int, 0),       # 0 = automatic, see ngprofile.py
+    'MAKE_JOBS': (int, 0),              # 0 = automatic
+    'PARALLEL_STAGES': (int, 0),        # 0 = automatic
+    'USE_TMPFS': (str, 'auto'),         # auto, yes or no
+    'TMPFS_SIZE': (int, 0),             # GB, 0 = automatic
+    'DEBIAN_MIRROR': (str, ''),         # '' = deb.debian.org/debian
+    'UBUNTU_MIRROR': (str, ''),         # '' = ports.ubuntu.com/
+    'DOWNLOAD_CONCURRENCY': (int, 8),
+    'KERNELSOURCE': (str, ''),          # '' = see ngsources.py
+    'KERNELBRANCH': (str, ''),          # branch:<name>, tag:<name> or commit:<sha1>
+    'KERNELSOURCE_SHA256': (str, ''),   # for a tarball KERNELSOURCE
+    'BOOTSOURCE': (str, ''),
+    'BOOTBRANCH': (str, ''),
+    'BOOTSOURCE_SHA256': (str, ''),
+    'USE_CCACHE': (bool, True),
+    }
+
+booleans = {'yes': True, 'true': True, 'on': True, '1': True,
+            'no': False, 'false': False, 'off': False, '0': False, '': False}
+
+assignment = re.compile(r'^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)$')
+reference = re.compile(r'\$(?:\{([A-Za-z_][A-Za-z0-9_:]*)\}|([A-Za-z_][A-Za-z0-9_]*))')
+blockstart = re.compile(r'^\s*(if|case|for|while|until)\b|^\s*(function\s+)?[A-Za-z_][A-Za-z0-9_]*\s*\(\)|\{\s*$')
+functionheader = re.compile(r'^\s*(function\s+)?[A-Za-z_][A-Za-z0-9_]*\s*\(\)\s*$')
+blockend = re.compile(r'^\s*(?:(?:fi|esac|done)\b|\})')
+blockclosed = re.compile(r'\b(fi|esac|done)\s*;?\s*$|\}\s*;?\s*$')     # a block on a single line
+casestart = re.compile(r'^case\s+"?\$(?:\{([A-Za-z_][A-Za-z0-9_]*)\}|([A-Za-z_][A-Za-z0-9_]*))"?\s+in\s*$')
+casearm = re.compile(r'^\(?\s*([^()]+?)\s*\)(.*)$')
+
+def isngconfig(text):
+    # Armbian-NG configuration files have "Armbian-NG" in their first line
+    return "Armbian-NG" in text.split('\n', 1)[0]
+
+def splitreferences(value, segments):
+    # Appends the literal parts and variable references of value to segments
+    position = 0
+    for match in reference.finditer(value):
+        segments.append(['s', value[position:match.start()]])
+        segments.append(['v', match.group(1) or match.group(2)])
+        position = match.end()
+    segments.append(['s', value[position:]])
+
+def compilebashvalue(value):
+    # Compiles the right hand side of a bash assignment, handling quotes and comments
+    segments = []
+    i = 0
+    literal = ''
+    while i < len(value):
+        c = value[i]
+        if c == "'":
+            end = value.find("'", i + 1)
+            end = len(value) if end < 0 else end
+            splitreferences(literal, segments)
+            literal = ''
+            segments.append(['s', value[i + 1:end]])   # no expansion in single quotes
+            i = end + 1
+        elif c == '"':
+            end = i + 1
+            while end < len(value) and value[end] != '"':
+                end += 2 if value[end] == '\\' else 1
+            splitreferences(literal, segments)
+            literal = ''
+            splitreferences(re.sub(r'\\(.)', r'\1', value[i + 1:end]), segments)
+            i = end + 1
+        elif c in ' \t;' or (c == '#' and (i == 0 or value[i - 1] in ' \t')):
+            break   # end of the value, a comment or another command
+        else:
+            literal += c
+            i += 1
+    splitreferences(literal, segments)
+    return [s for s in segments if s != ['s', '']]
+
+def compilebash(text):
+    # Returns the top-level assignments of a bash file. Assignments in the arms of
+    # a top-level case $VARIABLE in ... esac get a third item, the condition
+    # [VARIABLE, patterns of the arm, patterns of the arms before it].
+    assignments = []
+    depth = 0
+    case = None     # in a top-level case: [variable, patterns of the current arm or None, earlier patterns]
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if case is not None and not depth:
+            if re.match(r'^esac\b', stripped):
+                case = None
+                continue
+            arm = casearm.match(stripped) if case[1] is None else None
+            if arm:
+                case[1] = [pattern.strip().strip('"\'') for pattern in arm.group(1).split('|')]
+                stripped = arm.group(2).strip()
+            armend = stripped.endswith(';;')
+            if armend:
+                stripped = stripped[:-2].strip()
+            match = assignment.match(stripped)
+            if match and case[1] is not None:
+                assignments.append([match.group(1), compilebashvalue(match.group(2)),
+                                    [case[0], case[1], list(case[2])]])
+            elif blockstart.search(stripped) and not blockclosed.search(stripped):
+                depth += 1
+            if armend and case[1] is not None:
+                case[2] += case[1]
+                case[1] = None
+            continue
+        if blockend.match(stripped):
+            depth = max(depth - 1, 0)
+            continue
+        if functionheader.match(stripped):
+            continue    # Allman style function, its body starts with the { on the next line
+        match = casestart.match(stripped)
+        if match and not depth:
+            case = [match.group(1) or match.group(2), None, []]
+            continue
+        if blockstart.search(stripped):
+            if not blockclosed.search(stripped):
+                depth += 1
+            continue
+        if depth:
+            continue
+        match = assignment.match(line)
+        if match:
+            assignments.append([match.group(1), compilebashvalue(match.group(2))])
+    return assignments
+
+def ngname(section, option):
+    if section in ('DEFAULT', 'build'):
+        return option.upper()
+    return (section + '_' + option).upper()
+
+def compileng(text):
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.optionxform = str
+    parser.read_string(text)
+    assignments = []
+    items = [('DEFAULT', option, value) for option, value in parser.defaults().items()]
+    for section in parser.sections():
+        items += [(section, option, value) for option, value in parser.items(section, raw=True)
+                  if option not in parser.defaults()]
+    for section, option, value in items:
+        segments = []
+        splitreferences(value, segments)
+        for segment in segments:
+            if segment[0] == 'v':
+                segment[0] = 'r'    # resolved once all layers are loaded
+                if ':' in segment[1]:
+                    segment[1] = ngname(*segment[1].split(':', 1))
+        assignments.append([ngname(section, option), [s for s in segments if s != ['s', '']]])
+    return assignments
+
+def compileconfig(text):
+    # Returns the compiled form of a configuration file, auto-detecting its format
+    if isngconfig(text):
+        return compileng(text)
+    return compilebash(text)
+
+memorycache = {}
+
+def compilefile(path, cachedir=defaultcachedir):
+    # Returns the compiled form of a file, from the in-memory or on-disk cache when possible
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = hashlib.sha256(data + b'\0' + str(compilerversion).encode()).hexdigest()
+    if key in memorycache:
+        return memorycache[key]
+    cachefile = os.path.join(cachedir, key[:2], key + '.json') if cachedir else None
+    compiled = None
+    if cachefile:
+        try:
+            with open(cachefile) as f:
+                compiled = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if compiled is None:
+        compiled = compileconfig(data.decode(errors='replace'))
+        if cachefile:
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            with open(cachefile + '.tmp', 'w') as f:
+                json.dump(compiled, f)
+            os.replace(cachefile + '.tmp', cachefile)
+    memorycache[key] = compiled
+    return compiled
+
+def convert(name, value):
+    # Converts a string value to the schema type of name, raises ValueError if invalid
+    kind = configschema[name][0]
+    if kind is bool:
+        if value.lower() not in booleans:
+            raise ValueError(name + ' must be yes or no, not "' + value + '"')
+        return booleans[value.lower()]
+    if kind is int:
+        if value.lower() == 'auto' and configschema[name][1] == 0:
+            return 0    # the settings whose default 0 means automatic
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(name + ' must be a number, not "' + value + '"')
+    if kind is list:
+        return value.replace(',', ' ').split()
+    return value
+
+def matches(value, condition):
+    # Whether a case arm condition [variable, patterns, earlier patterns] selects value
+    variable, patterns, earlier = condition
+    return (not any(fnmatch.fnmatchcase(value, pattern) for pattern in earlier) and
+            any(fnmatch.fnmatchcase(value, pattern) for pattern in patterns))
+
+def loadconfig(paths, cachedir=defaultcachedir, variables=None):
+    # Loads and merges configuration files in order, later files override earlier
+    # ones. Missing files are skipped. variables are set before the first file,
+    # as armbian-build sets BRANCH before reading the family file. Returns a dict
+    # of variable values, with the schema variables converted to their type and
+    # set to their default if unset.
+    values = dict(variables or {})
+    late = {}       # variables set with references resolved at the end: their segments
+    errors = []
+
+    def lookup(name, resolving):
+        if name in late:
+            resolve(name, resolving)
+        return values.get(name, os.environ.get(name))
+
+    def resolve(name, resolving=()):
+        # Sets the value of a variable with references resolved at the end
+        if name in resolving:
+            errors.append('${' + name + '} refers to itself')
+            values[name] = ''
+            del late[name]
+            return
+        result = ''
+        for kind, text in late[name]:
+            if kind == 's':
+                result += text
+                continue
+            value = lookup(text, resolving + (name,))
+            if value is None:
+                if kind == 'r':
+                    errors.append(name + ' refers to ${' + text + '}, which is not set')
+                value = ''
+            result += value
+        if name in late:
+            values[name] = result
+            del late[name]
+
+    for path in paths:
+        if not path or not os.path.isfile(path):
+            continue
+        for name, segments, *condition in compilefile(path, cachedir):
+            if condition and not matches(lookup(condition[0][0], ()) or '', condition[0]):
+                continue
+            late.pop(name, None)
+            if any(kind == 'r' for kind, text in segments):
+                late[name] = segments
+                continue
+            result = ''
+            for kind, text in segments:
+                if kind == 's':
+                    result += text
+                else:
+                    result += lookup(text, ()) or ''
+            values[name] = result
+    for name in list(late):
+        if name in late:
+            resolve(name)
+    config = dict(values)
+    for name, (kind, default) in configschema.items():
+        if name not in values:
+            config[name] = default
+            continue
+        try:
+            config[name] = convert(name, values[name])
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        for error in errors:
+            print('Configuration error:', error)
+        sys.exit(1)
+    return config
+
+def configlayers(armbianbranch, board, configfile):
+    # Returns the configuration files that apply to a build, in merge order:
+    # board configuration, board family configuration, user configuration file
+    import ngboards
+    layers = []
+    entry = ngboards.getcatalog(armbianbranch).get(board) if board else None
+    if entry is not None:
+        builddir = "armbian-" + armbianbranch + "/build"
+        layers.append(os.path.join(builddir, "config/boards", entry['file']))
+        for familyfile in ("config/sources/families/" + entry['family'] + ".conf",
+                           "config/sources/" + entry['family'] + ".conf"):
+            if entry['family'] and os.path.isfile(os.path.join(builddir, familyfile)):
+                layers.append(os.path.join(builddir, familyfile))
+                break
+    layers.append(configfile)
+    return layers
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngdistcc.py - distcc distributed kernel compilation support for build.py
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# The pool of distcc hosts is set in the configuration file, for example
+#
+#	DISTCC_POOL="192.168.1.20 192.168.1.21/4 buildbox:3700/8"
+#
+# in an old-style configuration file, or
+#
+#	[distcc]
+#	pool = 192.168.1.20 192.168.1.21/4 buildbox:3700/8
+#
+# in an Armbian-NG configuration file. Each entry is host[:port][/cores].
+# When the number of cores is not given, it is read from the distccd statistics
+# port (distccd --stats), and if that is not available a default is used.
+
+import os
+import socket
+
+distccport = 3632           # default distccd port
+distccstatsport = 3633      # default distccd --stats port
+defaultcores = 2            # used when a host's core count can't be found
+probetimeout = 1.0          # seconds
+
+def parsehost(entry):
+    # Splits a pool entry host[:port][/cores] into (host, port, cores or None)
+    # Raises ValueError if the entry is malformed.
+    cores = None
+    host = entry
+    if '/' in host:
+        host, cores = host.split('/', 1)
+        cores = int(cores)
+        if cores < 1:
+            raise ValueError('invalid number of cores ' + str(cores))
+    port = distccport
+    if ':' in host:
+        host, port = host.rsplit(':', 1)
+        port = int(port)
+        if not 0 < port < 65536:
+            raise ValueError('invalid port ' + str(port))
+    if not host:
+        raise ValueError('no host name')
+    return host, port, cores
+
+def statscores(host, statsport=distccstatsport):
+    # Asks distccd's statistics port for the number of jobs it accepts (dcc_max_kids)
+    try:
+        with socket.create_connection((host, statsport), timeout=probetimeout) as s:
+            s.sendall(b'GET / HTTP/1.0\r\n\r\n')
+            data = b''
+            while True:
+                chunk = s.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+    except OSError:
+        return None
+    for line in data.decode(errors='replace').splitlines():
+        if line.startswith('dcc_max_kids'):
+            try:
+                return int(line.split()[1])
+            except (IndexError, ValueError):
+                return None     # not a distccd statistics reply
+    return None
+
+def probehost(entry, statsport=distccstatsport):
+    # Returns (host, port, cores) if distccd answers on host:port, None otherwise
+    try:
+        host, port, cores = parsehost(entry)
+    except ValueError as e:
+        print('Ignoring distcc pool entry "' + entry + '":', e)
+        return None
+    try:
+        socket.create_connection((host, port), timeout=probetimeout).close()
+    except OSError:
+        return None
+    if cores is None:
+        cores = statscores(host, statsport) or defaultcores
+    return host, port, cores
+
+def compileplan(pool, localcores=None, statsport=distccstatsport):
+    # Probes the pool and returns (DISTCC_HOSTS string or None, make -j value)
+    # Hosts with more cores come first, since distcc fills hosts in list order.
+    # If no host answers, returns (None, localcores), i.e. compile locally.
+    if localcores is None:
+        localcores = os.cpu_count() or 1
+    hosts = [h for h in (probehost(entry, statsport) for entry in pool) if h is not None]
+    if not hosts:
+        return None, localcores
+    hosts.sort(key=lambda h: h[2], reverse=True)
+    entries = [host + ':' + str(port) + '/' + str(cores) for host, port, cores in hosts]
+    # keep a couple of local slots for preprocessing and linking
+    entries.append('localhost/' + str(min(localcores, 2)))
+    jobs = sum(h[2] for h in hosts) + localcores
+    return ' '.join(entries), jobs
+
+def kernelbuildenv(pool, usedistcc, localcores=None):
+    # Returns (make -j value, environment) for the kernel build
+    # pool is the DISTCC_POOL list from the configuration, localcores the
+    # make -j value for a local build (default: one job per core)
+    env = dict(os.environ)
+    if not usedistcc:
+        return localcores or os.cpu_count() or 1, env
+    distcchosts, jobs = compileplan(pool, localcores)
+    if distcchosts is None:
+        print('No distcc host in the pool answered, compiling the kernel locally')
+        return jobs, env
+    print('Compiling the kernel with distcc on', distcchosts, 'with make -j' + str(jobs))
+    env['DISTCC_HOSTS'] = distcchosts
+    env['DISTCC_FALLBACK'] = '1'        # compile locally if a host drops out
+    env['DISTCC_BACKOFF_PERIOD'] = '30' # and retry that host after 30 seconds
+    env['CC'] = 'distcc gcc'
+    return jobs, env
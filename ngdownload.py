@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngdownload.py - concurrent, resumable and verified downloads
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# fetchall() downloads a list of files at the same time, at most concurrency
+# at once, driven by an asyncio event loop. Each file is downloaded to
+# <path>.part, and an interrupted download continues where it stopped (HTTP
+# Range request) on the next try or the next build. A file only gets its final
+# name once its size and sha256 are verified, so a file that exists is complete.
+# Only the standard library is used: urllib does the HTTP(S), in executor threads.
+#
+# Two downloads of the same file (e.g. a package shared by two image types of
+# a build matrix, or by two builds using the same cache) would write to the same
+# .part file, so each path is locked while it is downloaded, see pathlock().
+
+import os
+import fcntl
+import hashlib
+import threading
+import contextlib
+
+chunksize = 1024 * 1024
+defaultconcurrency = 8
+defaultretries = 3
+timeout = 60    # seconds without data before a download is retried
+
+class ngDownloadError(Exception):
+    pass
+
+pathlocks = {}
+pathlockslock = threading.Lock()
+
+@contextlib.contextmanager
+def pathlock(path):
+    # Gives exclusive use of path in a with block, among the threads of this
+    # build (a lock per path) and other builds (a lock on <path>.lock)
+    with pathlockslock:
+        lock = pathlocks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+def download(url, path, sha256=None, size=None, retries=defaultretries):
+    # Downloads url to path (blocking), resuming a previous partial download.
+    # Raises ngDownloadError when the download fails or does not verify.
+    if os.path.isfile(path):
+        return path
+    with pathlock(path):
+        if os.path.isfile(path):    # downloaded by another thread or build meanwhile
+            return path
+        return downloadlocked(url, path, sha256, size, retries)
+
+def downloadlocked(url, path, sha256, size, retries):
+    import urllib.error     # only loaded when downloading, not on the startup path
+    import urllib.request
+    part = path + '.part'
+    error = None
+    for attempt in range(retries):
+        h = hashlib.sha256()
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        if size is not None and offset > size:
+            offset = 0
+        request = urllib.request.Request(url, headers={'User-Agent': 'Armbian-NG'})
+        if offset:
+            request.add_header('Range', 'bytes=' + str(offset) + '-')
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if offset and response.status == 206:
+                    with open(part, 'rb') as f:
+                        for block in iter(lambda: f.read(chunksize), b''):
+                            h.update(block)
+                    mode = 'ab'
+                else:
+                    mode = 'wb'     # the server ignored the range, start again
+                with open(part, mode) as f:
+                    for block in iter(lambda: response.read(chunksize), b''):
+                        h.update(block)
+                        f.write(block)
+        except urllib.error.HTTPError as e:
+            error = str(e)
+            if e.code == 416 and offset:
+                # nothing after offset: the .part is complete if the server file
+                # has that size (Content-Range: bytes */<size>), otherwise it is
+                # stale (e.g. the file changed on the server) and is downloaded again
+                total = (e.headers.get('Content-Range') or '').rpartition('/')[2]
+                if offset == (size if size is not None else int(total) if total.isdigit() else None):
+                    with open(part, 'rb') as f:
+                        for block in iter(lambda: f.read(chunksize), b''):
+                            h.update(block)
+                else:
+                    os.remove(part)
+                    continue
+            else:
+                if 400 <= e.code < 500:
+                    break   # not found, forbidden...: retrying will not help
+                continue
+        except (OSError, ValueError) as e:
+            error = str(e)
+            continue
+        if size is not None and os.path.getsize(part) != size:
+            error = 'size is ' + str(os.path.getsize(part)) + ' instead of ' + str(size)
+            os.remove(part)
+            continue
+        if sha256 is not None and h.hexdigest() != sha256:
+            error = 'sha256 mismatch'
+            os.remove(part)
+            continue
+        os.replace(part, path)
+        return path
+    raise ngDownloadError(url + ': ' + str(error))
+
+async def fetch(executor, semaphore, url, path, sha256, size):
+    import asyncio
+    async with semaphore:
+        return await asyncio.get_event_loop().run_in_executor(executor, download, url, path, sha256, size)
+
+async def fetchasync(items, executor, concurrency):
+    import asyncio
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[fetch(executor, semaphore, *item) for item in items], return_exceptions=True)
+
+def fetchall(items, concurrency=defaultconcurrency):
+    # Downloads items, a list of (url, path, sha256 or None, size or None).
+    # Returns the list of (url, error) of the downloads that failed.
+    import ngrunner
+    import concurrent.futures
+    if not items:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='download') as executor:
+        results = ngrunner.runloop(fetchasync([tuple(item) for item in items], executor, concurrency))
+    return [(item[0], str(result)) for item, result in zip(items, results) if isinstance(result, Exception)]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngimage.py - sparse SD card image assembly with bmap output
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Images are created as sparse files, so the empty space in them takes no disk
+# space and is never written. Filesystem images (made by e.g. mkfs.ext4 -d,
+# themselves sparse) are copied into their partition with copy_file_range(),
+# one data extent at a time: holes are skipped, and the kernel can share or
+# copy the blocks without going through userspace. Finally a .bmap file lists
+# the blocks that hold data, so that bmaptool only writes those to the SD card.
+#
+# Everything works on regular files, no loop or block devices are needed.
+
+import os
+import struct
+import hashlib
+
+import ngrunner
+
+sectorsize = 512
+blocksize = 4096            # bmap block size
+defaultfirstoffset = 4 * 1024 * 1024    # armbian leaves the first 4 MiB to the boot loader
+copychunk = 64 * 1024 * 1024
+
+# MBR partition types
+partitiontypes = {'fat32': 0x0c, 'linux': 0x83}
+
+def createimage(path, size):
+    # Creates (or empties) a sparse image file of size bytes
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+def punchhole(fd, offset, length):
+    # Deallocates a byte range of a file, it then reads as zeros
+    # Falls back to writing zeros where fallocate() hole punching is not available
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        FALLOC_FL_KEEP_SIZE = 0x01
+        FALLOC_FL_PUNCH_HOLE = 0x02
+        if libc.fallocate(fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE,
+                          ctypes.c_longlong(offset), ctypes.c_longlong(length)) == 0:
+            return
+    except (OSError, AttributeError):
+        pass
+    zeros = bytes(min(length, copychunk))
+    while length > 0:
+        n = os.pwrite(fd, zeros[:min(length, len(zeros))], offset)
+        offset += n
+        length -= n
+
+def dataextents(fd, start=0, end=None):
+    # Yields the (offset, length) data extents of a file between start and end,
+    # using SEEK_DATA/SEEK_HOLE. Without them the whole range is one extent.
+    if end is None:
+        end = os.fstat(fd).st_size
+    if not hasattr(os, 'SEEK_DATA'):
+        if end > start:
+            yield start, end - start
+        return
+    offset = start
+    while offset < end:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError:     # ENXIO: no more data
+            return
+        if data >= end:
+            return
+        hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+        yield data, hole - data
+        offset = hole
+
+def copyrange(src, dst, srcoffset, dstoffset, length):
+    # Copies length bytes between file descriptors, in the kernel when possible
+    while length > 0:
+        n = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                n = os.copy_file_range(src, dst, min(length, copychunk), srcoffset, dstoffset)
+            except OSError:
+                n = 0
+        if n == 0:
+            # no copy_file_range (Python < 3.8, older kernels or cross-filesystem)
+            n = os.pwrite(dst, os.pread(src, min(length, copychunk), srcoffset), dstoffset)
+        srcoffset += n
+        dstoffset += n
+        length -= n
+
+def copyinto(imagepath, sourcepath, offset, size=None):
+    # Copies a (sparse) file into the image at offset, keeping it sparse.
+    # The destination range is deallocated first, so old data does not survive.
+    if size is None:
+        size = os.path.getsize(sourcepath)
+    src = os.open(sourcepath, os.O_RDONLY)
+    dst = os.open(imagepath, os.O_RDWR)
+    try:
+        punchhole(dst, offset, size)
+        for start, length in dataextents(src, 0, size):
+            copyrange(src, dst, start, offset + start, length)
+    finally:
+        os.close(src)
+        os.close(dst)
+
+def writeat(imagepath, data, offset):
+    # Writes a small blob (e.g. the u-boot binary) into the image at offset
+    fd = os.open(imagepath, os.O_RDWR)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+def writembr(imagepath, partitions, diskid=None):
+    # Writes an MBR partition table, partitions is a list of (start, size, type)
+    # in bytes, type being a key of partitiontypes. At most 4 partitions.
+    if len(partitions) > 4:
+        raise ValueError('An MBR partition table holds at most 4 partitions')
+    if diskid is None:
+        diskid = struct.unpack('<I', os.urandom(4))[0]
+    table = b''
+    for start, size, kind in partitions:
+        # CHS addresses are unused, use the usual "beyond 8 GB" values
+        table += struct.pack('<B3sB3sII', 0, b'\xfe\xff\xff', partitiontypes[kind], b'\xfe\xff\xff',
+                             start // sectorsize, size // sectorsize)
+    table += bytes(16 * (4 - len(partitions)))
+    writeat(imagepath, struct.pack('<I', diskid) + b'\0\0' + table + b'\x55\xaa', 440)
+
+def makeext4(rootdir, fsimage, size, label='armbi_root'):
+    # Creates a sparse ext4 filesystem image of size bytes from the contents of rootdir
+    createimage(fsimage, size)
+    ngrunner.run(['mkfs.ext4', '-q', '-F', '-L', label, '-d', rootdir, fsimage])
+
+def writebmap(imagepath, bmappath=None):
+    # Writes a bmap (version 2.0, sha256) listing the image blocks that hold data
+    if bmappath is None:
+        bmappath = imagepath + '.bmap'
+    imagesize = os.path.getsize(imagepath)
+    blockscount = (imagesize + blocksize - 1) // blocksize
+    ranges = []
+    mapped = 0
+    fd = os.open(imagepath, os.O_RDONLY)
+    try:
+        for offset, length in dataextents(fd):
+            first = offset // blocksize
+            last = (offset + length - 1) // blocksize
+            if ranges and ranges[-1][1] >= first - 1:
+                first = ranges.pop()[0]     # merge with an adjacent range
+            ranges.append([first, last])
+        lines = []
+        for first, last in ranges:
+            h = hashlib.sha256()
+            position = first * blocksize
+            remaining = min((last + 1) * blocksize, imagesize) - position
+            while remaining > 0:
+                chunk = os.pread(fd, min(remaining, copychunk), position)
+                h.update(chunk)
+                position += len(chunk)
+                remaining -= len(chunk)
+            mapped += last - first + 1
+            blocks = str(first) if first == last else str(first) + '-' + str(last)
+            lines.append('        <Range chksum="' + h.hexdigest() + '"> ' + blocks + ' </Range>\n')
+    finally:
+        os.close(fd)
+    text = ('<?xml version="1.0" ?>\n'
+            '<!-- Generated by Armbian-NG -->\n'
+            '<bmap version="2.0">\n'
+            '    <ImageSize> ' + str(imagesize) + ' </ImageSize>\n'
+            '    <BlockSize> ' + str(blocksize) + ' </BlockSize>\n'
+            '    <BlocksCount> ' + str(blockscount) + ' </BlocksCount>\n'
+            '    <MappedBlocksCount> ' + str(mapped) + ' </MappedBlocksCount>\n'
+            '    <ChecksumType> sha256 </ChecksumType>\n'
+            '    <BmapFileChecksum> ' + '0' * 64 + ' </BmapFileChecksum>\n'
+            '    <BlockMap>\n' + ''.join(lines) +
+            '    </BlockMap>\n'
+            '</bmap>\n')
+    # the file checksum is computed with the checksum field set to zeros
+    text = text.replace('0' * 64, hashlib.sha256(text.encode()).hexdigest(), 1)
+    with open(bmappath, 'w') as f:
+        f.write(text)
+    return bmappath
+
+def assembleimage(imagepath, filesystems, bootloader=None, firstoffset=defaultfirstoffset, align=1024 * 1024):
+    # Assembles an SD card image from filesystem images
+    # - filesystems: list of (filesystem image path, partition type), in partition order
+    # - bootloader: list of (blob path, offset) written in the space before the first partition
+    # Returns the path of the .bmap file.
+    partitions = []
+    offset = firstoffset
+    for fsimage, kind in filesystems:
+        size = os.path.getsize(fsimage)
+        size = (size + sectorsize - 1) // sectorsize * sectorsize
+        partitions.append((offset, size, kind))
+        offset = (offset + size + align - 1) // align * align
+    createimage(imagepath, offset)
+    writembr(imagepath, partitions)
+    for blob, bloboffset in bootloader or []:
+        with open(blob, 'rb') as f:
+            writeat(imagepath, f.read(), bloboffset)
+    for (fsimage, kind), partition in zip(filesystems, partitions):
+        copyinto(imagepath, fsimage, partition[0])
+    return writebmap(imagepath)
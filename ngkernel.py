@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngkernel.py - incremental out-of-tree kernel builds with ccache
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# The kernel of each board family and kernel branch is built out of tree
+# (make O=...) in an object directory that is kept between builds, in the
+# kernel-<family>-<branch> tree of the workspace (see ngworkspace.py). The
+# source checkout is never written to, so it can be shared by all families.
+#
+# Every build starts from the armbian-build kernel configuration of the family
+# (or the one saved from the configuration menu, see editconfig()), and
+# reports how it differs from the configuration of the previous build. make
+# then only recompiles what the changed options and sources affect. Compiler
+# output is also cached by ccache in cache/ccache, shared by all families, and
+# the build reports its ccache hit rate.
+#
+# When the source commit changes, the object directory is emptied first: kbuild
+# dependency files name the headers of the old source checkout by path.
+
+import os
+import re
+import glob
+import shutil
+import subprocess
+
+import ngrunner
+
+defaultccachedir = "cache/ccache"
+sourcemarker = '.ng-source'         # in the object directory, the source tree it was built from
+lastconfig = '.ng-lastconfig'       # the .config of the last successful build
+
+def readconfig(path):
+    # Returns {option: value} of a kernel .config, 'n' for options that are not set
+    options = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                match = re.match(r'^(CONFIG_\w+)=(.*)$', line) or re.match(r'^# (CONFIG_\w+) is not set$', line)
+                if match:
+                    options[match.group(1)] = match.group(2) if match.lastindex == 2 else 'n'
+    except OSError:
+        pass
+    return options
+
+def diffconfig(old, new):
+    # Returns the differences between two readconfig() results, as in scripts/diffconfig
+    changes = []
+    for option in sorted(set(old) | set(new)):
+        before, after = old.get(option, 'n'), new.get(option, 'n')
+        if before != after:
+            changes.append(option[len('CONFIG_'):] + ' ' + before + ' -> ' + after)
+    return changes
+
+def ccachestats(env):
+    # Returns (hits, misses) counted by ccache so far, or None without ccache
+    result = ngrunner.run(['ccache', '--print-stats'], env=env, check=False, capture=True)
+    if result.returncode == 0:
+        stats = dict(line.split('\t', 1) for line in result.stdout.splitlines() if '\t' in line)
+        hits = int(stats.get('direct_cache_hit', 0)) + int(stats.get('preprocessed_cache_hit', 0))
+        return hits, int(stats.get('cache_miss', 0))
+    result = ngrunner.run(['ccache', '-s'], env=env, check=False, capture=True)   # ccache before 3.7
+    if result.returncode != 0:
+        return None
+    counts = dict((m.group(1), int(m.group(2))) for m in re.finditer(r'^(cache hit \(\w+\)|cache miss)\s+(\d+)',
+                                                                        result.stdout, re.MULTILINE))
+    return counts.get('cache hit (direct)', 0) + counts.get('cache hit (preprocessed)', 0), counts.get('cache miss', 0)
+
+def compilerenv(env, useccache, ccachedir=defaultccachedir):
+    # Returns the CC to pass to make, and adds the ccache settings to env.
+    # With distcc (CC="distcc gcc"), ccache runs first and hands misses to distcc.
+    cc = env.get('CC') or 'gcc'
+    if not useccache or shutil.which('ccache') is None:
+        return cc
+    os.makedirs(ccachedir, exist_ok=True)
+    env['CCACHE_DIR'] = os.path.abspath(ccachedir)
+    env['CCACHE_BASEDIR'] = os.path.abspath('.')    # hits across source checkouts at different paths
+    if cc.startswith('distcc '):
+        env['CCACHE_PREFIX'] = 'distcc'
+        cc = cc[len('distcc '):]
+    return 'ccache ' + cc
+
+def prepareobjdir(sourcedir, treedir, localversion=''):
+    # Creates the object directory treedir/obj for sourcedir, emptying it when it
+    # was built from another source tree, returns (objdir, make command)
+    objdir = os.path.abspath(os.path.join(treedir, 'obj'))
+    make = ['make', '-C', sourcedir, 'O=' + objdir, 'ARCH=arm64', 'LOCALVERSION=' + localversion]
+
+    # an object directory only builds incrementally from the same source tree
+    source = os.path.realpath(sourcedir) + ' ' + ngrunner.run(['git', '-C', sourcedir, 'rev-parse', 'HEAD'],
+                                                             check=False, capture=True).stdout.strip()
+    marker = os.path.join(objdir, sourcemarker)
+    previous = None
+    if os.path.isfile(marker):
+        with open(marker) as f:
+            previous = f.read()
+    if os.path.isdir(objdir) and previous != source:
+        print('Kernel sources changed, rebuilding', localversion.lstrip('-'), 'kernel from scratch')
+        shutil.rmtree(objdir)
+    os.makedirs(objdir, exist_ok=True)
+    with open(marker, 'w') as f:
+        f.write(source)
+    return objdir, make
+
+def startconfig(make, objdir, baseconfig, env):
+    # Starts from the family configuration, only touching .config when it changes
+    # (its modification time makes kbuild re-check the configuration)
+    if baseconfig and os.path.isfile(baseconfig):
+        with open(baseconfig) as f:
+            wanted = f.read()
+        current = None
+        if os.path.isfile(os.path.join(objdir, '.config')):
+            with open(os.path.join(objdir, '.config')) as f:
+                current = f.read()
+        if current != wanted:
+            shutil.copyfile(baseconfig, os.path.join(objdir, '.config'))
+        ngrunner.run(make + ['olddefconfig'], env=env, name='kernel')
+    elif not os.path.isfile(os.path.join(objdir, '.config')):
+        ngrunner.run(make + ['defconfig'], env=env, name='kernel')
+
+def editconfig(sourcedir, treedir, baseconfig, env, savedconfig, localversion=''):
+    # Shows the kernel configuration menu on the terminal, starting from baseconfig,
+    # and saves the result in savedconfig. Runs before the build stages start,
+    # nothing else writes to the terminal then.
+    objdir, make = prepareobjdir(sourcedir, treedir, localversion)
+    startconfig(make, objdir, baseconfig, env)
+    subprocess.run(make + ['menuconfig'], env=env)
+    os.makedirs(os.path.dirname(savedconfig) or '.', exist_ok=True)
+    shutil.copyfile(os.path.join(objdir, '.config'), savedconfig)
+    return savedconfig
+
+def buildkernel(sourcedir, treedir, baseconfig, jobs, env, localversion='',
+                useccache=True, revision='1.0', ccachedir=defaultccachedir):
+    # Builds the kernel packages of sourcedir in treedir/obj, returns (list of .deb
+    # paths in treedir, (ccache hits, misses) of this build or None)
+    env = dict(env)
+    objdir, make = prepareobjdir(sourcedir, treedir, localversion)
+    startconfig(make, objdir, baseconfig, env)
+    changes = diffconfig(readconfig(os.path.join(objdir, lastconfig)), readconfig(os.path.join(objdir, '.config')))
+    if not os.path.isfile(os.path.join(objdir, lastconfig)):
+        print('First', localversion.lstrip('-'), 'kernel build in', objdir)
+    elif changes:
+        print(len(changes), 'kernel configuration changes since the last build:')
+        for change in changes:
+            print('   ', change)
+    else:
+        print('Kernel configuration unchanged since the last build')
+
+    # compile what is out of date and package it, the packages go in treedir
+    cc = compilerenv(env, useccache, ccachedir)
+    before = ccachestats(env) if cc.startswith('ccache ') else None
+    for deb in glob.glob(os.path.join(treedir, '*.deb')):
+        os.remove(deb)
+    ngrunner.run(make + ['-j' + str(jobs), 'CC=' + cc, 'KDEB_PKGVERSION=' + revision, 'bindeb-pkg'],
+                 env=env, name='kernel')
+    shutil.copyfile(os.path.join(objdir, '.config'), os.path.join(objdir, lastconfig))
+    stats = None
+    if before is not None:
+        after = ccachestats(env)
+        if after is not None:
+            stats = (after[0] - before[0], after[1] - before[1])
+    return sorted(glob.glob(os.path.join(treedir, '*.deb'))), stats
+
+def reportccache(stats):
+    if stats is None:
+        return
+    hits, misses = stats
+    total = hits + misses
+    print('ccache:', hits, 'hits,', misses, 'misses', '(%d%% hit rate)' % (100 * hits // total) if total else '')
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngmatrix.py - non-interactive build of a matrix of target images
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# A build matrix file lists one target image per line:
+#
+#	# board          kernel branch  distribution  image type
+#	orangepipc       current        bionic        minimal
+#	nanopik2-s905    legacy         stretch       desktop
+#
+# All targets go into one stage graph where shared work is only declared once:
+# one package download and rootfs per distribution and image type, one kernel
+# per board family and kernel branch, one u-boot per board and kernel branch.
+# The boot partition, image and compression stages of each target then fan out
+# in parallel.
+
+import os
+import sys
+
+import ngstages
+import ngconfig
+from ngscheduler import ngStage, ngScheduler
+
+def readmatrix(path):
+    # Returns the list of (board, kernel branch, distribution, image type) targets in path
+    targets = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) != 4:
+                print(path, 'line', number, ': expected board, kernel branch, distribution and image type')
+                sys.exit(1)
+            for value, choices in zip(fields[1:], (ngstages.kernelbranches, ngstages.distributions, ngstages.imagetypes)):
+                if value not in choices:
+                    print(path, 'line', number, ':', value, 'is not one of', ', '.join(choices))
+                    sys.exit(1)
+            target = tuple(fields)
+            if target not in targets:
+                targets.append(target)
+    return targets
+
+def targetstage(function, options, config, inputs, outputs):
+    # Adapts a stage function to one target of the matrix: the function sees the
+    # target options and configuration, and its inputs and outputs under their
+    # generic names (e.g. 'kernel-debs' for 'kernel-debs:sun8i-current')
+    def targetfunction(context):
+        view = dict(context)
+        view['options'] = options
+        view['config'] = config
+        for generic, specific in inputs.items():
+            view[generic] = context.get(specific)
+        result = function(view) or {}
+        return dict((outputs[generic], value) for generic, value in result.items() if generic in outputs)
+    return targetfunction
+
+def buildmatrixpipeline(armbianbranch, targets, configfile):
+    # Declares the stages of all targets in a single stage graph
+    import ngboards
+    pipeline = ngScheduler()
+    pipeline.addstage(ngStage('check-requirements', ngstages.checkrequirements,
+                              inputs=['args'], outputs=['requirements'], estimate=1))
+    artifacts = []
+    for board, kernelbranch, distribution, imagetype in targets:
+        options = ngstages.makeoptions(armbianbranch, board, kernelbranch, distribution, imagetype)
+        if options['boardfile'] is None:
+            print('Board', board, 'not found in', ngboards.boardsdir(armbianbranch))
+            if os.path.isdir(ngboards.boardsdir(armbianbranch)):
+                close = ngboards.getcatalog(armbianbranch).fuzzy(board, 5)
+                if close:
+                    print('Did you mean', ', '.join(entry['board'] for entry in close) + '?')
+            sys.exit(1)
+        config = ngconfig.loadconfig(ngconfig.configlayers(armbianbranch, board, configfile),
+                                     variables={'BRANCH': kernelbranch})
+        kernel = options['family'] + '-' + kernelbranch
+        rootfs = distribution + '-' + imagetype
+        uboot = board + '-' + kernelbranch
+        image = uboot + '-' + rootfs
+
+        if pipeline.getstage('build-kernel-' + kernel) is None:
+            pipeline.addstage(ngStage('build-kernel-' + kernel,
+                                      targetstage(ngstages.cached(ngstages.buildkernel, ngstages.kernelkey), options, config,
+                                                  {}, {'kernel-debs': 'kernel-debs:' + kernel}),
+                                      inputs=['requirements'], outputs=['kernel-debs:' + kernel], estimate=40))
+        if pipeline.getstage('build-rootfs-' + rootfs) is None:
+            pipeline.addstage(ngStage('prefetch-packages-' + rootfs,
+                                      targetstage(ngstages.prefetchpackages, options, config,
+                                                  {}, {'packages': 'packages:' + rootfs}),
+                                      inputs=['requirements'], outputs=['packages:' + rootfs], estimate=3))
+            pipeline.addstage(ngStage('build-rootfs-' + rootfs,
+                                      targetstage(ngstages.cached(ngstages.buildrootfs, ngstages.rootfskey), options, config,
+                                                  {'packages': 'packages:' + rootfs}, {'rootfs': 'rootfs:' + rootfs}),
+                                      inputs=['requirements', 'packages:' + rootfs], outputs=['rootfs:' + rootfs], estimate=22))
+        if pipeline.getstage('build-u-boot-' + uboot) is None:
+            pipeline.addstage(ngStage('build-u-boot-' + uboot,
+                                      targetstage(ngstages.cached(ngstages.builduboot, ngstages.ubootkey), options, config,
+                                                  {}, {'u-boot-debs': 'u-boot-debs:' + uboot}),
+                                      inputs=['requirements'], outputs=['u-boot-debs:' + uboot], estimate=5))
+            pipeline.addstage(ngStage('build-boot-' + uboot,
+                                      targetstage(ngstages.buildboot, options, config,
+                                                  {'kernel-debs': 'kernel-debs:' + kernel, 'u-boot-debs': 'u-boot-debs:' + uboot},
+                                                  {'boot': 'boot:' + uboot}),
+                                      inputs=['kernel-debs:' + kernel, 'u-boot-debs:' + uboot], outputs=['boot:' + uboot], estimate=2))
+        pipeline.addstage(ngStage('build-image-' + image,
+                                  targetstage(ngstages.buildimage, options, config,
+                                              {'rootfs': 'rootfs:' + rootfs, 'boot': 'boot:' + uboot},
+                                              {'image': 'image:' + image}),
+                                  inputs=['rootfs:' + rootfs, 'boot:' + uboot], outputs=['image:' + image], estimate=8))
+        pipeline.addstage(ngStage('compress-image-' + image,
+                                  targetstage(ngstages.compressimage, options, config,
+                                              {'image': 'image:' + image}, {'artifacts': 'artifacts:' + image}),
+                                  inputs=['image:' + image], outputs=['artifacts:' + image], estimate=5))
+        artifacts.append('artifacts:' + image)
+    pipeline.addstage(ngStage('cleanup', ngstages.cleanup, inputs=artifacts, estimate=1))
+    return pipeline
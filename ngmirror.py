@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngmirror.py - local mirror of the armbian-build repository and per-branch checkouts
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# All armbian-build branches share one local bare repository (the mirror), so
+# their objects are only downloaded and stored once. Each branch is checked out
+# as a git worktree of the mirror in armbian-<branch>/build, refreshed with an
+# incremental fetch on every run and checked out (detached) at the fetched
+# commit. The commit each branch was last checked out at is recorded in the
+# pins file, and reused when the fetch fails (e.g. no network).
+
+import os
+import json
+
+import ngrunner
+
+armbianbuildurl = "https://github.com/armbian/build.git"
+defaultmirrordir = "cache/armbian-build.git"
+
+def git(*args, check=False):
+    # Runs a git command, returns the CompletedProcess with its stdout as a string
+    result = ngrunner.run(['git'] + list(args), check=check, capture=True)
+    result.stdout = result.stdout.strip()
+    return result
+
+def readpins(mirrordir):
+    try:
+        with open(mirrordir + ".pins") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def writepin(mirrordir, branch, commit):
+    pins = readpins(mirrordir)
+    pins[branch] = commit
+    with open(mirrordir + ".pins.tmp", 'w') as f:
+        json.dump(pins, f, indent=1, sort_keys=True)
+    os.replace(mirrordir + ".pins.tmp", mirrordir + ".pins")
+
+def ensuremirror(mirrordir, url):
+    # Creates the bare mirror repository if it does not exist yet
+    if os.path.isdir(mirrordir):
+        git('--git-dir=' + mirrordir, 'remote', 'set-url', 'origin', url)
+        return
+    print("Creating armbian-build mirror in", mirrordir)
+    os.makedirs(os.path.dirname(mirrordir) or '.', exist_ok=True)
+    git('init', '--quiet', '--bare', mirrordir, check=True)
+    git('--git-dir=' + mirrordir, 'remote', 'add', 'origin', url, check=True)
+
+def fetchbranch(mirrordir, branch, depth=1):
+    # Incrementally fetches branch into the mirror, returns its commit or None
+    # depth=1 keeps the mirror small, use depth=0 for the full history
+    command = ['--git-dir=' + mirrordir, 'fetch', '--quiet', '--no-tags']
+    if depth:
+        command += ['--depth', str(depth)]
+    command += ['origin', '+refs/heads/' + branch + ':refs/heads/' + branch]
+    if git(*command).returncode != 0:
+        return None
+    return git('--git-dir=' + mirrordir, 'rev-parse', 'refs/heads/' + branch).stdout
+
+def checkoutbranch(branch, workdir, mirrordir=defaultmirrordir, url=armbianbuildurl, depth=1):
+    # Makes workdir a checkout of branch at its latest commit, returns the commit
+    ensuremirror(mirrordir, url)
+    commit = fetchbranch(mirrordir, branch, depth)
+    if commit is None:
+        commit = readpins(mirrordir).get(branch)
+        if commit is None:
+            print("Could not fetch armbian-build branch", branch, "from", url)
+            return None
+        print("Could not fetch armbian-build branch", branch, "using previously checked out commit", commit)
+
+    if os.path.isdir(os.path.join(workdir, '.git')):
+        # an older standalone clone, not a worktree of the mirror: update it in place
+        print("Directory", workdir, "is a standalone clone, updating it from the mirror")
+        git('-C', workdir, 'fetch', '--quiet', os.path.abspath(mirrordir), commit, check=True)
+    elif not os.path.exists(workdir):
+        git('--git-dir=' + mirrordir, 'worktree', 'prune')
+        git('--git-dir=' + mirrordir, 'worktree', 'add', '--quiet', '--detach', workdir, commit, check=True)
+        writepin(mirrordir, branch, commit)
+        return commit
+
+    if git('-C', workdir, 'rev-parse', 'HEAD').stdout != commit:
+        if git('-C', workdir, 'checkout', '--quiet', '--detach', commit).returncode != 0:
+            print("Could not update", workdir, "to", commit, "- local changes?")
+            return None
+    writepin(mirrordir, branch, commit)
+    return commit
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngpackages.py - local package cache and prefetcher for root filesystems
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# The package cache is a partial mirror of the Debian or Ubuntu archive in
+# cache/packages/<mirror host and path>/, with the same layout as the real one:
+# the suite Release files and Packages indices, and the .deb files in pool/.
+#
+# Before the rootfs is created, prefetch() refreshes the indices of the suite
+# (verified against the Release file), resolves the full set of packages of
+# the distribution and image type (required and important packages, the image
+# type packages and all their dependencies) and downloads the missing ones at
+# the same time, each verified against the sha256 of the index (see
+# ngdownload.py). localmirror() then serves the cache over HTTP on localhost,
+# so debootstrap and apt in the chroot install everything offline. The original
+# Release files are kept, so apt still checks the archive signatures.
+
+import os
+import re
+import gzip
+
+import ngdownload
+
+defaultcachedir = "cache/packages"
+architecture = 'arm64'
+
+# distribution: (configuration variable of the mirror, default mirror, suite, components)
+archives = {
+    'stretch': ('DEBIAN_MIRROR', 'deb.debian.org/debian', 'stretch', ['main']),
+    'bionic': ('UBUNTU_MIRROR', 'ports.ubuntu.com/', 'bionic', ['main', 'universe']),
+    }
+
+# packages installed on top of the required and important ones, per image type
+imagepackages = {
+    'minimal': ['ca-certificates', 'locales', 'sudo', 'openssh-server', 'network-manager', 'u-boot-tools',
+                'initramfs-tools', 'wireless-regdb', 'crda'],
+    }
+imagepackages['desktop'] = imagepackages['minimal'] + ['xserver-xorg', 'lightdm', 'xfce4', 'xfce4-terminal',
+                                                       'network-manager-gnome', 'pulseaudio', 'firefox-esr|firefox']
+
+def mirrorurl(distribution, config):
+    variable, default, suite, components = archives[distribution]
+    mirror = (config or {}).get(variable) or default
+    if '://' not in mirror:
+        mirror = 'http://' + mirror
+    return mirror.rstrip('/') + '/'
+
+def mirrordir(url, cachedir=defaultcachedir):
+    # The cache directory of a mirror, e.g. cache/packages/deb.debian.org/debian
+    return os.path.join(cachedir, url.split('://', 1)[1].strip('/'))
+
+def parserelease(path):
+    # Returns {index path: (sha256, size)} from the SHA256 section of a Release file
+    checksums = {}
+    insection = False
+    with open(path, errors='replace') as f:
+        for line in f:
+            if not line.startswith(' '):
+                insection = line.startswith('SHA256:')
+                continue
+            fields = line.split()
+            if insection and len(fields) == 3:
+                checksums[fields[2]] = (fields[0], int(fields[1]))
+    return checksums
+
+def parsepackages(path):
+    # Yields the stanzas of a Packages.gz index as dicts
+    with gzip.open(path, 'rt', errors='replace') as f:
+        stanza = {}
+        field = None
+        for line in f:
+            line = line.rstrip('\n')
+            if not line:
+                if stanza:
+                    yield stanza
+                stanza = {}
+            elif line[0] in ' \t':
+                if field:
+                    stanza[field] += '\n' + line
+            else:
+                field, _, value = line.partition(':')
+                stanza[field] = value.strip()
+        if stanza:
+            yield stanza
+
+def fetchindices(url, suite, components, cachedir=defaultcachedir, concurrency=ngdownload.defaultconcurrency):
+    # Refreshes the Release files and Packages indices of suite in the cache,
+    # returns the paths of the Packages indices. Without network, the indices
+    # of a previous build are used.
+    base = mirrordir(url, cachedir)
+    suitedir = os.path.join(base, 'dists', suite)
+    with ngdownload.pathlock(suitedir):     # image types of the same suite share the indices
+        return fetchsuiteindices(url, suite, components, base, suitedir, concurrency)
+
+def fetchsuiteindices(url, suite, components, base, suitedir, concurrency):
+    # fetchindices() with the suite directory locked
+    fresh = os.path.join(suitedir, 'new')
+    os.makedirs(fresh, exist_ok=True)
+    for name in ('Release', 'Release.gpg', 'InRelease'):
+        if os.path.isfile(os.path.join(fresh, name)):
+            os.remove(os.path.join(fresh, name))
+    failed = ngdownload.fetchall([(url + 'dists/' + suite + '/' + name, os.path.join(fresh, name), None, None)
+                                  for name in ('Release', 'Release.gpg', 'InRelease')], concurrency)
+    if not os.path.isfile(os.path.join(fresh, 'Release')):
+        if not os.path.isfile(os.path.join(suitedir, 'Release')):
+            raise ngdownload.ngDownloadError('Cannot download the ' + suite + ' Release file: ' + failed[0][1])
+        print('Could not refresh the', suite, 'package indices, using the cached ones')
+    else:
+        for name in ('Release', 'Release.gpg', 'InRelease'):
+            if os.path.isfile(os.path.join(fresh, name)):
+                os.replace(os.path.join(fresh, name), os.path.join(suitedir, name))
+            elif os.path.isfile(os.path.join(suitedir, name)):
+                os.remove(os.path.join(suitedir, name))     # would not match the new Release
+    checksums = parserelease(os.path.join(suitedir, 'Release'))
+    indices = []
+    for component in components:
+        index = component + '/binary-' + architecture + '/Packages.gz'
+        if index not in checksums:
+            raise ngdownload.ngDownloadError(index + ' is not listed in the ' + suite + ' Release file')
+        sha256, size = checksums[index]
+        # indices are stored by hash (as in the archive), so the Release file
+        # always matches the indices even when a refresh fails halfway
+        indices.append((url + 'dists/' + suite + '/' + index,
+                        os.path.join(suitedir, os.path.dirname(index), 'by-hash/SHA256', sha256), sha256, size))
+    failed = ngdownload.fetchall(indices, concurrency)
+    if failed:
+        raise ngdownload.ngDownloadError('Cannot download package indices: ' + '; '.join(e for u, e in failed))
+    # apt and debootstrap look for the indices under their usual names
+    for indexurl, path, sha256, size in indices:
+        link = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(path))), 'Packages.gz')
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.join('by-hash/SHA256', sha256), link)
+    return [index[1] for index in indices]
+
+def dependencies(stanza):
+    # Returns the dependencies of a package as lists of alternatives
+    depends = []
+    for field in ('Pre-Depends', 'Depends'):
+        for group in stanza.get(field, '').split(','):
+            alternatives = [re.sub(r'\s*\(.*?\)|:\w+|\s*\[.*?\]', '', a).strip() for a in group.split('|')]
+            alternatives = [a for a in alternatives if a]
+            if alternatives:
+                depends.append(alternatives)
+    return depends
+
+def resolve(stanzas, seeds):
+    # Returns the stanzas of the seed packages (names, "a|b" for alternatives)
+    # and of all their dependencies, plus the list of names that were not found
+    packages = {}
+    provides = {}
+    for stanza in stanzas:
+        name = stanza.get('Package')
+        if name and name not in packages:
+            packages[name] = stanza
+            for virtual in stanza.get('Provides', '').split(','):
+                virtual = re.sub(r'\s*\(.*?\)', '', virtual).strip()
+                if virtual:
+                    provides.setdefault(virtual, name)
+    selected = {}
+    missing = []
+    todo = [seed.split('|') for seed in seeds]
+    todo += [[name] for name, stanza in packages.items()
+             if stanza.get('Essential') == 'yes' or stanza.get('Priority') in ('required', 'important')]
+    while todo:
+        alternatives = todo.pop()
+        for candidate in alternatives:
+            name = candidate if candidate in packages else provides.get(candidate)
+            if name is not None:
+                break
+        else:
+            missing.append('|'.join(alternatives))
+            continue
+        if name in selected:
+            continue
+        selected[name] = packages[name]
+        todo.extend(dependencies(packages[name]))
+    return list(selected.values()), sorted(set(missing))
+
+def prefetch(distribution, imagetype, config=None, cachedir=defaultcachedir,
+             concurrency=ngdownload.defaultconcurrency):
+    # Makes sure all the packages of a distribution and image type are in the
+    # package cache. Returns a dict with the mirror url, the cache directory of
+    # the mirror, the suite and the number of packages and bytes downloaded.
+    if distribution not in archives:
+        print('No package cache for', distribution, 'yet, its root filesystem downloads its own packages')
+        return None
+    variable, default, suite, components = archives[distribution]
+    url = mirrorurl(distribution, config)
+    base = mirrordir(url, cachedir)
+    stanzas = []
+    for index in fetchindices(url, suite, components, cachedir, concurrency):
+        stanzas.extend(parsepackages(index))
+    selected, missing = resolve(stanzas, imagepackages[imagetype])
+    if missing:
+        print('Packages not found in', suite + ':', ', '.join(missing))
+    todo = [(url + s['Filename'], os.path.join(base, s['Filename']), s.get('SHA256'), int(s['Size']))
+            for s in selected if not os.path.isfile(os.path.join(base, s['Filename']))]
+    print(len(selected), distribution, imagetype, 'packages,', len(todo), 'to download (' +
+          str(sum(t[3] for t in todo) // 1024 ** 2), 'MB)')
+    failed = ngdownload.fetchall(todo, concurrency)
+    if failed:
+        for fileurl, error in failed:
+            print('Download failed:', error)
+        raise ngdownload.ngDownloadError(str(len(failed)) + ' packages could not be downloaded')
+    return {'url': url, 'mirrordir': base, 'suite': suite, 'packages': len(selected),
+            'downloaded': len(todo), 'bytes': sum(t[3] for t in todo)}
+
+class localmirror:
+    # Serves a mirror directory of the package cache over HTTP on localhost, in a
+    # with block that gives the mirror url to use in the chroot
+    def __init__(self, directory):
+        self.directory = directory
+        self.server = None
+
+    def __enter__(self):
+        import threading
+        import socketserver
+        import http.server
+        directory = os.path.abspath(self.directory)
+
+        class handler(http.server.SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                path = http.server.SimpleHTTPRequestHandler.translate_path(self, path)
+                return os.path.join(directory, os.path.relpath(path, os.getcwd()))
+
+            def log_message(self, *args):
+                pass
+
+        class server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self.server = server(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, name='package-mirror', daemon=True).start()
+        return 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/'
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
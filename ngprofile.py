@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngprofile.py - build host resource profile and automatic tuning
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Armbian-NG runs on anything from 2 GB boards to 128 GB servers. Instead of one
+# hardcoded setting, we look at the cores and memory the build can really use
+# (including cgroup limits, e.g. in a container) and at the storage of the work
+# directory, and derive:
+#
+# - makejobs: make -j for kernel and u-boot compilation, one per core as long
+#   as each compiler job has jobmemory of RAM
+# - compressthreads: xz/zstd threads, limited by the memory each thread needs
+#   at the configured compression level
+# - parallelstages: how many build stages may run at the same time
+# - tmpfs, tmpfssize: whether the hot build trees fit in RAM next to the
+#   compilers, and how much RAM they may use
+#
+# Each of them can be set in the configuration file instead (MAKE_JOBS,
+# COMPRESS_THREADS, PARALLEL_STAGES, USE_TMPFS, TMPFS_SIZE), 0 or auto means
+# use the value derived here.
+
+import os
+
+MiB = 1024 ** 2
+GiB = 1024 ** 3
+
+jobmemory = 512 * MiB           # per gcc job compiling the kernel
+reservedmemory = 512 * MiB      # for the system and build.py itself
+tmpfsminimum = 6 * GiB          # smallest useful tmpfs workspace (kernel objects + rootfs)
+stagememory = 2 * GiB           # per concurrent compile heavy stage
+
+def compressmemory(formatname, level):
+    # Approximate memory used by one compressor thread at a compression level
+    if formatname == 'xz':
+        return 100 * MiB if level <= 6 else 700 * MiB
+    return 128 * MiB if level <= 19 else 1024 * MiB    # zstd --ultra levels use big windows
+
+def readfirst(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+def cgroupcpus():
+    # Returns the CPU limit of our cgroup as a number of cores, or None
+    quota = readfirst('/sys/fs/cgroup/cpu.max').split()     # cgroup v2: "max 100000" or "200000 100000"
+    if len(quota) == 2 and quota[0] != 'max':
+        return max(1, -(-int(quota[0]) // int(quota[1])))
+    quota = readfirst('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')   # cgroup v1
+    period = readfirst('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return max(1, -(-int(quota) // int(period)))
+    return None
+
+def cgroupmemory():
+    # Returns (limit, usage) in bytes of our cgroup, or (None, None)
+    for limitfile, usagefile in (('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+                                 ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+                                  '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        limit = readfirst(limitfile)
+        if limit.isdigit() and int(limit) < 2 ** 60:    # v1 "no limit" is a huge number
+            usage = readfirst(usagefile)
+            return int(limit), int(usage) if usage.isdigit() else 0
+    return None, None
+
+def meminfo():
+    info = {}
+    for line in readfirst('/proc/meminfo').splitlines():
+        name, _, value = line.partition(':')
+        if value.split():
+            info[name] = int(value.split()[0]) * 1024
+    return info
+
+def disktype(path):
+    # Returns 'flash' (SD card, eMMC), 'ssd', 'hdd', 'ram' or 'unknown' for the device holding path
+    try:
+        device = os.stat(path).st_dev
+    except OSError:
+        return 'unknown'
+    if os.major(device) == 0:
+        return 'ram' if ismemoryfs(path) else 'unknown'      # tmpfs, overlay, nfs...
+    sysdir = os.path.realpath('/sys/dev/block/%d:%d' % (os.major(device), os.minor(device)))
+    if not os.path.isdir(os.path.join(sysdir, 'queue')):
+        sysdir = os.path.dirname(sysdir)    # a partition, the queue is on the whole disk
+    name = os.path.basename(sysdir)
+    if name.startswith('mmcblk'):
+        return 'flash'
+    rotational = readfirst(os.path.join(sysdir, 'queue/rotational'))
+    if rotational == '1':
+        return 'hdd'
+    if rotational == '0':
+        return 'ssd'
+    return 'unknown'
+
+def ismemoryfs(path):
+    # True if the mount point holding path is a tmpfs or ramfs
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    for line in readfirst('/proc/mounts').splitlines():
+        fields = line.split()
+        if len(fields) > 2 and (path == fields[1] or path.startswith(fields[1].rstrip('/') + '/')):
+            if len(fields[1]) > len(best):
+                best, fstype = fields[1], fields[2]
+    return fstype in ('tmpfs', 'ramfs')
+
+def hostprofile(workdir='.'):
+    # Returns a dict describing the resources available to the build
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    limit = cgroupcpus()
+    if limit is not None:
+        cores = min(cores, limit)
+    info = meminfo()
+    total = info.get('MemTotal', 0)
+    available = info.get('MemAvailable', info.get('MemFree', 0))
+    limit, usage = cgroupmemory()
+    if limit is not None:
+        total = min(total, limit)
+        available = min(available, limit - usage)
+    disk = os.statvfs(workdir)
+    return {'cores': cores, 'memorytotal': total, 'memoryavailable': max(available, 0),
+            'diskfree': disk.f_bavail * disk.f_frsize, 'disktype': disktype(workdir)}
+
+def tune(profile, config):
+    # Returns the build tuning for a host profile, with the settings of the
+    # configuration file taking precedence over the derived ones
+    cores = profile['cores']
+    memory = max(profile['memoryavailable'] - reservedmemory, jobmemory)
+
+    makejobs = config.get('MAKE_JOBS') or max(1, min(cores, memory // jobmemory))
+
+    perthread = max(compressmemory(f, config.get(f.upper() + '_LEVEL', 6)) for f in config.get('IMAGE_COMPRESSION') or ['xz'])
+    compressthreads = config.get('COMPRESS_THREADS') or max(1, min(cores, memory // perthread))
+
+    # kernel, u-boot and rootfs stages can overlap, if there is memory for them
+    # 0 lets the scheduler run as many as can run at the same time
+    parallelstages = config.get('PARALLEL_STAGES')
+    if not parallelstages:
+        parallelstages = 0 if cores > 2 and memory >= 3 * stagememory else max(1, min(cores, memory // stagememory))
+
+    # tmpfs for the build trees, with what is left next to the compilers
+    spare = memory - makejobs * jobmemory
+    tmpfssize = (config.get('TMPFS_SIZE') or 0) * GiB or spare // 2 // GiB * GiB
+    usetmpfs = str(config.get('USE_TMPFS', 'auto')).lower()
+    if usetmpfs in ('auto', ''):
+        tmpfs = tmpfssize >= tmpfsminimum and profile['disktype'] != 'ram'
+    else:
+        tmpfs = usetmpfs in ('yes', 'true', 'on', '1')
+        tmpfssize = max(tmpfssize, GiB)
+
+    return {'makejobs': makejobs, 'compressthreads': compressthreads, 'parallelstages': parallelstages,
+            'tmpfs': tmpfs, 'tmpfssize': tmpfssize if tmpfs else 0}
+
+def report(profile, tuning):
+    print('Build host:', profile['cores'], 'cores,',
+          round(profile['memoryavailable'] / GiB, 1), 'of', round(profile['memorytotal'] / GiB, 1), 'GB memory available,',
+          round(profile['diskfree'] / GiB, 1), 'GB free on', profile['disktype'], 'storage')
+    print('Build tuning: make -j' + str(tuning['makejobs']) + ',', tuning['compressthreads'], 'compressor threads,',
+          tuning['parallelstages'] or 'all possible', 'concurrent stages,',
+          'tmpfs workspace of ' + str(tuning['tmpfssize'] // GiB) + ' GB' if tuning['tmpfs'] else 'no tmpfs workspace')
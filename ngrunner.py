@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngrunner.py - asynchronous command runner with streamed, leveled logging
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# All the commands of a build (git, make, debootstrap, mkfs...) are run through
+# run(). Their stdout and stderr are read line by line as they come and logged
+# with the Python logging library, stdout lines at DEBUG level and stderr lines
+# at INFO level, each line tagged with the command name. Whole lines are logged
+# at once, so commands running at the same time in different stages never mix
+# their output within a line. What reaches the terminal depends on the -V flag
+# (see setuplogging()), the log file always gets everything.
+#
+# The last lines of output of each command are kept in a ring buffer, and
+# included in the error raised when the command fails or times out.
+
+import os
+import sys
+import signal
+import logging
+import collections
+import subprocess
+
+defaultlogfile = "output/logs/build.log"
+defaultringsize = 50    # lines of output kept for failure reports
+
+class ngCommandError(Exception):
+    # Raised when a command fails or times out, str() includes its last lines of output
+    def __init__(self, command, returncode, tail, timedout=False):
+        self.command = command
+        self.returncode = returncode
+        self.tail = list(tail)
+        self.timedout = timedout
+        if timedout:
+            reason = 'timed out'
+        else:
+            reason = 'failed with exit code ' + str(returncode)
+        Exception.__init__(self, ' '.join(command) + ' ' + reason +
+                           ''.join('\n    ' + line for line in self.tail))
+
+def setuplogging(verbosity=0, logfile=defaultlogfile):
+    # Sends log records to the terminal and to logfile
+    # verbosity 0: warnings and errors only, 1: also command stderr, 2: everything
+    levels = [logging.WARNING, logging.INFO, logging.DEBUG]
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    logging.getLogger('asyncio').setLevel(logging.WARNING)
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(levels[min(verbosity, len(levels) - 1)])
+    console.setFormatter(logging.Formatter('%(name)s: %(message)s'))
+    root.addHandler(console)
+    if logfile:
+        os.makedirs(os.path.dirname(logfile) or '.', exist_ok=True)
+        handler = logging.FileHandler(logfile, 'w')
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s: %(message)s'))
+        root.addHandler(handler)
+
+async def readlines(stream, logger, level, tail, captured):
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        text = line.decode(errors='replace').rstrip('\n')
+        if captured is not None:
+            captured.append(text)
+        tail.append(text)
+        if logger.isEnabledFor(level):
+            logger.log(level, text)
+
+async def runasync(command, name=None, cwd=None, env=None, timeout=None, capture=False,
+                   ringsize=defaultringsize):
+    # Runs command, returns a subprocess.CompletedProcess. With capture=True its
+    # stdout is returned as a string instead of being logged.
+    import asyncio      # only loaded when a command runs, not on the startup path
+    logger = logging.getLogger('armbian-ng.' + (name or os.path.basename(command[0])))
+    logger.debug('running ' + ' '.join(command))
+    process = await asyncio.create_subprocess_exec(
+        *command, cwd=cwd, env=env,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,    # its own process group, so a timeout kills all of it
+        limit=1024 * 1024)         # longest output line
+    tail = collections.deque(maxlen=ringsize)
+    captured = [] if capture else None
+    readers = asyncio.gather(readlines(process.stdout, logger, logging.DEBUG, tail, captured),
+                             readlines(process.stderr, logger, logging.INFO, tail, None),
+                             process.wait())
+    try:
+        await asyncio.wait_for(readers, timeout)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await process.wait()
+        logger.error(' '.join(command) + ' timed out after ' + str(timeout) + ' seconds')
+        raise ngCommandError(command, process.returncode, tail, timedout=True)
+    stdout = '\n'.join(captured) if capture else None
+    return subprocess.CompletedProcess(command, process.returncode, stdout, None), tail
+
+def runloop(coroutine):
+    # Runs a coroutine on a new event loop, build stages run in different threads
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def runthreaded(command, name=None, cwd=None, env=None, timeout=None, capture=False,
+                ringsize=defaultringsize):
+    # Same as runasync(), with one reader thread per stream instead of an event loop.
+    # Used before Python 3.8, where asyncio child processes need a child watcher.
+    import threading
+    logger = logging.getLogger('armbian-ng.' + (name or os.path.basename(command[0])))
+    logger.debug('running ' + ' '.join(command))
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               start_new_session=True)
+    tail = collections.deque(maxlen=ringsize)
+    captured = [] if capture else None
+    def readlines(stream, level, captured):
+        for line in stream:
+            text = line.decode(errors='replace').rstrip('\n')
+            if captured is not None:
+                captured.append(text)
+            tail.append(text)
+            if logger.isEnabledFor(level):
+                logger.log(level, text)
+    readers = [threading.Thread(target=readlines, args=(process.stdout, logging.DEBUG, captured)),
+               threading.Thread(target=readlines, args=(process.stderr, logging.INFO, None))]
+    for reader in readers:
+        reader.start()
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        for reader in readers:
+            reader.join()
+        logger.error(' '.join(command) + ' timed out after ' + str(timeout) + ' seconds')
+        raise ngCommandError(command, process.returncode, tail, timedout=True)
+    for reader in readers:
+        reader.join()
+    stdout = '\n'.join(captured) if capture else None
+    return subprocess.CompletedProcess(command, process.returncode, stdout, None), tail
+
+def runone(command, name, cwd, env, timeout, capture, ringsize):
+    # Before Python 3.8 a new event loop has no child watcher attached to it, on
+    # the main thread too, so child processes are always run with threads there
+    if sys.version_info < (3, 8):
+        return runthreaded(command, name, cwd, env, timeout, capture, ringsize)
+    return runloop(runasync(command, name, cwd, env, timeout, capture, ringsize))
+
+def run(command, name=None, cwd=None, env=None, timeout=None, check=True, capture=False,
+        ringsize=defaultringsize):
+    # Runs command and waits for it, see runasync(). With check=True a failure
+    # raises ngCommandError, otherwise the caller checks returncode.
+    result, tail = runone(command, name, cwd, env, timeout, capture, ringsize)
+    if check and result.returncode != 0:
+        logging.getLogger('armbian-ng.' + (name or os.path.basename(command[0]))).error(
+            ' '.join(command) + ' failed with exit code ' + str(result.returncode))
+        raise ngCommandError(command, result.returncode, tail)
+    return result
+
+def runmany(commands, timeout=None, check=True):
+    # Runs several commands at the same time, commands is a list of (name, command).
+    # Returns the list of CompletedProcess, in the same order.
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(commands), 1)) as pool:
+        futures = [pool.submit(run, command, name, timeout=timeout, check=check) for name, command in commands]
+        return [future.result() for future in futures]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngscheduler.py - dependency graph based stage scheduler for build.py
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+import sys
+
+class ngStage:
+    # A single build pipeline stage
+    # - name: stage name, e.g. 'build-kernel'
+    # - function: called with the shared build context (a dict), returns a dict
+    #   with a value for each of the stage outputs (or None if there are none)
+    # - inputs: names of the context entries the stage needs
+    # - outputs: names of the context entries the stage produces
+    # - estimate: expected stage duration in minutes, used for the critical path
+    def __init__(self, name, function, inputs=(), outputs=(), estimate=1):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.estimate = estimate
+
+class ngScheduler:
+    # Builds a dependency graph from the stage inputs and outputs and runs
+    # independent stages at the same time on a pool of worker threads
+    def __init__(self):
+        self.stages = []
+
+    def addstage(self, stage):
+        self.stages.append(stage)
+        return stage
+
+    def getstage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        return None
+
+    def dependencies(self):
+        # Returns {stage name: set of stage names it depends on}
+        # Inputs not produced by any stage are external, i.e. already in the context
+        producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in producers:
+                    print('Output', output, 'is produced by both', producers[output], 'and', stage.name)
+                    sys.exit(1)
+                producers[output] = stage.name
+        deps = {}
+        for stage in self.stages:
+            deps[stage.name] = set(producers[i] for i in stage.inputs if i in producers)
+        return deps
+
+    def order(self):
+        # Topological order of the stages, grouped in waves of stages that can run together
+        deps = self.dependencies()
+        done = set()
+        waves = []
+        while len(done) < len(self.stages):
+            wave = [s.name for s in self.stages if s.name not in done and deps[s.name] <= done]
+            if not wave:
+                print('Circular dependency between stages', ', '.join(sorted(set(deps) - done)))
+                sys.exit(1)
+            waves.append(wave)
+            done.update(wave)
+        return waves
+
+    def criticalpath(self):
+        # Returns (list of stage names, total estimate) for the longest dependency chain
+        deps = self.dependencies()
+        finish = {}
+        previous = {}
+        for wave in self.order():
+            for name in wave:
+                start = 0
+                previous[name] = None
+                for dep in deps[name]:
+                    if finish[dep] > start:
+                        start = finish[dep]
+                        previous[name] = dep
+                finish[name] = start + self.getstage(name).estimate
+        if not finish:
+            return [], 0
+        name = max(finish, key=lambda n: finish[n])
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.insert(0, name)
+            name = previous[name]
+        return path, total
+
+    def dryrun(self):
+        # Prints what would run in parallel and the critical path, without running anything
+        print('Build pipeline, stages in the same step can run in parallel:')
+        for step, wave in enumerate(self.order(), 1):
+            print('  step', step, ':', ', '.join(wave))
+        path, total = self.criticalpath()
+        serial = sum(s.estimate for s in self.stages)
+        print('Critical path:', ' -> '.join(path))
+        print('Estimated build time: approximately', total, 'minutes (' + str(serial), 'minutes if run serially)')
+
+    def run(self, context, workers=0):
+        # Runs all stages, each one as soon as all its dependencies are done
+        # workers = 0 means one worker per stage that can run at the same time,
+        # up to the number of cores
+        import os
+        import threading
+        import concurrent.futures   # loaded here, dry runs don't need it
+        deps = self.dependencies()
+        self.order()    # exits on circular dependencies before anything runs
+        if workers <= 0:
+            widest = max(len(wave) for wave in self.order()) if self.stages else 1
+            workers = min(widest, os.cpu_count() or 1)
+        lock = threading.Lock()
+        done = set()
+        running = {}
+        failed = None
+
+        def runstage(stage):
+            # With a build state (see ngstate.py), a stage still valid since the
+            # previous build is skipped, and every completed stage is recorded
+            state = context.get('state')
+            if state is not None:
+                with lock:
+                    key = state.stagekey(stage, context)
+                    result = state.valid(stage, key) if state.resume else None
+                    if result is not None:
+                        print('Stage', stage.name, 'is up to date, skipping it')
+                        for output in stage.outputs:
+                            context[output] = result.get(output)
+                        return result
+                    state.discard(stage)
+            telemetry = context.get('telemetry')
+            if telemetry is None:
+                result = stage.function(context)
+            else:
+                with telemetry.span(stage.name, 'stage'):
+                    result = stage.function(context)
+            with lock:
+                for output in stage.outputs:
+                    context[output] = (result or {}).get(output)
+                if state is not None:
+                    state.record(stage, key, dict((o, context[o]) for o in stage.outputs))
+            return result
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stage') as pool:
+            while len(done) < len(self.stages) and failed is None:
+                for stage in self.stages:
+                    if stage.name not in done and stage.name not in running.values() and deps[stage.name] <= done:
+                        running[pool.submit(runstage, stage)] = stage.name
+                finished, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        print('Stage', name, 'failed:', future.exception())
+                        failed = name
+                    else:
+                        done.add(name)
+            # let stages already running finish before giving up
+            concurrent.futures.wait(running)
+        if failed is not None:
+            sys.exit(1)
+        return context
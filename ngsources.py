@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngsources.py - concurrent, verified download of kernel and u-boot sources
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Kernel and u-boot sources are set as in armbian-build, by the board family
+# configuration or the user configuration file:
+#
+#	KERNELSOURCE="https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux-stable.git"
+#	KERNELBRANCH="branch:linux-4.19.y"      (or tag:<tag> or commit:<sha1>)
+#	BOOTSOURCE="https://github.com/u-boot/u-boot.git"
+#	BOOTBRANCH="tag:v2019.04"
+#
+# A source can also be a release tarball, verified with KERNELSOURCE_SHA256 or
+# BOOTSOURCE_SHA256 when set.
+#
+# All sources go into a shared cache in cache/sources/: one bare git repository
+# per source url, whatever the family or branch, and one checkout per commit,
+# shared by all the boards built from it. Git sources are fetched shallow, a
+# commit: source must fetch exactly that commit. Tarballs are downloaded with
+# ngdownload.py, resumed when interrupted and checked against their sha256.
+# Only the defaultkeeptrees most recently used checkouts are kept.
+#
+# ngSourceFetcher fetches in the background, a few sources at a time, as soon
+# as build.py knows a board and kernel branch (while the user is still making
+# the other choices in the user interface, or right away for a build matrix).
+# The compile stages then wait for their sources with result().
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+import ngmirror
+import ngrunner
+import ngdownload
+
+defaultcachedir = "cache/sources"
+logger = logging.getLogger('armbian-ng.sources')
+
+# used when the board family configuration does not set the sources
+defaultkernelsource = "https://git.kernel.org/pub/scm/linux/kernel/git/stable/linux-stable.git"
+defaultkernelbranches = {'legacy': 'branch:linux-4.19.y', 'current': 'branch:linux-5.1.y'}
+defaultbootsource = "https://github.com/u-boot/u-boot.git"
+defaultbootbranch = "tag:v2019.04"
+
+tarballs = ('.tar.xz', '.tar.gz', '.tar.bz2', '.tgz')
+defaultkeeptrees = 8    # source checkouts kept in the cache, the least recently used ones are removed
+
+def kernelsource(config, kernelbranch):
+    # Returns the (kind, url, ref, sha256) source spec of a kernel
+    url = config.get('KERNELSOURCE') or defaultkernelsource
+    ref = config.get('KERNELBRANCH') or defaultkernelbranches.get(kernelbranch, 'branch:master')
+    return sourcespec(url, ref, config.get('KERNELSOURCE_SHA256'))
+
+def bootsource(config):
+    # Returns the (kind, url, ref, sha256) source spec of u-boot
+    url = config.get('BOOTSOURCE') or defaultbootsource
+    ref = config.get('BOOTBRANCH') or defaultbootbranch
+    return sourcespec(url, ref, config.get('BOOTSOURCE_SHA256'))
+
+def sourcespec(url, ref, sha256=None):
+    if url.endswith(tarballs):
+        return ('tarball', url, None, sha256 or None)
+    return ('git', url, ref, None)
+
+def targetsources(armbianbranch, board, kernelbranch, configfile):
+    # Returns the kernel and u-boot source specs of a target
+    import ngconfig
+    config = ngconfig.loadconfig(ngconfig.configlayers(armbianbranch, board, configfile),
+                                 variables={'BRANCH': kernelbranch})
+    if not config.get('KERNELSOURCE'):
+        logger.warning('the configuration of ' + str(board) + ' sets no KERNELSOURCE for the ' + kernelbranch +
+                       ' branch, using ' + defaultkernelsource)
+    return [kernelsource(config, kernelbranch), bootsource(config)]
+
+def cachename(url):
+    # Directory name of a source in the cache, readable and unique per url
+    name = os.path.basename(url.rstrip('/'))
+    for suffix in ('.git',) + tarballs:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name + '-' + hashlib.sha1(url.encode()).hexdigest()[:12]
+
+def gitref(ref):
+    # Returns the refspec to fetch for an armbian-build style branch:, tag: or commit: ref
+    kind, _, name = (ref or 'branch:master').partition(':')
+    if not name:
+        kind, name = 'branch', kind
+    if kind == 'tag':
+        return 'refs/tags/' + name
+    if kind == 'commit':
+        return name
+    return 'refs/heads/' + name
+
+class ngSourceFetcher:
+    def __init__(self, concurrency=ngdownload.defaultconcurrency, cachedir=defaultcachedir, keeptrees=defaultkeeptrees):
+        self.concurrency = concurrency
+        self.cachedir = cachedir
+        self.keeptrees = keeptrees
+        self.pool = None
+        self.futures = {}       # source spec: future of its result
+        self.lock = threading.Lock()
+        self.repolocks = {}     # one fetch at a time into each bare repository
+        self.used = set()       # the checkouts of this build, never pruned
+        self.prunelock = threading.Lock()
+
+    def repolock(self, repo):
+        with self.lock:
+            return self.repolocks.setdefault(repo, threading.Lock())
+
+    def use(self, tree):
+        # Marks a checkout as used by this build and as recently used
+        with self.lock:
+            self.used.add(tree)
+        os.utime(tree)
+
+    def start(self, specs):
+        # Starts fetching the sources in the background, each source only once
+        import concurrent.futures
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency,
+                                                                  thread_name_prefix='source')
+            for spec in specs:
+                if spec not in self.futures:
+                    logger.info('fetching ' + ' '.join(s for s in spec[1:3] if s))
+                    self.futures[spec] = self.pool.submit(self.fetch, spec)
+
+    def result(self, spec):
+        # Waits for a source and returns a dict with its checkout 'path', 'commit'
+        # (git) or 'sha256' (tarball). Raises ngDownloadError if it could not be fetched.
+        self.start([spec])
+        return self.futures[spec].result()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+    def fetch(self, spec):
+        if spec[0] == 'tarball':
+            result = self.fetchtarball(*spec[1:])
+        else:
+            result = self.fetchgit(*spec[1:3])
+        self.prune()
+        return result
+
+    def prune(self):
+        # Removes the least recently used checkouts beyond keeptrees, the way
+        # ngcache evicts artifacts. The refs/ng/<commit> ref of a git checkout
+        # goes too, so that git gc can drop its objects.
+        with self.prunelock:
+            treesdir = os.path.join(self.cachedir, 'trees')
+            entries = []
+            for name in os.listdir(treesdir) if os.path.isdir(treesdir) else []:
+                tree = os.path.join(treesdir, name)
+                try:
+                    if not name.endswith('.tmp'):
+                        entries.append((os.stat(tree).st_mtime, tree))
+                except FileNotFoundError:
+                    continue
+            repos = set()
+            for mtime, tree in sorted(entries)[:max(len(entries) - self.keeptrees, 0)]:
+                repo = os.path.join(self.cachedir, 'git', os.path.basename(tree).rpartition('-')[0] + '.git')
+                with self.repolock(repo):
+                    with self.lock:
+                        if tree in self.used:
+                            continue
+                    logger.info('removing least recently used source checkout ' + tree)
+                    if os.path.isdir(repo):
+                        commit = ngmirror.git('-C', tree, 'rev-parse', 'HEAD').stdout
+                        ngmirror.git('--git-dir=' + repo, 'worktree', 'remove', '--force', tree)
+                        if commit:
+                            ngmirror.git('--git-dir=' + repo, 'update-ref', '-d', 'refs/ng/' + commit)
+                        repos.add(repo)
+                    shutil.rmtree(tree, ignore_errors=True)
+            for repo in repos:
+                with self.repolock(repo):
+                    ngmirror.git('--git-dir=' + repo, 'worktree', 'prune')
+                    ngmirror.git('--git-dir=' + repo, 'gc', '--quiet', '--prune=now')
+
+    def readpins(self):
+        try:
+            with open(os.path.join(self.cachedir, 'pins.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def writepin(self, url, ref, commit):
+        with self.lock:
+            pins = self.readpins()
+            pins[url + ' ' + ref] = commit
+            path = os.path.join(self.cachedir, 'pins.json')
+            with open(path + '.tmp', 'w') as f:
+                json.dump(pins, f, indent=1, sort_keys=True)
+            os.replace(path + '.tmp', path)
+
+    def fetchgit(self, url, ref):
+        repo = os.path.join(self.cachedir, 'git', cachename(url) + '.git')
+        refspec = gitref(ref)
+        with self.repolock(repo):
+            if not os.path.isdir(repo):
+                ngmirror.git('init', '--quiet', '--bare', repo, check=True)
+                ngmirror.git('--git-dir=' + repo, 'remote', 'add', 'origin', url, check=True)
+            fetched = ngmirror.git('--git-dir=' + repo, 'fetch', '--quiet', '--no-tags', '--depth', '1',
+                                   'origin', refspec)
+            if fetched.returncode == 0:
+                commit = ngmirror.git('--git-dir=' + repo, 'rev-parse', 'FETCH_HEAD^{commit}').stdout
+                # keep the commit reachable, a later fetch of another ref replaces FETCH_HEAD
+                ngmirror.git('--git-dir=' + repo, 'update-ref', 'refs/ng/' + commit, commit, check=True)
+                self.writepin(url, ref, commit)
+            else:
+                commit = self.readpins().get(url + ' ' + ref)
+                if commit is None:
+                    raise ngdownload.ngDownloadError('Cannot fetch ' + ref + ' from ' + url)
+                logger.warning('could not fetch ' + ref + ' from ' + url + ', using previously fetched commit ' + commit)
+            if ref.startswith('commit:') and not commit.startswith(ref[len('commit:'):]):
+                raise ngdownload.ngDownloadError(url + ' ' + ref + ' fetched commit ' + commit)
+            tree = os.path.join(self.cachedir, 'trees', cachename(url) + '-' + commit[:12])
+            if os.path.isdir(tree):
+                head = ngmirror.git('-C', tree, 'rev-parse', 'HEAD').stdout
+                if head != commit:
+                    raise ngdownload.ngDownloadError(tree + ' is at ' + head + ' instead of ' + commit)
+            else:
+                ngmirror.git('--git-dir=' + repo, 'worktree', 'prune')
+                ngmirror.git('--git-dir=' + repo, 'worktree', 'add', '--quiet', '--detach', tree, commit, check=True)
+            self.use(tree)
+        logger.info(url + ' ' + ref + ' is at ' + commit + ' in ' + tree)
+        return {'path': tree, 'commit': commit}
+
+    def fetchtarball(self, url, ref, sha256):
+        name = os.path.basename(url)
+        tarball = ngdownload.download(url, os.path.join(self.cachedir, 'tarballs', name), sha256)
+        if sha256 is None:
+            import ngcache
+            sha256 = ngcache.hashfile(tarball).hexdigest()
+        tree = os.path.join(self.cachedir, 'trees', cachename(url) + '-' + sha256[:12])
+        if not os.path.isdir(tree):
+            ngrunner.run(['rm', '-rf', tree + '.tmp'])
+            os.makedirs(tree + '.tmp')
+            ngrunner.run(['tar', '-xf', tarball, '-C', tree + '.tmp', '--strip-components=1'], name='tar')
+            os.rename(tree + '.tmp', tree)
+        self.use(tree)
+        logger.info(url + ' sha256 ' + sha256 + ' in ' + tree)
+        return {'path': tree, 'sha256': sha256}
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngstages.py - the Armbian-NG build pipeline stages
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+import os
+
+import ngsupportfunc
+import ngcache
+from ngtelemetry import span
+from ngscheduler import ngStage, ngScheduler
+
+# Each stage function gets the shared build context, a dict holding the command
+# line arguments ('args'), the merged configuration files ('config', see
+# ngconfig.py), the user options ('options'), the artifact cache
+# ('cache', None when disabled), the build telemetry ('telemetry', use span() to
+# time substages), the build checkpoints ('state', see ngstate.py), the host
+# tuning ('tuning', see ngprofile.py, use tuned()), the build workspace
+# ('workspace', see ngworkspace.py, use worktree()), the kernel and u-boot
+# source downloads ('sources', see ngsources.py, use source()) and the outputs
+# of the stages it depends on.
+# It returns a dict with a value for each of its outputs, file paths in the
+# outputs are checked by --resume to still be there before skipping the stage.
+
+# Codes of the choices offered by the user interface, in the order they are shown
+buildoptions = ['kernel', 'image']
+kernelbranches = ['legacy', 'current']
+distributions = ['stretch', 'bionic', 'arch', 'alpine']
+imagetypes = ['minimal', 'desktop']
+
+def makeoptions(armbianbranch, board=None, kernelbranch='legacy', distribution='bionic',
+                imagetype='minimal', kernelconfigedit=False, buildoption='image'):
+    # Returns the build options dict for a target, the defaults are the ones of the
+    # user interface. The board configuration file and family come from the board catalog.
+    import ngboards
+    options = {'board': board, 'boardfile': None, 'family': None, 'kernelconfig': None,
+               'kernelbranch': kernelbranch, 'distribution': distribution, 'imagetype': imagetype,
+               'kernelconfigedit': kernelconfigedit, 'buildoption': buildoption}
+    entry = None
+    if board and os.path.isdir(ngboards.boardsdir(armbianbranch)):
+        entry = ngboards.getcatalog(armbianbranch).get(board)
+    if entry is not None:
+        options['boardfile'] = os.path.join(ngboards.boardsdir(armbianbranch), entry['file'])
+        options['family'] = entry['family'] or board
+        options['kernelconfig'] = os.path.join("armbian-" + armbianbranch, "build/config/kernel",
+                                               "linux-" + options['family'] + "-" + kernelbranch + ".config")
+    return options
+
+def optionvalue(context, name):
+    # Returns a user option, or None if it was not set
+    options = context.get('options')
+    if isinstance(options, dict):
+        return options.get(name)
+    return None
+
+def tuned(context, name):
+    # Returns a host tuning value (e.g. 'makejobs'), or 0 (automatic) without a tuning
+    tuning = context.get('tuning')
+    if isinstance(tuning, dict):
+        return tuning.get(name, 0)
+    return 0
+
+def worktree(context, name, size=0, keep=False):
+    # Returns a context manager giving the directory of a hot build tree, in RAM
+    # when the workspace has room for size bytes, see ngworkspace.ngWorkspace.tree()
+    workspace = context.get('workspace')
+    if workspace is None:
+        import ngworkspace
+        workspace = ngworkspace.ngWorkspace()
+    return workspace.tree(name, size, keep)
+
+def source(context, spec):
+    # Returns the fetched kernel or u-boot source of spec, waiting for its download
+    # when it was started earlier, see ngsources.ngSourceFetcher.result()
+    import ngsources
+    fetcher = context.get('sources')
+    if fetcher is None:
+        fetcher = ngsources.ngSourceFetcher()
+    with span(context, 'wait-sources'):
+        return fetcher.result(spec)
+
+# The options each cached stage depends on, shared stages must not depend on
+# board specific options: the kernel is built once per family and branch, the
+# rootfs once per distribution and image type.
+fileoptions = ('boardfile', 'kernelconfig')    # their file contents are hashed
+sourceoptions = ('kernelsource', 'bootsource')  # the source spec and fetched commit or tarball sha256
+kernelkey = ('family', 'kernelbranch', 'kernelconfig', 'kernelsource')
+ubootkey = ('boardfile', 'kernelbranch', 'bootsource')
+rootfskey = ('distribution', 'imagetype')
+
+def sourcekey(context, name):
+    # Returns the cache key part of the kernel or u-boot source: its spec, and the
+    # commit a branch or tag resolved to, or the sha256 of the tarball
+    import ngsources
+    if name == 'kernelsource':
+        spec = ngsources.kernelsource(context['config'], str(optionvalue(context, 'kernelbranch')))
+    else:
+        spec = ngsources.bootsource(context['config'])
+    fetched = source(context, spec)
+    return [list(spec), fetched.get('commit') or fetched.get('sha256')]
+
+def cached(function, keyoptions):
+    # Wraps a stage function so that it restores its outputs from the artifact
+    # cache when all its inputs are unchanged since an earlier build. The key
+    # covers the armbian-build commit and local changes and the user options
+    # and sources listed in keyoptions.
+    def cachedfunction(context):
+        cache = context.get('cache')
+        if cache is None:
+            return function(context)
+        if keyoptions and not isinstance(context.get('options'), dict):
+            # without the user options every target would get the same key
+            return function(context)
+        args = context['args']
+        parts = [function.__name__, ngcache.treestate("armbian-" + args.armbianbranch + "/build")]
+        for name in keyoptions:
+            if name in fileoptions:
+                parts.append(('file', optionvalue(context, name)))
+            elif name in sourceoptions:
+                parts.append(sourcekey(context, name))
+            else:
+                parts.append(optionvalue(context, name))
+        key = ngcache.inputskey(*parts)
+        with span(context, function.__name__ + '-cache-lookup'):
+            outputs = cache.lookup(key)
+        if outputs is not None:
+            ngsupportfunc.armbianngmsg('Restored ' + function.__name__ + ' outputs from the artifact cache')
+            return outputs
+        outputs = function(context)
+        with span(context, function.__name__ + '-cache-store'):
+            cache.store(key, outputs)
+        return outputs
+    cachedfunction.__name__ = function.__name__
+    return cachedfunction
+
+def editkernelconfig(context):
+    # Shows the kernel configuration menu when the user asked for it, before the
+    # stages start (they write to the terminal too). Returns the options to build
+    # with: the edited configuration, saved in output/config, replaces the family
+    # one, so the kernel stage is cached by its contents like any other.
+    options = context.get('options')
+    if not isinstance(options, dict) or not options.get('kernelconfigedit'):
+        return options
+    import ngsources
+    import ngkernel
+    family = str(options['family'])
+    kernelbranch = str(options['kernelbranch'])
+    ngsupportfunc.armbianngmsg('Configuring ' + family + ' ' + kernelbranch + ' kernel...')
+    kernelsource = source(context, ngsources.kernelsource(context['config'], kernelbranch))
+    saved = os.path.join("output/config", "linux-" + family + "-" + kernelbranch + ".config")
+    with worktree(context, 'kernel-' + family + '-' + kernelbranch, 6 * 1024 ** 3, keep=True) as tree:
+        ngkernel.editconfig(kernelsource['path'], tree, options['kernelconfig'], dict(os.environ), saved, '-' + family)
+    return dict(options, kernelconfig=saved, kernelconfigedit=False)
+
+def checkrequirements(context):
+    ngsupportfunc.armbianngmsg('Checking build requirements...')
+    return {'requirements': True}
+
+def buildkernel(context):
+    ngsupportfunc.armbianngmsg('Building ' + str(optionvalue(context, 'family')) + ' ' +
+                               str(optionvalue(context, 'kernelbranch')) + ' kernel packages...')
+    import ngdistcc
+    import ngsources
+    import ngkernel
+    import ngworkspace
+    args = context['args']
+    config = context['config']
+    family = str(optionvalue(context, 'family'))
+    kernelbranch = str(optionvalue(context, 'kernelbranch'))
+    kernelsource = source(context, ngsources.kernelsource(config, kernelbranch))
+    with span(context, 'distcc-probe'):
+        jobs, env = ngdistcc.kernelbuildenv(config['DISTCC_POOL'], args.distcc, tuned(context, 'makejobs') or None)
+    # the object directory is kept for the next build of this family and branch
+    with worktree(context, 'kernel-' + family + '-' + kernelbranch, 6 * 1024 ** 3, keep=True) as tree:
+        with span(context, 'compile-kernel'):
+            debs, stats = ngkernel.buildkernel(kernelsource['path'], tree, optionvalue(context, 'kernelconfig'),
+                                               jobs, env, '-' + family, config['USE_CCACHE'])
+        ngkernel.reportccache(stats)
+        debs = [ngworkspace.copyout(deb, os.path.join("output/debs", os.path.basename(deb))) for deb in debs]
+    return {'kernel-debs': debs}
+
+def builduboot(context):
+    import ngsources
+    ngsupportfunc.armbianngmsg('Building u-boot packages for ' + str(optionvalue(context, 'board')) + '...')
+    source(context, ngsources.bootsource(context['config']))     # u-boot is not compiled yet
+    return {'u-boot-debs': []}
+
+def prefetchpackages(context):
+    # Downloads all the packages of the root filesystem into the package cache
+    import ngpackages
+    ngsupportfunc.armbianngmsg('Downloading ' + str(optionvalue(context, 'distribution')) + ' ' +
+                               str(optionvalue(context, 'imagetype')) + ' packages...')
+    config = context['config']
+    return {'packages': ngpackages.prefetch(optionvalue(context, 'distribution'), optionvalue(context, 'imagetype'),
+                                            config, concurrency=config['DOWNLOAD_CONCURRENCY'])}
+
+def buildrootfs(context):
+    # The packages stage output is the package cache mirror of the distribution
+    # (None without one), served on localhost for the chroot to install offline
+    import ngpackages
+    packages = context.get('packages')
+    if packages is None:
+        ngsupportfunc.armbianngmsg('Creating ' + str(optionvalue(context, 'distribution')) + ' ' +
+                                   str(optionvalue(context, 'imagetype')) + ' root filesystem...')
+        return {'rootfs': None}
+    with ngpackages.localmirror(packages['mirrordir']) as mirror:
+        ngsupportfunc.armbianngmsg('Creating ' + str(optionvalue(context, 'distribution')) + ' ' +
+                                   str(optionvalue(context, 'imagetype')) + ' root filesystem from ' + mirror + '...')
+    return {'rootfs': None}
+
+def buildboot(context):
+    ngsupportfunc.armbianngmsg('Creating boot partition for ' + str(optionvalue(context, 'board')) + '...')
+    return {'boot': None}
+
+def buildimage(context):
+    # The rootfs stage output is the root filesystem tree, the boot stage output a
+    # boot filesystem image. Both go into a sparse image with a .bmap next to it.
+    import ngimage
+    ngsupportfunc.armbianngmsg('Assembling ' + str(optionvalue(context, 'board')) + ' image...')
+    rootfs = context.get('rootfs')
+    if not rootfs or not os.path.isdir(rootfs):
+        return {'image': None}
+    import ngworkspace
+    name = '-'.join(str(optionvalue(context, o)) for o in ('board', 'kernelbranch', 'distribution', 'imagetype'))
+    # leave 30% and 256 MiB free on the root filesystem
+    size = ngcache.dirsize(rootfs) * 13 // 10 + 256 * 1024 * 1024
+    # the filesystem and image are built in the workspace, the finished image
+    # and its bmap are then copied to output/images
+    with worktree(context, 'image-' + name, 2 * size) as workdir:
+        rootfsimage = os.path.join(workdir, name + ".img.rootfs")
+        with span(context, 'mkfs-rootfs'):
+            ngimage.makeext4(rootfs, rootfsimage, size // 4096 * 4096)
+        filesystems = [(rootfsimage, 'linux')]
+        if context.get('boot'):
+            filesystems.insert(0, (context['boot'], 'linux'))
+        workimage = os.path.join(workdir, name + ".img")
+        with span(context, 'assemble-image'):
+            bmap = ngimage.assembleimage(workimage, filesystems)
+        os.remove(rootfsimage)
+        image = os.path.join("output/images", name + ".img")
+        with span(context, 'copy-out-image'):
+            ngworkspace.copyout(workimage, image)
+            ngworkspace.copyout(bmap, image + ".bmap")
+        os.remove(workimage)
+        os.remove(bmap)
+    return {'image': image}
+
+def compressimage(context):
+    # Compresses the image and writes its checksums and manifest in a single read pass
+    import ngcompress
+    image = context.get('image')
+    if not image:
+        return {'artifacts': None}
+    config = context['config']
+    ngsupportfunc.armbianngmsg('Compressing ' + os.path.basename(image) + '...')
+    manifest = ngcompress.compressimage(image, config['IMAGE_COMPRESSION'],
+                                        {'xz': config['XZ_LEVEL'], 'zstd': config['ZSTD_LEVEL']},
+                                        tuned(context, 'compressthreads'))
+    return {'artifacts': manifest}
+
+def cleanup(context):
+    ngsupportfunc.armbianngmsg('Cleaning up...')
+    return None
+
+def buildpipeline():
+    # Declares the build stages with their inputs, outputs and estimated duration
+    # in minutes on a typical Aarch64 build host. Kernel and u-boot compilation
+    # only depend on the requirements check, so they overlap with the rootfs stage.
+    pipeline = ngScheduler()
+    pipeline.addstage(ngStage('check-requirements', checkrequirements,
+                              inputs=['args', 'options'], outputs=['requirements'], estimate=1))
+    pipeline.addstage(ngStage('build-kernel', cached(buildkernel, kernelkey),
+                              inputs=['requirements'], outputs=['kernel-debs'], estimate=40))
+    pipeline.addstage(ngStage('build-u-boot', cached(builduboot, ubootkey),
+                              inputs=['requirements'], outputs=['u-boot-debs'], estimate=5))
+    pipeline.addstage(ngStage('prefetch-packages', prefetchpackages,
+                              inputs=['requirements'], outputs=['packages'], estimate=3))
+    pipeline.addstage(ngStage('build-rootfs', cached(buildrootfs, rootfskey),
+                              inputs=['requirements', 'packages'], outputs=['rootfs'], estimate=22))
+    pipeline.addstage(ngStage('build-boot', buildboot,
+                              inputs=['kernel-debs', 'u-boot-debs'], outputs=['boot'], estimate=2))
+    pipeline.addstage(ngStage('build-image', buildimage,
+                              inputs=['rootfs', 'boot'], outputs=['image'], estimate=8))
+    pipeline.addstage(ngStage('compress-image', compressimage,
+                              inputs=['image'], outputs=['artifacts'], estimate=5))
+    pipeline.addstage(ngStage('cleanup', cleanup,
+                              inputs=['artifacts'], estimate=1))
+    return pipeline
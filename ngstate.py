@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngstate.py - build checkpoints, to resume a failed or interrupted build
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Every time a build stage completes, the scheduler records it in the state
+# file output/build-state.json together with its outputs and a key: a hash of
+# the armbian-build tree state, the configuration, the user options and the
+# values of the stage inputs. Files and directories named in the inputs are
+# hashed by path, size and modification time, not by contents, so that a
+# multi-GB image does not need to be read again.
+#
+# With --resume, a stage whose key is unchanged and whose output files are
+# still there is skipped and its recorded outputs put back in the context.
+# A stage that runs again gives its dependents new input files, and so new
+# keys: everything after the first invalid or failed stage runs again.
+
+import os
+import json
+import hashlib
+
+defaultstatefile = "output/build-state.json"
+
+# Context entries that never go into a stage key
+volatile = ('args', 'cache', 'telemetry', 'state', 'tuning', 'workspace', 'sources')
+
+def paths(value):
+    # Returns the existing file and directory paths found in a stage output value
+    if isinstance(value, str):
+        return [value] if os.path.exists(value) else []
+    if isinstance(value, (list, tuple)):
+        return [p for v in value for p in paths(v)]
+    if isinstance(value, dict):
+        return [p for v in value.values() for p in paths(v)]
+    return []
+
+def fingerprint(path):
+    # Identifies a version of a file or directory without reading it
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if os.path.isdir(path):
+        return ['dir', stat.st_mtime_ns]
+    return [stat.st_size, stat.st_mtime_ns]
+
+class ngBuildState:
+    def __init__(self, statefile=defaultstatefile):
+        self.statefile = statefile
+        self.tree = None
+        self.resume = False
+        self.options = None
+        self.stages = {}    # stage name: {'key', 'outputs', 'files'}
+
+    def load(self):
+        # Reads the state of the previous build, returns False if there is none
+        try:
+            with open(self.statefile) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.options = state.get('options')
+        self.stages = state.get('stages', {})
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.statefile) or '.', exist_ok=True)
+        with open(self.statefile + '.tmp', 'w') as f:
+            json.dump({'options': self.options, 'stages': self.stages}, f, indent=1, sort_keys=True, default=str)
+        os.replace(self.statefile + '.tmp', self.statefile)
+
+    def start(self, tree, options, resume):
+        # Starts recording a build of the armbian-build tree state tree,
+        # a build that is not resumed forgets all the previous checkpoints
+        self.tree = tree
+        self.resume = resume
+        self.options = options
+        if not resume:
+            self.stages = {}
+        self.save()
+
+    def stagekey(self, stage, context):
+        h = hashlib.sha256()
+        values = [stage.name, self.tree, context.get('config'), context.get('options')]
+        for name in stage.inputs:
+            if name in volatile:
+                continue
+            value = context.get(name)
+            values.append([name, value, [[p, fingerprint(p)] for p in paths(value)]])
+        h.update(json.dumps(values, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def valid(self, stage, key):
+        # Returns the recorded outputs of stage if it completed with the same key
+        # and its output files are unchanged, otherwise None
+        entry = self.stages.get(stage.name)
+        if entry is None or entry['key'] != key:
+            return None
+        for path, recorded in entry['files']:
+            if fingerprint(path) != recorded:
+                return None
+        return entry['outputs'] or {}
+
+    def discard(self, stage):
+        # Called when a stage starts running, its outputs are about to change
+        if self.stages.pop(stage.name, None) is not None:
+            self.save()
+
+    def record(self, stage, key, outputs):
+        files = [[p, fingerprint(p)] for p in paths(outputs)]
+        self.stages[stage.name] = {'key': key, 'outputs': outputs, 'files': files}
+        self.save()
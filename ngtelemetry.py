@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngtelemetry.py - per-stage build timing and host resource sampling
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Every build stage (and any substage a stage wants to time) is recorded as a
+# span with its start and end time and thread. A background thread samples the
+# host every few seconds from /proc: CPU use, memory in use, RSS of build.py and
+# its children, disk and network traffic. At the end of the build we write
+#
+# - trace.json, in Chrome trace event format: open it in chrome://tracing or
+#   https://ui.perfetto.dev to see the stages on a timeline with the counters
+# - summary.json, stable and sorted, for CI to diff between two builds
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+defaultoutputdir = "output/telemetry"
+sampleinterval = 2.0    # seconds
+
+def readproc(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ''
+
+def cputimes():
+    # Returns (busy, total) jiffies of all CPUs from /proc/stat
+    fields = readproc('/proc/stat').split('\n', 1)[0].split()[1:]
+    if not fields:
+        return 0, 0
+    values = [int(v) for v in fields]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)   # idle + iowait
+    return sum(values) - idle, sum(values)
+
+def memoryused():
+    # Returns the memory in use (MemTotal - MemAvailable) in bytes
+    info = {}
+    for line in readproc('/proc/meminfo').splitlines():
+        name, _, value = line.partition(':')
+        info[name] = int(value.split()[0]) * 1024 if value.split() else 0
+    return info.get('MemTotal', 0) - info.get('MemAvailable', 0)
+
+def treerss(pid=None):
+    # Returns the total RSS in bytes of a process and all its descendants
+    pid = pid or os.getpid()
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        stat = readproc('/proc/' + entry + '/stat')
+        if not stat:
+            continue
+        fields = stat.rsplit(')', 1)[-1].split()
+        children.setdefault(int(fields[1]), []).append(int(entry))
+        rss[int(entry)] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    todo = [pid]
+    while todo:
+        p = todo.pop()
+        total += rss.get(p, 0)
+        todo.extend(children.get(p, []))
+    return total
+
+def diskbytes():
+    # Returns (read, written) bytes of all whole disks from /proc/diskstats
+    read = written = 0
+    for line in readproc('/proc/diskstats').splitlines():
+        fields = line.split()
+        if len(fields) < 10 or fields[2].startswith(('loop', 'ram', 'dm-')):
+            continue
+        if os.path.exists('/sys/block/' + fields[2]):    # whole disks only, not partitions
+            read += int(fields[5]) * 512
+            written += int(fields[9]) * 512
+    return read, written
+
+def networkbytes():
+    # Returns (received, sent) bytes of all network interfaces but lo from /proc/net/dev
+    received = sent = 0
+    for line in readproc('/proc/net/dev').splitlines()[2:]:
+        name, _, values = line.partition(':')
+        if name.strip() == 'lo':
+            continue
+        fields = values.split()
+        received += int(fields[0])
+        sent += int(fields[8])
+    return received, sent
+
+class ngTelemetry:
+    def __init__(self):
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.spans = []         # (name, category, start, end, thread)
+        self.samples = []       # (time, cpu %, memory, rss, disk read, disk written, net rx, net tx)
+        self.stopping = threading.Event()
+        self.sampler = None
+        self.first = None
+
+    def now(self):
+        return time.time() - self.start
+
+    @contextlib.contextmanager
+    def span(self, name, category='substage'):
+        # Times the code in a with block
+        start = self.now()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.spans.append((name, category, start, self.now(), threading.current_thread().name))
+
+    def sample(self, previouscpu):
+        busy, total = cputimes()
+        cpu = 0.0
+        if total > previouscpu[1]:
+            cpu = 100.0 * (busy - previouscpu[0]) / (total - previouscpu[1])
+        values = (self.now(), round(cpu, 1), memoryused(), treerss()) + diskbytes() + networkbytes()
+        if self.first is None:
+            self.first = values
+        self.samples.append(values)
+        return busy, total
+
+    def startsampling(self, interval=sampleinterval):
+        def sampler():
+            previous = cputimes()
+            while True:
+                previous = self.sample(previous)
+                if self.stopping.wait(interval):
+                    return
+        self.sampler = threading.Thread(target=sampler, name='telemetry', daemon=True)
+        self.sampler.start()
+
+    def stopsampling(self):
+        if self.sampler is not None:
+            self.stopping.set()
+            self.sampler.join()
+            self.sampler = None
+
+    def summary(self):
+        # Returns a dict of the build totals, stable enough to diff between builds
+        stages = {}
+        for name, category, start, end, thread in self.spans:
+            key = category + ':' + name
+            stages[key] = round(stages.get(key, 0) + end - start, 3)
+        summary = {'total_seconds': round(self.now(), 3), 'spans': stages}
+        if self.samples:
+            last = self.samples[-1]
+            summary.update({
+                'cpu_percent_avg': round(sum(s[1] for s in self.samples) / len(self.samples), 1),
+                'memory_used_peak_mb': round(max(s[2] for s in self.samples) / 1e6, 1),
+                'rss_peak_mb': round(max(s[3] for s in self.samples) / 1e6, 1),
+                'disk_read_mb': round((last[4] - self.first[4]) / 1e6, 1),
+                'disk_written_mb': round((last[5] - self.first[5]) / 1e6, 1),
+                'network_received_mb': round((last[6] - self.first[6]) / 1e6, 1),
+                'network_sent_mb': round((last[7] - self.first[7]) / 1e6, 1),
+                })
+        return summary
+
+    def chrometrace(self):
+        # Returns the Chrome trace event format dict of the spans and samples
+        events = []
+        threads = {}
+        for name, category, start, end, thread in self.spans:
+            tid = threads.setdefault(thread, len(threads) + 1)
+            events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': 1, 'tid': tid,
+                           'ts': int(start * 1e6), 'dur': int((end - start) * 1e6)})
+        for thread, tid in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread}})
+        for s in self.samples:
+            ts = int(s[0] * 1e6)
+            events.append({'name': 'cpu %', 'ph': 'C', 'pid': 1, 'ts': ts, 'args': {'cpu': s[1]}})
+            events.append({'name': 'memory MB', 'ph': 'C', 'pid': 1, 'ts': ts,
+                           'args': {'used': round(s[2] / 1e6, 1), 'build rss': round(s[3] / 1e6, 1)}})
+            events.append({'name': 'disk MB', 'ph': 'C', 'pid': 1, 'ts': ts,
+                           'args': {'read': round((s[4] - self.first[4]) / 1e6, 1),
+                                    'written': round((s[5] - self.first[5]) / 1e6, 1)}})
+            events.append({'name': 'network MB', 'ph': 'C', 'pid': 1, 'ts': ts,
+                           'args': {'received': round((s[6] - self.first[6]) / 1e6, 1),
+                                    'sent': round((s[7] - self.first[7]) / 1e6, 1)}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, outputdir=defaultoutputdir):
+        # Writes trace.json and summary.json, returns the summary
+        os.makedirs(outputdir, exist_ok=True)
+        with open(os.path.join(outputdir, 'trace.json'), 'w') as f:
+            json.dump(self.chrometrace(), f)
+        summary = self.summary()
+        with open(os.path.join(outputdir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        return summary
+
+def span(context, name):
+    # Times a substage of a build stage, does nothing when telemetry is off
+    telemetry = context.get('telemetry') if context else None
+    if telemetry is None:
+        return contextlib.suppress()    # an empty context manager
+    return telemetry.span(name)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngtui.py - console user input interface using npyscreen, used by ngsupportfunc.dialog()
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# This module is only imported when the user interface is displayed, so that
+# non-interactive runs of build.py don't pay for loading npyscreen and curses.
+
+import npyscreen
+
+import ngboards
+import ngstages
+
+ngver = "Armbian-NG"    # set by ngsupportfunc.dialog()
+armbianbranch = "master"    # ditto
+onbranch = None     # ditto, called with the board and kernel branch as soon as both are selected
+
+class ngTUI(npyscreen.NPSAppManaged):
+    def onStart(self):
+        # Set the theme. DefaultTheme is used by default
+        # npyscreen.setTheme(npyscreen.Themes.ElegantTheme)
+        # Option values selected by the user, returned by ngsupportfunc.dialog()
+        self.options = {}
+        # Sequential list of forms
+        self.addForm("MAIN", myTUI, name= (ngver + " - Build Configuration User Interface - General instructions"))
+        self.addForm("First", myTUI1, name= (ngver + " - Build selection"))
+        self.addForm("Second", myTUI2, name= (ngver + " - Kernel configuration editing"))
+        self.addForm("Third", myTUI3, name= (ngver + " - Target board configuration file selection"))
+        self.addForm("Fourth", myTUI4, name= (ngver + " - Kernel branch selection"))
+        self.addForm("Fifth", myTUI5, name= (ngver + " - Linux distribution selection"))
+        self.addForm("Sixth", myTUI6, name= (ngver + " - Image type selection"))
+        self.addForm("Summary", SummaryTUI, name= (ngver + " - Summary of user selected build options"))
+
+class myTUI(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.parentApp.setNextForm("First")
+        self.edit()
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription0 = self.add(npyscreen.FixedText, editable=False,
+                              value="* The following screens allow the user to configure the Armbian-NG build process.")
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="* Option selection is done by moving to an option with <Tab> or the arrow keys,")
+        self.choiceDescription1a = self.add(npyscreen.FixedText, editable=False,
+                              value="  then selecting that option with <Enter>.")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value="* The default option is indicated on each screen.")
+        self.choiceDescription3 = self.add(npyscreen.FixedText, editable=False,
+                              value="* To move from one screen to the next, select <OK>.")
+    def on_ok(self):
+        self.parentApp.switchForm("First")
+
+class myTUI1(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm("Second")
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="Select what to build and press <Enter>")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value="Default is to build full OS image")
+        # leave an empty line
+        self.nextrely += 1
+        # get user input
+        self.kernelOnly = self.add(npyscreen.MultiLine, relx=20,
+                              values=["U-boot and kernel packages only", "Full OS image for flashing"])
+
+    def on_ok(self):
+        # send input value to Summary form and move to next form
+        toSummary = self.parentApp.getForm("Summary")
+        toSummary.ko.value = self.kernelOnly.values[self.kernelOnly.value] # value is an index into values list
+        self.parentApp.options['buildoption'] = ngstages.buildoptions[self.kernelOnly.value]
+        self.parentApp.switchForm("Second")
+
+class myTUI2(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm("Third")
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="Select kernel configuration editing option and press <Enter>")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value="Default is to not change the kernel configuration")
+        # leave an empty line
+        self.nextrely += 1
+        # get user input
+        self.kernelConfigEdit = self.add(npyscreen.MultiLine, relx=20,
+                              values=["Do not change the default kernel configuration", "Show a kernel configuration menu before compiling"])
+
+    def on_ok(self):
+        # send input value to Summary form and move to next form
+        toSummary = self.parentApp.getForm("Summary")
+        toSummary.kc.value = self.kernelConfigEdit.values[self.kernelConfigEdit.value] # value is an index into values list
+        self.parentApp.options['kernelconfigedit'] = self.kernelConfigEdit.value == 1
+        self.parentApp.switchForm("Third")
+
+class boardPrefix(npyscreen.TitleText):
+    # narrows the board list to the boards whose name starts with what is typed
+    def when_value_edited(self):
+        self.parent.showboards(self.value)
+
+class myTUI3(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm("Fourth")
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="Select target board configuration file and press <Enter>")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value=".conf = officially supported target board")
+        self.choiceDescription3 = self.add(npyscreen.FixedText, editable=False,
+                              value=".csc  = community supported target board")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value=".wip  = work in progress")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value=".eos  = support ended")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value=".tvb  = TV Box")
+        # leave an empty line
+        self.nextrely += 1
+        # get user input, boards come from the board catalog, type the start of
+        # a board name to narrow the list, or press "l" to search it
+        self.catalog = ngboards.getcatalog(armbianbranch)
+        self.boardPrefix = self.add(boardPrefix, name="Board name starts with:", begin_entry_at=24)
+        self.favFile = self.add(npyscreen.MultiLine, relx=4)
+        self.showboards()
+
+    def showboards(self, prefix=''):
+        self.boards = self.catalog.prefix(prefix) if prefix else self.catalog.filter()
+        self.favFile.values = ["%-30s %-8s %-24s %s" % (b['file'], b['family'], ','.join(b['kernelbranches']), b['name'])
+                               for b in self.boards]
+        self.favFile.value = None
+        self.favFile.cursor_line = 0
+        self.favFile.display()
+
+    def on_ok(self):
+        # send input value to Summary form and move to next form
+        toSummary = self.parentApp.getForm("Summary")
+        if self.favFile.value is not None:
+            toSummary.tf.value = self.boards[self.favFile.value]['file'] # value is an index into the board list
+            self.parentApp.options['board'] = self.boards[self.favFile.value]['board']
+        self.parentApp.switchForm("Fourth")
+
+class myTUI4(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm("Fifth")
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="Select target kernel branch and press <Enter>")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value="Default is vendor/legacy kernel")
+        self.choiceDescription3 = self.add(npyscreen.FixedText, editable=False,
+                              value="Exact kernel versions depend on selected target board")
+        # leave an empty line
+        self.nextrely += 1
+        # get user input
+        self.kernelVer = self.add(npyscreen.MultiLine, relx=20,
+                              values=["Vendor provided / Legacy (3.xx - 4.xx)", "Mainline (4.xx - 5.xx)"])
+
+    def on_ok(self):
+        # send input value to Summary form and move to next form
+        toSummary = self.parentApp.getForm("Summary")
+        toSummary.kv.value = self.kernelVer.values[self.kernelVer.value] # value is an index into values list
+        self.parentApp.options['kernelbranch'] = ngstages.kernelbranches[self.kernelVer.value]
+        if onbranch is not None and self.parentApp.options.get('board'):
+            onbranch(self.parentApp.options['board'], self.parentApp.options['kernelbranch'])
+        self.parentApp.switchForm("Fifth")
+
+class myTUI5(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm("Sixth")
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="Select target Linux distribution/release and press <Enter>")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value="Default is Ubuntu 18.04")
+        # leave an empty line
+        self.nextrely += 1
+        # get user input
+        self.linuxDistVer = self.add(npyscreen.MultiLine, relx=20,
+                              values=["Debian Stretch 9.x", 
+                                      "Ubuntu Bionic 18.04",
+                                      "Arch Linux",
+                                      "Alpine Linux"])
+
+    def on_ok(self):
+        # send input value to Summary form and move to next form
+        toSummary = self.parentApp.getForm("Summary")
+        toSummary.ld.value = self.linuxDistVer.values[self.linuxDistVer.value] # value is an index into values list
+        self.parentApp.options['distribution'] = ngstages.distributions[self.linuxDistVer.value]
+        self.parentApp.switchForm("Sixth")
+
+class myTUI6(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm("Summary")
+
+    def create(self):
+        # non-selectable text
+        self.choiceDescription1 = self.add(npyscreen.FixedText, editable=False,
+                              value="Select Linux image type (desktop/server) and press <Enter>")
+        self.choiceDescription2 = self.add(npyscreen.FixedText, editable=False,
+                              value="Default is minimal server image")
+        # leave an empty line
+        self.nextrely += 1
+        # get user input
+        self.distImageType = self.add(npyscreen.MultiLine, relx=20,
+                              values=["Minimal Linux server image, console interface", 
+                                      "Full Linux desktop image, graphical interface"])
+
+    def on_ok(self):
+        # send input value to Summary form and move to next form
+        toSummary = self.parentApp.getForm("Summary")
+        toSummary.it.value = self.distImageType.values[self.distImageType.value] # value is an index into values list
+        self.parentApp.options['imagetype'] = ngstages.imagetypes[self.distImageType.value]
+        self.parentApp.switchForm("Summary")
+
+class SummaryTUI(npyscreen.ActionFormMinimal):
+    def activate(self):
+        self.edit()
+        self.parentApp.setNextForm(None)
+
+    def create(self):
+        # display selected options
+        self.ko = self.add(npyscreen.TitleFixedText, editable=False, name="Build option selection:        ")
+        self.kc = self.add(npyscreen.TitleFixedText, editable=False, name="Kernel config option selection:")
+        self.tf = self.add(npyscreen.TitleFixedText, editable=False, name="Target board file selection:   ")
+        self.kv = self.add(npyscreen.TitleFixedText, editable=False, name="Kernel version selection:      ")
+        self.ld = self.add(npyscreen.TitleFixedText, editable=False, name="Linux distribution selection:  ")
+        self.it = self.add(npyscreen.TitleFixedText, editable=False, name="Image type selection:          ")
+        
+    def on_ok(self):
+        self.parentApp.setNextForm(None)
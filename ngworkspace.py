@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# ngworkspace.py - RAM-backed build workspace with spill to disk
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# check Armbian-NG as well as standard Armbian documentation for more info
+
+# Kernel compilation and debootstrap write and read tens of thousands of small
+# files, which is slow on the SD cards and eMMC of most ARM build hosts. Build
+# stages ask the workspace for their hot trees by name (e.g. the kernel object
+# directory of a family) with tree(). When the host has memory to spare (see
+# ngprofile.py) trees are put on a tmpfs, mounted in work/tmpfs (or a directory
+# in /dev/shm when we cannot mount), otherwise in work/<name> on disk. What a
+# killed build left in RAM is removed when the next build opens the workspace.
+#
+# The tmpfs has a budget. When it is exceeded, or the host runs low on memory,
+# the least recently used trees that no stage is using are moved to their place
+# on disk, while the other stages keep entering and leaving their trees. The
+# size of each tree is measured when a stage is done with it. At the end of
+# the build, trees to keep (e.g. kernel objects, for the next incremental
+# build) are moved to disk and the others deleted. Stages copy their final
+# artifacts out of the workspace with copyout(), which never leaves a partial
+# file at the destination.
+
+import os
+import glob
+import time
+import shutil
+import threading
+import contextlib
+
+import ngcache
+import ngrunner
+import ngprofile
+
+defaultdiskdir = "work"
+shmdir = "/dev/shm"
+ownerfile = '.ng-owner'    # in the mounted tmpfs, the pid of the build using it
+lowmemory = 1024 ** 3      # spill when the host has less memory available than this
+
+def isrunning(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass    # running, as another user
+    return True
+
+class ngTree:
+    def __init__(self, name, keep):
+        self.name = name
+        self.keep = keep
+        self.inram = False
+        self.moving = False     # being copied between RAM and disk
+        self.size = 0           # bytes, when last measured
+        self.users = 0
+        self.lastuse = time.time()
+
+class ngWorkspace:
+    def __init__(self, diskdir=defaultdiskdir, size=0):
+        # size is the tmpfs budget in bytes, 0 means everything on disk
+        self.diskdir = diskdir
+        self.size = size
+        self.ramdir = None
+        self.mounted = False
+        self.trees = {}
+        self.used = 0           # bytes of the budget taken by the trees in RAM
+        self.lock = threading.Lock()
+        self.moved = threading.Condition(self.lock)
+
+    def open(self):
+        os.makedirs(self.diskdir, exist_ok=True)
+        if not self.size:
+            return
+        ramdir = os.path.join(self.diskdir, 'tmpfs')
+        os.makedirs(ramdir, exist_ok=True)
+        result = None
+        if self.removestale(ramdir):
+            result = ngrunner.run(['mount', '-t', 'tmpfs', '-o', 'size=' + str(self.size) + ',mode=0755',
+                                   'tmpfs', ramdir], check=False)
+        if result is not None and result.returncode == 0:
+            self.mounted = True
+            with open(os.path.join(ramdir, ownerfile), 'w') as f:
+                f.write(str(os.getpid()))
+        elif os.path.isdir(shmdir) and ngprofile.ismemoryfs(shmdir):
+            ramdir = os.path.join(shmdir, 'armbian-ng-' + str(os.getpid()))
+            os.makedirs(ramdir, exist_ok=True)
+        else:
+            print('Could not mount a tmpfs workspace, building on disk')
+            return
+        self.ramdir = ramdir
+        print('Using a', self.size // 1024 ** 2, 'MB tmpfs workspace in', ramdir)
+
+    def removestale(self, ramdir):
+        # Removes the RAM directories of earlier builds that were killed before
+        # close(): /dev/shm/armbian-ng-<pid> of a process that is gone, and a tmpfs
+        # still mounted on ramdir. Returns False when ramdir is the tmpfs of a
+        # build that is still running.
+        for path in glob.glob(os.path.join(shmdir, 'armbian-ng-*')):
+            pid = path.rpartition('-')[2]
+            if pid.isdigit() and not isrunning(int(pid)):
+                print('Workspace: removing', path, 'left by an earlier build')
+                shutil.rmtree(path, ignore_errors=True)
+        if not os.path.ismount(ramdir):
+            return True
+        try:
+            with open(os.path.join(ramdir, ownerfile)) as f:
+                owner = int(f.read())
+        except (OSError, ValueError):
+            owner = None
+        if owner is not None and owner != os.getpid() and isrunning(owner):
+            print('Workspace:', ramdir, 'is used by the running build', owner)
+            return False
+        print('Workspace: unmounting the tmpfs left mounted on', ramdir, 'by an earlier build')
+        return ngrunner.run(['umount', ramdir], check=False).returncode == 0
+
+    def diskpath(self, name):
+        return os.path.join(self.diskdir, name)
+
+    def rampath(self, name):
+        return os.path.join(self.ramdir, name)
+
+    def path(self, name):
+        tree = self.trees.get(name)
+        if tree is not None and tree.inram:
+            return self.rampath(name)
+        return self.diskpath(name)
+
+    def movetree(self, source, destination):
+        # Moves a tree between filesystems, the destination only appears once complete
+        # (cp -a keeps device nodes, ownership and hard links of rootfs trees)
+        shutil.rmtree(destination + '.tmp', ignore_errors=True)
+        ngrunner.run(['cp', '-a', source, destination + '.tmp'])
+        shutil.rmtree(destination, ignore_errors=True)
+        os.rename(destination + '.tmp', destination)
+        shutil.rmtree(source)
+
+    def victims(self, needed=0):
+        # Picks the least recently used idle trees to move to disk so that needed
+        # more bytes fit in the budget and the host is not short of memory, and
+        # Returns (trees to move, whether needed fits). Called with the lock held,
+        # the caller marks the trees as moving and moves them after releasing it.
+        victims = []
+        used = self.used
+        available = ngprofile.meminfo().get('MemAvailable', lowmemory)
+        for tree in sorted(self.trees.values(), key=lambda t: t.lastuse):
+            if used + needed <= self.size and available >= lowmemory:
+                break
+            if not tree.inram or tree.users or tree.moving:
+                continue
+            victims.append(tree)
+            used -= tree.size
+            available += tree.size
+        return victims, used + needed <= self.size
+
+    def spill(self, victims):
+        # Moves trees picked by victims() to disk, without the lock held
+        for tree in victims:
+            print('Workspace: moving', tree.name, 'to disk (' + str(tree.size // 1024 ** 2), 'MB)')
+            try:
+                self.movetree(self.rampath(tree.name), self.diskpath(tree.name))
+            finally:
+                with self.lock:
+                    if not os.path.isdir(self.rampath(tree.name)):
+                        tree.inram = False
+                        self.used -= tree.size
+                    tree.moving = False
+                    self.moved.notify_all()
+
+    def movein(self, tree):
+        # Moves a tree reserved in the budget from disk to RAM, without the lock held
+        try:
+            if os.path.isdir(self.diskpath(tree.name)):
+                self.movetree(self.diskpath(tree.name), self.rampath(tree.name))
+            inram = True
+        except (ngrunner.ngCommandError, OSError) as e:
+            print('Workspace: could not move', tree.name, 'to RAM, using it on disk:', e)
+            shutil.rmtree(self.rampath(tree.name), ignore_errors=True)
+            inram = False
+        with self.lock:
+            tree.inram = inram
+            if not inram:
+                self.used -= tree.size
+            tree.moving = False
+            self.moved.notify_all()
+
+    @contextlib.contextmanager
+    def tree(self, name, size=0, keep=False):
+        # Yields the directory of hot tree name for a with block. size is how
+        # many bytes the tree is expected to grow to, keep=True keeps the tree
+        # on disk after the build. A tree is never moved while in use. Trees
+        # are copied between RAM and disk without the workspace lock held, so
+        # other stages can enter and leave their trees meanwhile.
+        disksize = 0
+        if self.ramdir and self.path(name) == self.diskpath(name) and os.path.isdir(self.diskpath(name)):
+            disksize = ngcache.dirsize(self.diskpath(name))     # measured without the lock held
+        victims = []
+        moving = False
+        with self.lock:
+            tree = self.trees.setdefault(name, ngTree(name, keep))
+            tree.keep = tree.keep or keep
+            while tree.moving:
+                self.moved.wait()
+            needed = max(size, disksize)
+            if self.ramdir and not tree.inram and not tree.users and needed <= self.size:
+                victims, fits = self.victims(needed)
+                if fits:
+                    # reserve the budget now, the copies happen without the lock
+                    for victim in victims:
+                        victim.moving = True
+                    tree.moving = moving = True
+                    tree.size = needed
+                    self.used += needed
+                else:
+                    victims = []
+            tree.users += 1
+        try:
+            self.spill(victims)
+            if moving:
+                self.movein(tree)
+            path = self.path(name)
+            os.makedirs(path, exist_ok=True)
+            yield path
+        finally:
+            # measure the tree leaving use, the other trees in RAM keep their size
+            size = ngcache.dirsize(self.rampath(name)) if tree.inram else tree.size
+            with self.lock:
+                tree.users -= 1
+                tree.lastuse = time.time()
+                if tree.inram:
+                    self.used += size - tree.size
+                tree.size = size
+                victims = []
+                if self.ramdir:
+                    victims, fits = self.victims()
+                    for victim in victims:
+                        victim.moving = True
+            self.spill(victims)
+
+    def close(self):
+        # Moves the trees to keep to disk, deletes the others and releases the tmpfs
+        for tree in self.trees.values():
+            if tree.inram:
+                if tree.keep:
+                    self.movetree(self.rampath(tree.name), self.diskpath(tree.name))
+                tree.inram = False
+            if not tree.keep:
+                shutil.rmtree(self.diskpath(tree.name), ignore_errors=True)
+        if self.mounted:
+            ngrunner.run(['umount', self.ramdir], check=False)
+        elif self.ramdir:
+            shutil.rmtree(self.ramdir, ignore_errors=True)
+        self.ramdir = None
+        self.mounted = False
+        self.used = 0
+
+def copyout(source, destination):
+    # Copies a file (keeping it sparse) or directory out of the workspace. The
+    # copy is written next to the destination and renamed over it when complete.
+    import ngimage
+    temp = destination + '.tmp'
+    if os.path.dirname(destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.isdir(source):
+        shutil.rmtree(temp, ignore_errors=True)
+        ngrunner.run(['cp', '-a', source, temp])
+        shutil.rmtree(destination, ignore_errors=True)
+    else:
+        ngimage.createimage(temp, os.path.getsize(source))
+        ngimage.copyinto(temp, source, 0)
+        fd = os.open(temp, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        shutil.copystat(source, temp)
+    os.replace(temp, destination)
+    return destination
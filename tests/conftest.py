@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# conftest.py - shared fixtures of the Armbian-NG tests
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+# The tests run with pytest from the top directory (python3 -m pytest tests),
+# against local servers on the loopback interface: no network, board or root
+# access needed.
+
+import os
+import sys
+import threading
+import http.server
+import socketserver
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class quiethandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class threadedserver(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+@pytest.fixture
+def httpstatuses():
+    # The status codes sent by the httpdir server, in order
+    return []
+
+@pytest.fixture
+def httpdir(tmp_path, httpstatuses):
+    # Serves a directory over HTTP on localhost, yields (directory, base url).
+    # Like most mirrors, it honours 'Range: bytes=<start>-' requests.
+    directory = tmp_path / 'www'
+    directory.mkdir()
+
+    class handler(quiethandler):
+        def __init__(self, *args, **kwargs):
+            quiethandler.__init__(self, *args, directory=str(directory), **kwargs)
+
+        def send_response(self, code, message=None):
+            httpstatuses.append(code)
+            quiethandler.send_response(self, code, message)
+
+        def do_GET(self):
+            path = self.translate_path(self.path)
+            bytesrange = self.headers.get('Range', '')
+            if not bytesrange.startswith('bytes=') or not bytesrange.endswith('-') or not os.path.isfile(path):
+                return quiethandler.do_GET(self)
+            start = int(bytesrange[len('bytes='):-1])
+            with open(path, 'rb') as f:
+                data = f.read()
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */' + str(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes ' + str(start) + '-' + str(len(data) - 1) + '/' + str(len(data)))
+            self.send_header('Content-Length', str(len(data) - start))
+            self.end_headers()
+            self.wfile.write(data[start:])
+
+    server = threadedserver(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield directory, 'http://127.0.0.1:' + str(server.server_address[1]) + '/'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngboards.py - tests of the board catalog and its lookups
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import pytest
+
+import ngboards
+import ngmatrix
+
+@pytest.fixture
+def boards(tmp_path, monkeypatch):
+    # An armbian-build boards directory in the current directory, as build.py sees it
+    monkeypatch.chdir(tmp_path)
+    directory = tmp_path / 'armbian-test' / 'build' / 'config' / 'boards'
+    directory.mkdir(parents=True)
+    for name in ('orangepipc', 'orangepipcplus', 'orangepizero', 'nanopineo'):
+        (directory / (name + '.conf')).write_text('BOARD_NAME="%s"\nBOARDFAMILY="sun8i"\n' % name)
+    ngboards.catalogs.clear()
+    yield ngboards.getcatalog('test')
+    ngboards.catalogs.clear()
+
+def test_prefix(boards):
+    assert [entry['board'] for entry in boards.prefix('OrangePiPC')] == ['orangepipc', 'orangepipcplus']
+    assert boards.prefix('rock') == []
+
+def test_matrix_board_not_found(boards, capsys):
+    with pytest.raises(SystemExit):
+        ngmatrix.buildmatrixpipeline('test', [('orangepipcc', 'current', 'bionic', 'minimal')], None)
+    output = capsys.readouterr().out
+    assert 'Board orangepipcc not found' in output
+    assert 'Did you mean orangepipc' in output
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngcache.py - tests of the build artifact cache
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import threading
+
+import ngcache
+
+def artifact(tmp_path, name, size):
+    path = str(tmp_path / name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+def test_store_lookup(tmp_path):
+    cache = ngcache.ngArtifactCache(str(tmp_path / 'cache'))
+    path = artifact(tmp_path, 'linux-image.deb', 1000)
+    data = open(path, 'rb').read()
+    key = ngcache.inputskey('buildkernel', ('file', path), 'sunxi')
+    cache.store(key, {'kernel-debs': [path]})
+    os.remove(path)
+    assert cache.lookup(key) == {'kernel-debs': [path]}
+    assert open(path, 'rb').read() == data
+    assert cache.lookup(ngcache.inputskey('buildkernel', 'sunxi64')) is None
+
+def test_parallel_stores_evict(tmp_path):
+    # parallel stages storing their outputs in a cache that only fits two entries
+    cache = ngcache.ngArtifactCache(str(tmp_path / 'cache'), maxsize=2 * 100000)
+    errors = []
+
+    def store(i):
+        try:
+            for j in range(10):
+                path = artifact(tmp_path, 'artifact-%d-%d' % (i, j), 100000)
+                cache.store(ngcache.inputskey(i, j), {'files': [path]})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=store, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    entries = [key for prefix in os.listdir(str(tmp_path / 'cache')) if len(prefix) == 2
+               for key in os.listdir(str(tmp_path / 'cache' / prefix))]
+    assert 1 <= len(entries) <= 2
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngcompress.py - tests of the streaming image compressor
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import shutil
+import hashlib
+import threading
+
+import pytest
+
+import ngcompress
+
+needzstd = pytest.mark.skipif(shutil.which('zstd') is None, reason='zstd is not installed')
+
+def makeimage(tmp_path, size=50 * 1024 * 1024):
+    path = str(tmp_path / 'test.img')
+    with open(path, 'wb') as f:
+        for i in range(size // (1024 * 1024)):
+            f.write(os.urandom(512 * 1024) + b'\0' * (512 * 1024))
+    return path
+
+def compress(*args, **kwargs):
+    # compressimage() in a thread, failing the test instead of hanging it
+    result = []
+
+    def run():
+        try:
+            result.append(ngcompress.compressimage(*args, **kwargs))
+        except Exception as e:
+            result.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive(), 'compressimage() is stuck'
+    return result[0]
+
+@needzstd
+def test_compress(tmp_path):
+    image = makeimage(tmp_path, 8 * 1024 * 1024)
+    manifest = compress(image, ('zstd',), {'zstd': 1}, 2)
+    assert manifest['sha256'] == hashlib.sha256(open(image, 'rb').read()).hexdigest()
+    assert manifest['artifacts'][0]['size'] == os.path.getsize(image + '.zst')
+    assert os.path.isfile(image + '.manifest.json')
+
+@needzstd
+def test_output_write_error(tmp_path):
+    # the compressed image cannot be written, as on a full disk
+    if not os.path.exists('/dev/full'):
+        pytest.skip('no /dev/full')
+    image = makeimage(tmp_path)
+    os.symlink('/dev/full', image + '.zst')
+    error = compress(image, ('zstd',), {'zstd': 1}, 1)
+    assert isinstance(error, ngcompress.ngCompressError)
+    assert 'zstd' in str(error)
+    assert not os.path.exists(image + '.manifest.json')
+
+def test_compressor_failure(tmp_path, monkeypatch):
+    monkeypatch.setitem(ngcompress.compressors, 'broken', (['sh', '-c', 'head -c 1000 >/dev/null; exit 2'], '.broken'))
+    monkeypatch.setitem(ngcompress.defaultlevels, 'broken', 1)
+    image = makeimage(tmp_path, 8 * 1024 * 1024)
+    error = compress(image, ('broken',))
+    assert isinstance(error, ngcompress.ngCompressError)
+    assert not os.path.exists(image + '.broken')
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngconfig.py - tests of the configuration file compiler and loader
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import pytest
+
+import ngconfig
+
+def names(assignments):
+    return [name for name, segments in assignments]
+
+def test_compilebash_values():
+    assert ngconfig.compilebash('KERNELDIR="$SRC/linux-${BRANCH}" # comment\n') == \
+        [['KERNELDIR', [['v', 'SRC'], ['s', '/linux-'], ['v', 'BRANCH']]]]
+    assert ngconfig.compilebash("export A='$B'; B=2\n") == [['A', [['s', '$B']]]]
+
+def test_compilebash_blocks():
+    text = '\n'.join(['A=1',
+                      'if [ -n "$X" ]; then', '  IGNORED=1', 'fi',
+                      'for i in 1 2; do', '  IGNORED=2', 'done',
+                      'B=2'])
+    assert names(ngconfig.compilebash(text)) == ['A', 'B']
+
+def test_compilebash_functions():
+    # K&R and Allman style functions, as in armbian family files, followed by assignments
+    text = '\n'.join(['A=1',
+                      'write_uboot_platform()', '{', '\tdd if=$1 of=$2 bs=1k seek=8', '\tIGNORED=1', '}',
+                      'B=2',
+                      'foo() {', ' IGNORED=2', '}',
+                      'C=3',
+                      'function family_tweaks()', '{', '\tif true; then', '\t\tIGNORED=3', '\tfi', '}',
+                      'D=4',
+                      'bar() { IGNORED=4; }',
+                      'E=5'])
+    assert names(ngconfig.compilebash(text)) == ['A', 'B', 'C', 'D', 'E']
+
+familyfile = '\n'.join(['BOOTSOURCE=$MAINLINE_UBOOT_SOURCE',
+                        'case $BRANCH in',
+                        '\tlegacy)', '\tKERNELBRANCH="branch:linux-4.19.y"',
+                        '\tif true; then', '\t\tIGNORED=1', '\tfi', '\t;;',
+                        '\tcurrent|dev)', "\tKERNELBRANCH='branch:linux-5.1.y'", '\t;;',
+                        '\t*) KERNELBRANCH="branch:master" ;;',
+                        'esac',
+                        'LINUXFAMILY=sunxi'])
+
+def test_compilebash_case():
+    assert ngconfig.compilebash(familyfile) == \
+        [['BOOTSOURCE', [['v', 'MAINLINE_UBOOT_SOURCE']]],
+         ['KERNELBRANCH', [['s', 'branch:linux-4.19.y']], ['BRANCH', ['legacy'], []]],
+         ['KERNELBRANCH', [['s', 'branch:linux-5.1.y']], ['BRANCH', ['current', 'dev'], ['legacy']]],
+         ['KERNELBRANCH', [['s', 'branch:master']], ['BRANCH', ['*'], ['legacy', 'current', 'dev']]],
+         ['LINUXFAMILY', [['s', 'sunxi']]]]
+
+def test_compileng():
+    text = '# This is an Armbian-NG configuration file\n[build]\nboard = orangepipc\n[distcc]\npool = ${build:board}\n'
+    assert ngconfig.compileng(text) == [['BOARD', [['s', 'orangepipc']]], ['DISTCC_POOL', [['r', 'BOARD']]]]
+
+def layer(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+ngheader = '# This is an Armbian-NG configuration file\n'
+
+def test_loadconfig_bash_references_in_order(tmp_path):
+    path = layer(tmp_path, 'board.conf', 'A="x${B}"\nB=2\nC="${B}3"\n')
+    config = ngconfig.loadconfig([path], str(tmp_path / 'cache'))
+    assert (config['A'], config['C']) == ('x', '23')
+
+def test_loadconfig_ng_forward_references(tmp_path):
+    family = layer(tmp_path, 'family.conf', 'BOARDFAMILY="sunxi"\nHOST=buildbox\n')
+    user = layer(tmp_path, 'user.conf', ngheader + '[build]\ny = ${Z}/${BOARDFAMILY}\nz = ${distcc:pool}\n'
+                                        '[distcc]\npool = ${HOST}/8\n')
+    config = ngconfig.loadconfig([family, user], str(tmp_path / 'cache'))
+    assert config['Y'] == 'buildbox/8/sunxi'
+    assert config['DISTCC_POOL'] == ['buildbox/8']
+
+def test_loadconfig_ng_reference_to_later_layer(tmp_path):
+    first = layer(tmp_path, 'first.conf', ngheader + '[build]\nrelease = ${LATER}\n')
+    second = layer(tmp_path, 'second.conf', 'LATER=bionic\n')
+    assert ngconfig.loadconfig([first, second], str(tmp_path / 'cache'))['RELEASE'] == 'bionic'
+
+def test_loadconfig_ng_undefined_reference(tmp_path, capsys):
+    path = layer(tmp_path, 'user.conf', ngheader + '[build]\nrelease = ${NOWHERE_SET}\n')
+    with pytest.raises(SystemExit):
+        ngconfig.loadconfig([path], str(tmp_path / 'cache'))
+    assert 'NOWHERE_SET' in capsys.readouterr().out
+
+def test_loadconfig_ng_cycle(tmp_path, capsys):
+    path = layer(tmp_path, 'user.conf', ngheader + '[build]\na = ${B}\nb = ${A}\n')
+    with pytest.raises(SystemExit):
+        ngconfig.loadconfig([path], str(tmp_path / 'cache'))
+    assert 'refers to itself' in capsys.readouterr().out
+
+def test_loadconfig_case_selects_branch(tmp_path):
+    path = layer(tmp_path, 'sunxi.conf', familyfile)
+    for branch, kernelbranch in (('legacy', 'branch:linux-4.19.y'), ('dev', 'branch:linux-5.1.y'),
+                                 ('next', 'branch:master')):
+        config = ngconfig.loadconfig([path], str(tmp_path / 'cache'), variables={'BRANCH': branch})
+        assert config['KERNELBRANCH'] == kernelbranch
+    assert ngconfig.loadconfig([path], str(tmp_path / 'cache'))['KERNELBRANCH'] == 'branch:master'
+
+def test_convert_auto():
+    for name in ('MAKE_JOBS', 'COMPRESS_THREADS', 'PARALLEL_STAGES', 'TMPFS_SIZE'):
+        assert ngconfig.convert(name, 'auto') == ngconfig.convert(name, 'AUTO') == 0
+    assert ngconfig.convert('MAKE_JOBS', '8') == 8
+    with pytest.raises(ValueError):
+        ngconfig.convert('XZ_LEVEL', 'auto')
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngdistcc.py - tests of the distcc pool probing against loopback listeners
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import socket
+import threading
+
+import pytest
+
+import ngdistcc
+
+def listener():
+    # A socket accepting connections on a free loopback port, as distccd would
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    s.listen(8)
+    return s
+
+def statsserver(reply):
+    # A distccd --stats lookalike answering every connection with reply
+    s = listener()
+
+    def serve():
+        while True:
+            try:
+                connection, address = s.accept()
+            except OSError:
+                return
+            with connection:
+                connection.recv(4096)
+                connection.sendall(reply)
+
+    threading.Thread(target=serve, daemon=True).start()
+    return s
+
+def freeport():
+    s = listener()
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+@pytest.fixture
+def distccd():
+    s = listener()
+    yield s.getsockname()[1]
+    s.close()
+
+def test_parsehost():
+    assert ngdistcc.parsehost('buildbox') == ('buildbox', ngdistcc.distccport, None)
+    assert ngdistcc.parsehost('buildbox:3700/8') == ('buildbox', 3700, 8)
+    assert ngdistcc.parsehost('192.168.1.21/4') == ('192.168.1.21', ngdistcc.distccport, 4)
+    for entry in ('buildbox/four', 'buildbox:port', 'buildbox/0', ':3632', 'buildbox:70000'):
+        with pytest.raises(ValueError):
+            ngdistcc.parsehost(entry)
+
+def test_probehost_cores_given(distccd):
+    assert ngdistcc.probehost('127.0.0.1:%d/6' % distccd, freeport()) == ('127.0.0.1', distccd, 6)
+
+def test_probehost_cores_from_stats(distccd):
+    stats = statsserver(b'HTTP/1.0 200 OK\r\n\r\nargv /usr/bin/distccd\ndcc_max_kids 12\n')
+    try:
+        assert ngdistcc.probehost('127.0.0.1:%d' % distccd, stats.getsockname()[1]) == ('127.0.0.1', distccd, 12)
+    finally:
+        stats.close()
+
+def test_probehost_malformed_stats(distccd):
+    stats = statsserver(b'HTTP/1.0 200 OK\r\n\r\ndcc_max_kids many\n')
+    try:
+        assert ngdistcc.probehost('127.0.0.1:%d' % distccd, stats.getsockname()[1])[2] == ngdistcc.defaultcores
+    finally:
+        stats.close()
+
+def test_probehost_down_or_malformed(capsys):
+    assert ngdistcc.probehost('127.0.0.1:%d/4' % freeport()) is None
+    assert ngdistcc.probehost('127.0.0.1/lots') is None
+    assert 'Ignoring distcc pool entry' in capsys.readouterr().out
+
+def test_compileplan(distccd):
+    other = listener()
+    try:
+        pool = ['127.0.0.1:%d/2' % distccd, '127.0.0.1:%d/8' % other.getsockname()[1],
+                '127.0.0.1:%d/16' % freeport(), 'bad/entry']
+        hosts, jobs = ngdistcc.compileplan(pool, 4, freeport())
+        assert hosts == '127.0.0.1:%d/8 127.0.0.1:%d/2 localhost/2' % (other.getsockname()[1], distccd)
+        assert jobs == 8 + 2 + 4
+    finally:
+        other.close()
+
+def test_compileplan_no_host():
+    assert ngdistcc.compileplan(['127.0.0.1:%d' % freeport()], 3, freeport()) == (None, 3)
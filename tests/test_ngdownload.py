@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngdownload.py - tests of the downloader against a local HTTP server
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import hashlib
+import threading
+
+import pytest
+
+import ngdownload
+
+def publish(directory, name, size):
+    data = os.urandom(size)
+    (directory / name).write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+def test_download_verifies(httpdir, tmp_path):
+    directory, url = httpdir
+    sha256 = publish(directory, 'file.bin', 100000)
+    path = str(tmp_path / 'out' / 'file.bin')
+    assert ngdownload.download(url + 'file.bin', path, sha256, 100000) == path
+    assert hashlib.sha256(open(path, 'rb').read()).hexdigest() == sha256
+    assert not os.path.exists(path + '.part')
+
+def test_download_mismatch(httpdir, tmp_path):
+    directory, url = httpdir
+    publish(directory, 'file.bin', 1000)
+    path = str(tmp_path / 'file.bin')
+    with pytest.raises(ngdownload.ngDownloadError):
+        ngdownload.download(url + 'file.bin', path, '0' * 64, retries=1)
+    assert not os.path.exists(path)
+
+def test_download_resumes_part(httpdir, httpstatuses, tmp_path):
+    directory, url = httpdir
+    sha256 = publish(directory, 'file.bin', 50000)
+    path = str(tmp_path / 'file.bin')
+    with open(path + '.part', 'wb') as f:
+        f.write((directory / 'file.bin').read_bytes()[:20000])
+    ngdownload.download(url + 'file.bin', path, sha256, 50000)
+    assert httpstatuses == [206]
+    assert hashlib.sha256(open(path, 'rb').read()).hexdigest() == sha256
+
+def test_download_complete_part(httpdir, httpstatuses, tmp_path):
+    # interrupted between the last block and the rename, size unknown
+    directory, url = httpdir
+    sha256 = publish(directory, 'file.bin', 50000)
+    path = str(tmp_path / 'file.bin')
+    (tmp_path / 'file.bin.part').write_bytes((directory / 'file.bin').read_bytes())
+    assert ngdownload.download(url + 'file.bin', path, sha256, retries=1) == path
+    assert httpstatuses == [416]
+    assert hashlib.sha256(open(path, 'rb').read()).hexdigest() == sha256
+
+def test_download_stale_part(httpdir, httpstatuses, tmp_path):
+    # the .part is longer than the file now on the server
+    directory, url = httpdir
+    sha256 = publish(directory, 'file.bin', 50000)
+    path = str(tmp_path / 'file.bin')
+    (tmp_path / 'file.bin.part').write_bytes(b'x' * 60000)
+    ngdownload.download(url + 'file.bin', path)
+    assert httpstatuses == [416, 200]
+    assert hashlib.sha256(open(path, 'rb').read()).hexdigest() == sha256
+
+def test_fetchall_reports_failures(httpdir, tmp_path):
+    directory, url = httpdir
+    sha256 = publish(directory, 'a.bin', 1000)
+    items = [(url + 'a.bin', str(tmp_path / 'a.bin'), sha256, 1000),
+             (url + 'missing.bin', str(tmp_path / 'missing.bin'), None, None)]
+    failed = ngdownload.fetchall(items, 2)
+    assert [u for u, e in failed] == [url + 'missing.bin']
+    assert os.path.isfile(str(tmp_path / 'a.bin'))
+
+def test_concurrent_fetchall_same_path(httpdir, tmp_path):
+    # e.g. two image types of a build matrix prefetching the same package
+    directory, url = httpdir
+    size = 8 * 1024 * 1024
+    sha256 = publish(directory, 'big.bin', size)
+    path = str(tmp_path / 'big.bin')
+    results = []
+
+    def fetch():
+        results.append(ngdownload.fetchall([(url + 'big.bin', path, sha256, size)], 2))
+
+    threads = [threading.Thread(target=fetch) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [[]] * 4
+    assert hashlib.sha256(open(path, 'rb').read()).hexdigest() == sha256
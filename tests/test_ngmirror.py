@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngmirror.py - tests of the armbian-build mirror against a local repository
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import subprocess
+
+import pytest
+
+import ngmirror
+
+def git(*args):
+    return subprocess.run(['git', '-c', 'user.name=Test', '-c', 'user.email=test@example.com'] + list(args),
+                          check=True, stdout=subprocess.PIPE).stdout.decode().strip()
+
+def commit(repo, name, text):
+    with open(os.path.join(repo, name), 'w') as f:
+        f.write(text)
+    git('-C', repo, 'add', name)
+    git('-C', repo, 'commit', '--quiet', '-m', name + ' ' + text)
+    return git('-C', repo, 'rev-parse', 'HEAD')
+
+@pytest.fixture
+def upstream(tmp_path):
+    # An armbian-build lookalike with master and next branches, yields its file:// url
+    repo = str(tmp_path / 'upstream')
+    git('init', '--quiet', repo)
+    git('-C', repo, 'checkout', '--quiet', '-b', 'master')
+    commit(repo, 'compile.sh', 'master 1')
+    git('-C', repo, 'checkout', '--quiet', '-b', 'next')
+    commit(repo, 'compile.sh', 'next 1')
+    git('-C', repo, 'checkout', '--quiet', 'master')
+    yield repo, 'file://' + repo
+
+def head(repo, branch):
+    return git('-C', repo, 'rev-parse', branch)
+
+def test_fresh_checkout(upstream, tmp_path):
+    repo, url = upstream
+    mirror = str(tmp_path / 'cache' / 'armbian-build.git')
+    workdir = str(tmp_path / 'armbian-master' / 'build')
+    assert ngmirror.checkoutbranch('master', workdir, mirror, url) == head(repo, 'master')
+    assert open(os.path.join(workdir, 'compile.sh')).read() == 'master 1'
+    assert ngmirror.readpins(mirror) == {'master': head(repo, 'master')}
+
+def test_branches_share_the_mirror(upstream, tmp_path):
+    repo, url = upstream
+    mirror = str(tmp_path / 'armbian-build.git')
+    ngmirror.checkoutbranch('master', str(tmp_path / 'armbian-master' / 'build'), mirror, url)
+    workdir = str(tmp_path / 'armbian-next' / 'build')
+    assert ngmirror.checkoutbranch('next', workdir, mirror, url) == head(repo, 'next')
+    assert open(os.path.join(workdir, 'compile.sh')).read() == 'next 1'
+    assert len(git('--git-dir=' + mirror, 'worktree', 'list').splitlines()) == 3     # the mirror and two branches
+
+def test_refresh(upstream, tmp_path):
+    repo, url = upstream
+    mirror = str(tmp_path / 'armbian-build.git')
+    workdir = str(tmp_path / 'armbian-master' / 'build')
+    ngmirror.checkoutbranch('master', workdir, mirror, url)
+    latest = commit(repo, 'compile.sh', 'master 2')
+    assert ngmirror.checkoutbranch('master', workdir, mirror, url) == latest
+    assert open(os.path.join(workdir, 'compile.sh')).read() == 'master 2'
+
+def test_offline_uses_pinned_commit(upstream, tmp_path, capsys):
+    repo, url = upstream
+    mirror = str(tmp_path / 'armbian-build.git')
+    workdir = str(tmp_path / 'armbian-master' / 'build')
+    pinned = ngmirror.checkoutbranch('master', workdir, mirror, url)
+    offline = 'file://' + str(tmp_path / 'nowhere')
+    assert ngmirror.checkoutbranch('master', workdir, mirror, offline) == pinned
+    assert 'using previously checked out commit' in capsys.readouterr().out
+    assert ngmirror.checkoutbranch('next', str(tmp_path / 'armbian-next' / 'build'), mirror, offline) is None
+
+def test_standalone_clone_updated_in_place(upstream, tmp_path):
+    # checkouts made before the mirror existed are full clones
+    repo, url = upstream
+    workdir = str(tmp_path / 'armbian-master' / 'build')
+    git('clone', '--quiet', url, workdir)
+    latest = commit(repo, 'compile.sh', 'master 2')
+    assert ngmirror.checkoutbranch('master', workdir, str(tmp_path / 'armbian-build.git'), url) == latest
+    assert head(workdir, 'HEAD') == latest
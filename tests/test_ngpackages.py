@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngpackages.py - tests of the package cache against a local archive mirror
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import gzip
+import hashlib
+import threading
+import urllib.request
+
+import pytest
+
+import ngpackages
+
+def makearchive(directory, suite='bionic', components=('main', 'universe')):
+    # Writes a small archive: every image type package, a required package
+    # depending on a virtual package, and an unrelated package never fetched
+    names = ['base-files', 'libc6', 'unrelated']
+    for package in ngpackages.imagepackages['desktop']:
+        names.append(package.split('|')[0])
+    lines = {}
+    for i, name in enumerate(names):
+        data = os.urandom(2000 + i)
+        filename = 'pool/main/' + name[0] + '/' + name + '/' + name + '_1.0_arm64.deb'
+        os.makedirs(os.path.dirname(str(directory / filename)), exist_ok=True)
+        (directory / filename).write_bytes(data)
+        stanza = ['Package: ' + name, 'Version: 1.0', 'Architecture: arm64', 'Filename: ' + filename,
+                  'Size: ' + str(len(data)), 'SHA256: ' + hashlib.sha256(data).hexdigest()]
+        if name == 'base-files':
+            stanza += ['Priority: required', 'Depends: libc-virtual (>= 2.0) | nothing']
+        if name == 'libc6':
+            stanza += ['Priority: optional', 'Provides: libc-virtual']
+        component = components[i % len(components)]
+        lines.setdefault(component, []).append('\n'.join(stanza) + '\n')
+    release = ['Origin: Test', 'Suite: ' + suite, 'SHA256:']
+    for component in components:
+        index = component + '/binary-arm64/Packages.gz'
+        os.makedirs(str(directory / 'dists' / suite / component / 'binary-arm64'), exist_ok=True)
+        data = gzip.compress('\n'.join(lines.get(component, [])).encode())
+        (directory / 'dists' / suite / index).write_bytes(data)
+        release.append(' ' + hashlib.sha256(data).hexdigest() + ' ' + str(len(data)) + ' ' + index)
+    (directory / 'dists' / suite / 'Release').write_text('\n'.join(release) + '\n')
+    return names
+
+def test_prefetch_and_serve(httpdir, tmp_path):
+    directory, url = httpdir
+    makearchive(directory)
+    cachedir = str(tmp_path / 'cache')
+    config = {'UBUNTU_MIRROR': url}
+    result = ngpackages.prefetch('bionic', 'minimal', config, cachedir, 4)
+    assert result['downloaded'] == result['packages']
+    base = result['mirrordir']
+    assert os.path.isfile(os.path.join(base, 'pool/main/l/libc6/libc6_1.0_arm64.deb'))
+    assert not os.path.exists(os.path.join(base, 'pool/main/u/unrelated'))
+    assert os.path.isfile(os.path.join(base, 'dists/bionic/main/binary-arm64/Packages.gz'))
+
+    # a second build downloads nothing, and installs from the local mirror
+    assert ngpackages.prefetch('bionic', 'minimal', config, cachedir, 4)['downloaded'] == 0
+    with ngpackages.localmirror(base) as mirror:
+        with urllib.request.urlopen(mirror + 'dists/bionic/Release') as response:
+            assert response.read() == (directory / 'dists/bionic/Release').read_bytes()
+
+def test_prefetch_offline_uses_cached_indices(httpdir, tmp_path):
+    directory, url = httpdir
+    makearchive(directory)
+    cachedir = str(tmp_path / 'cache')
+    ngpackages.prefetch('bionic', 'minimal', {'UBUNTU_MIRROR': url}, cachedir, 4)
+    os.rename(str(directory / 'dists'), str(directory / 'gone'))
+    result = ngpackages.prefetch('bionic', 'minimal', {'UBUNTU_MIRROR': url}, cachedir, 4)
+    assert result['downloaded'] == 0
+
+def test_prefetch_missing_release(httpdir, tmp_path):
+    directory, url = httpdir
+    with pytest.raises(ngpackages.ngdownload.ngDownloadError):
+        ngpackages.prefetch('bionic', 'minimal', {'UBUNTU_MIRROR': url}, str(tmp_path / 'cache'), 4)
+
+def test_concurrent_image_types(httpdir, tmp_path):
+    # the prefetch stages of two image types of a build matrix share the suite
+    # indices and most packages, and run at the same time
+    directory, url = httpdir
+    makearchive(directory)
+    cachedir = str(tmp_path / 'cache')
+    results = {}
+
+    def prefetch(imagetype):
+        try:
+            results[imagetype] = ngpackages.prefetch('bionic', imagetype, {'UBUNTU_MIRROR': url}, cachedir, 4)
+        except Exception as e:
+            results[imagetype] = e
+
+    threads = [threading.Thread(target=prefetch, args=(imagetype,)) for imagetype in ('minimal', 'desktop')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert isinstance(results['minimal'], dict), results['minimal']
+    assert isinstance(results['desktop'], dict), results['desktop']
+    assert ngpackages.prefetch('bionic', 'desktop', {'UBUNTU_MIRROR': url}, cachedir, 4)['downloaded'] == 0
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngrunner.py - tests of the command runner
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import sys
+import threading
+
+import pytest
+
+import ngrunner
+
+def test_run_main_thread():
+    # build.py runs git, mount... from the main thread before the stages start
+    assert threading.current_thread() is threading.main_thread()
+    assert ngrunner.run(['echo', 'hi'], capture=True).stdout == 'hi'
+
+def test_run_before_python38(monkeypatch):
+    # a new event loop has no child watcher before Python 3.8, on any thread
+    def noloop(coroutine):
+        coroutine.close()
+        raise RuntimeError('Cannot add child handler, the child watcher does not have a loop attached')
+    monkeypatch.setattr(sys, 'version_info', (3, 7, 16))
+    monkeypatch.setattr(ngrunner, 'runloop', noloop)
+    assert ngrunner.run(['echo', 'hi'], capture=True).stdout == 'hi'
+
+def test_run_stage_thread():
+    results = []
+    thread = threading.Thread(target=lambda: results.append(ngrunner.run(['echo', 'hi'], capture=True).stdout))
+    thread.start()
+    thread.join()
+    assert results == ['hi']
+
+def test_run_failure_tail():
+    with pytest.raises(ngrunner.ngCommandError) as error:
+        ngrunner.run(['sh', '-c', 'echo one; echo two >&2; exit 3'])
+    assert error.value.returncode == 3
+    assert sorted(error.value.tail) == ['one', 'two']     # stdout and stderr, read at the same time
+    assert ngrunner.run(['sh', '-c', 'exit 3'], check=False).returncode == 3
+
+def test_run_timeout():
+    with pytest.raises(ngrunner.ngCommandError) as error:
+        ngrunner.run(['sleep', '10'], timeout=0.5)
+    assert error.value.timedout
+
+def test_runthreaded():
+    result, tail = ngrunner.runthreaded(['echo', 'hi'], capture=True)
+    assert result.stdout == 'hi' and list(tail) == ['hi']
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason='asyncio child processes need Python 3.8')
+def test_runasync():
+    result, tail = ngrunner.runloop(ngrunner.runasync(['echo', 'hi'], capture=True))
+    assert result.stdout == 'hi' and list(tail) == ['hi']
+
+def test_runmany():
+    results = ngrunner.runmany([('a', ['echo', 'a']), ('b', ['echo', 'b'])])
+    assert [r.returncode for r in results] == [0, 0]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngsources.py - tests of the kernel and u-boot source cache against a local repository
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import time
+
+import ngsources
+from test_ngmirror import git, commit
+
+def test_fetch_and_prune(tmp_path):
+    repo = str(tmp_path / 'linux')
+    git('init', '--quiet', repo)
+    git('-C', repo, 'checkout', '--quiet', '-b', 'master')
+    commits = [commit(repo, 'Makefile', 'version ' + str(i)) for i in range(3)]
+    url = 'file://' + repo
+    cachedir = str(tmp_path / 'sources')
+    fetchers = []
+    for i, sha1 in enumerate(commits):
+        fetcher = ngsources.ngSourceFetcher(2, cachedir, keeptrees=2)     # one build per commit
+        result = fetcher.result(('git', url, 'commit:' + sha1, None))
+        fetcher.close()
+        fetchers.append(fetcher)
+        assert open(os.path.join(result['path'], 'Makefile')).read() == 'version ' + str(i)
+        time.sleep(0.01)
+    trees = sorted(os.listdir(os.path.join(cachedir, 'trees')))
+    assert [tree[-12:] for tree in trees] == sorted(sha1[:12] for sha1 in commits[1:])
+    bare = os.path.join(cachedir, 'git', ngsources.cachename(url) + '.git')
+    refs = git('--git-dir=' + bare, 'for-each-ref', '--format=%(refname)', 'refs/ng/').split()
+    assert sorted(refs) == sorted('refs/ng/' + sha1 for sha1 in commits[1:])
+    assert len(git('--git-dir=' + bare, 'worktree', 'list').splitlines()) == 3
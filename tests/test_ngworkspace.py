@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2019 AndrewBCN Andre Derrick Balsa (andrebalsa@gmail.com)
+#
+# This file is licensed under the terms of the GNU General Public
+# License version 3. This program is licensed "as is" without any
+# warranty of any kind, whether express or implied.
+#
+# test_ngworkspace.py - tests of the build workspace, on disk
+#
+# This file is a part of the Armbian-NG project
+# https://github.com/AndrewBCN/Armbian-NG
+
+import os
+import subprocess
+
+import ngworkspace
+
+def deadpid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+def test_removestale(tmp_path, monkeypatch):
+    monkeypatch.setattr(ngworkspace, 'shmdir', str(tmp_path / 'shm'))
+    stale = tmp_path / 'shm' / ('armbian-ng-' + str(deadpid()))
+    running = tmp_path / 'shm' / ('armbian-ng-' + str(os.getpid()))
+    for path in (stale, running):
+        (path / 'kernel-sunxi-current').mkdir(parents=True)
+    workspace = ngworkspace.ngWorkspace(str(tmp_path / 'work'))
+    assert workspace.removestale(str(tmp_path / 'work' / 'tmpfs'))
+    assert not stale.exists()
+    assert running.exists()
+
+def test_tree_on_disk(tmp_path):
+    workspace = ngworkspace.ngWorkspace(str(tmp_path / 'work'))
+    workspace.open()
+    with workspace.tree('kernel-sunxi-current', keep=True) as tree:
+        open(os.path.join(tree, '.config'), 'w').close()
+    with workspace.tree('rootfs') as tree:
+        assert tree == str(tmp_path / 'work' / 'rootfs')
+    workspace.close()
+    assert sorted(os.listdir(str(tmp_path / 'work'))) == ['kernel-sunxi-current']